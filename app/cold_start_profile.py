@@ -0,0 +1,328 @@
+"""
+Cold-start profiling harness.
+
+Starts the app in fresh interpreters with every external service stubbed
+(Firebase, the Cloud SQL connector, Stripe, Gmail), records what `import
+main` spends per module (`python -X importtime`, parsed and ranked) and the
+time to first byte of a few requests, and writes the results as JSON:
+
+    cd app
+    python cold_start_profile.py --output cold_start.json
+    python cold_start_profile.py --baseline cold_start.json --threshold 0.25
+
+With --baseline it exits with status 1 if import time or any request got
+more than `threshold` slower (and by more than --min-delta-ms), so a change
+to main.py that makes App Engine cold starts worse shows up before deploy.
+
+The SDKs are still really imported, so their import cost is measured; only
+the calls that would reach the network or need credentials are replaced,
+through an import hook that patches each module right after it loads.
+Requests that read the database need --database-url pointing at a local
+PostgreSQL; without one they fail fast and are reported with their status.
+"""
+# Only what the child needs before `import main`, so that everything the app
+# imports is attributed to main in the importtime output
+import importlib.abc
+import json
+import os
+import sys
+import time
+
+
+PROFILE_TOKEN = 'cold-start-profile-token'
+PROJECT_ID = 'cold-start-profile'
+DEFAULT_PATHS = ['/', '/api/events', '/api/admin/requests']
+
+
+# --- Stubs (used in the child process) ---------------------------------------
+
+class StubConnector:
+    """Stands in for google.cloud.sql.connector.Connector"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def connect(self, *args, **kwargs):
+        raise RuntimeError("Cloud SQL is stubbed while profiling; pass --database-url")
+
+    def close(self):
+        pass
+
+
+class StubGmail:
+    """Stands in for the Gmail client: any call chain ends in execute() -> {}"""
+
+    def __getattr__(self, name):
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def execute(self):
+        return {}
+
+
+def patch_firebase_admin(module):
+    app = type('StubApp', (), {'name': '[DEFAULT]', 'project_id': PROJECT_ID})()
+
+    def initialize_app(credential=None, options=None, name='[DEFAULT]'):
+        module._apps[name] = app
+        return app
+
+    module.initialize_app = initialize_app
+    module.get_app = lambda name='[DEFAULT]': module._apps[name]
+
+
+def patch_credentials(module):
+    module.Certificate = lambda *args, **kwargs: None
+
+
+def patch_auth(module):
+    def verify_id_token(id_token, app=None, check_revoked=False, clock_skew_seconds=0):
+        if id_token != PROFILE_TOKEN:
+            raise module.InvalidIdTokenError("Stubbed token check: unknown token")
+        return {'uid': 'cold-start-profile', 'email': os.environ['PROFILE_ADMIN_EMAIL'],
+                'exp': time.time() + 3600}
+
+    module.verify_id_token = verify_id_token
+
+
+def patch_connector(module):
+    module.Connector = StubConnector
+
+
+def patch_stripe(module):
+    module.api_key = 'sk_test_cold_start_profile'
+
+
+def patch_discovery(module):
+    module.build = lambda *args, **kwargs: StubGmail()
+
+
+PATCHES = {
+    'firebase_admin': patch_firebase_admin,
+    'firebase_admin.credentials': patch_credentials,
+    'firebase_admin.auth': patch_auth,
+    'google.cloud.sql.connector': patch_connector,
+    'stripe': patch_stripe,
+    'googleapiclient.discovery': patch_discovery,
+}
+
+
+class PatchingLoader(importlib.abc.Loader):
+    """Runs the real loader, then the patch for that module"""
+
+    def __init__(self, loader, patch):
+        self.loader = loader
+        self.patch = patch
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        self.patch(module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class PatchingFinder(importlib.abc.MetaPathFinder):
+    """Finds the modules in PATCHES the normal way but loads them through PatchingLoader"""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in PATCHES:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                spec.loader = PatchingLoader(spec.loader, PATCHES[fullname])
+                return spec
+        return None
+
+
+def child(paths):
+    """Import main with the stubs in place and time each request; prints JSON"""
+    sys.meta_path.insert(0, PatchingFinder())
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    import inspect
+
+    client = main.app.test_client()
+    # The signature changed in Werkzeug 2.3
+    if 'server_name' in inspect.signature(client.set_cookie).parameters:
+        client.set_cookie('localhost', 'firebaseToken', PROFILE_TOKEN)
+    else:
+        client.set_cookie('firebaseToken', PROFILE_TOKEN)
+    requests = []
+    for path in paths:
+        timings = []
+        for _ in range(2):  # cold, then warm
+            request_started = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - request_started)
+        requests.append({"path": path, "status": response.status_code,
+                         "first_ms": timings[0] * 1000, "second_ms": timings[1] * 1000})
+
+    print(json.dumps({"import_main_ms": (imported - started) * 1000, "requests": requests}))
+
+
+# --- Harness (parent process) --------------------------------------------------
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output into (modules imported by `import main`,
+    top-level imports made afterwards, i.e. deferred to the first requests).
+    Each entry is {"module", "self_ms", "cumulative_ms", "depth"}.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000, "depth": depth})
+
+    # importtime prints children before their parent
+    main_index = next((i for i, entry in enumerate(entries)
+                       if entry['module'] == 'main' and entry['depth'] == 0), None)
+    if main_index is None:
+        return [], []
+    start = main_index
+    while start > 0 and entries[start - 1]['depth'] > 0:
+        start -= 1
+    deferred = [entry for entry in entries[main_index + 1:] if entry['depth'] == 0]
+    return entries[start:main_index + 1], deferred
+
+
+def run_child(args):
+    import subprocess
+
+    env = dict(os.environ, PROFILE_ADMIN_EMAIL=args.admin_email)
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    else:
+        env.pop('DATABASE_URL', None)
+        for key in ('INSTANCE_CONNECTION_NAME', 'DB_USER', 'DB_PASS', 'DB_NAME'):
+            env.setdefault(key, 'stub')
+
+    command = [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', *args.paths]
+    result = subprocess.run(command, capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        print(result.stderr[-4000:])
+        raise SystemExit(f"Profiling run failed with exit code {result.returncode}")
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    measured['modules'], measured['deferred'] = parse_importtime(result.stderr)
+    return measured
+
+
+def median(values):
+    import statistics
+    return statistics.median(values)
+
+
+def combine(runs, top):
+    """Median of each measurement over the runs, modules ranked by cost"""
+    modules = {}
+    for run in runs:
+        for entry in run['modules']:
+            modules.setdefault(entry['module'], []).append(entry)
+
+    def ranked(key):
+        rows = [{"module": name, "self_ms": round(median([e['self_ms'] for e in entries]), 2),
+                 "cumulative_ms": round(median([e['cumulative_ms'] for e in entries]), 2)}
+                for name, entries in modules.items() if name != 'main']
+        return sorted(rows, key=lambda row: row[key], reverse=True)[:top]
+
+    requests = []
+    for i, request in enumerate(runs[0]['requests']):
+        requests.append({
+            "path": request['path'],
+            "status": request['status'],
+            "first_ms": round(median([run['requests'][i]['first_ms'] for run in runs]), 2),
+            "second_ms": round(median([run['requests'][i]['second_ms'] for run in runs]), 2),
+        })
+
+    return {
+        "python": sys.version.split()[0],
+        "runs": len(runs),
+        "import_main_ms": round(median([run['import_main_ms'] for run in runs]), 2),
+        "requests": requests,
+        "top_cumulative": ranked('cumulative_ms'),
+        "top_self": ranked('self_ms'),
+        "deferred_imports": sorted(({"module": e['module'], "cumulative_ms": e['cumulative_ms']}
+                                    for e in runs[-1]['deferred']),
+                                   key=lambda row: row['cumulative_ms'], reverse=True)[:top],
+    }
+
+
+def regressions(result, baseline, threshold, min_delta_ms):
+    """Measurements more than `threshold` (a fraction) and `min_delta_ms` over the baseline"""
+    current = {"import main": result['import_main_ms']}
+    previous = {"import main": baseline.get('import_main_ms')}
+    for request in result['requests']:
+        current[f"GET {request['path']}"] = request['first_ms']
+    for request in baseline.get('requests', []):
+        previous[f"GET {request['path']}"] = request['first_ms']
+
+    found = []
+    for name, value in current.items():
+        before = previous.get(name)
+        if before is not None and value > before * (1 + threshold) and value - before > min_delta_ms:
+            found.append(f"{name}: {before:.1f} ms -> {value:.1f} ms")
+    return found
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile import main and first requests with services stubbed")
+    parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS, help="GET paths to time")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=25, help="modules to list")
+    parser.add_argument('--database-url', help="local PostgreSQL for requests that read the database")
+    parser.add_argument('--admin-email', default='admin@example.com',
+                        help="email the stubbed token carries (must be in public.admin for admin paths)")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    parser.add_argument('--baseline', help="earlier JSON output to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown, as a fraction")
+    parser.add_argument('--min-delta-ms', type=float, default=20.0, help="ignore slowdowns smaller than this")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.paths)
+        return
+
+    result = combine([run_child(args) for _ in range(args.runs)], args.top)
+    for request in result['requests']:
+        if request['status'] >= 400:
+            print(f"Warning: GET {request['path']} returned {request['status']}", file=sys.stderr)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"import main {result['import_main_ms']:.1f} ms; wrote {args.output}")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(result, baseline, args.threshold, args.min_delta_ms)
+        if found:
+            print("Cold start regressions:", file=sys.stderr)
+            for line in found:
+                print(f"  {line}", file=sys.stderr)
+            raise SystemExit(1)
+        print(f"No regressions over {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == '__main__':
+    main()
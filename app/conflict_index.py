@@ -0,0 +1,244 @@
+"""
+In-process index of the bookings that block the rink (approved/admin rental
+requests and admin events), used by the conflict checks so that a check only
+looks at bookings whose date range overlaps the proposed one.
+"""
+import os
+import threading
+import time
+
+from recurrence import Recurrence
+
+
+# Bookings that always fall on the same weekday (weekly and biweekly rules,
+# single-day bookings) live in one bucket per weekday, everything else goes
+# in 'any'.
+ANY_BUCKET = 'any'
+WEEKDAY_BUCKETS = tuple(range(7))
+
+
+class Booking:
+    """A booking (or a proposed booking) as seen by the conflict checks"""
+
+    __slots__ = ('source', 'booking_id', 'name', 'start_date', 'end_date',
+                 'start_time', 'end_time', 'is_recurring', 'recurrence_rule', 'status',
+                 'recurrence')
+
+    def __init__(self, source, booking_id, name, start_date, end_date, start_time,
+                 end_time, is_recurring, recurrence_rule=None, status=None):
+        self.source = source  # 'rental', 'admin' or None for a proposal
+        self.booking_id = booking_id
+        self.name = name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.start_time = start_time
+        self.end_time = end_time
+        self.is_recurring = bool(is_recurring)
+        self.recurrence_rule = recurrence_rule if is_recurring else None
+        self.status = status
+        self.recurrence = Recurrence.from_booking(start_date, end_date, start_time, end_time,
+                                                  self.is_recurring, self.recurrence_rule)
+
+    @property
+    def key(self):
+        return (self.source, self.booking_id)
+
+    @property
+    def bucket(self):
+        weekday = self.recurrence.weekday
+        return ANY_BUCKET if weekday is None else weekday
+
+    def search_buckets(self):
+        """Buckets that can hold bookings conflicting with this one"""
+        weekday = self.recurrence.weekday
+        if weekday is None:
+            return (ANY_BUCKET,) + WEEKDAY_BUCKETS
+        return (ANY_BUCKET, weekday)
+
+    def to_conflict_dict(self, conflict_date=None):
+        """Format the booking the way /api/check_conflicts reports it"""
+        if self.source == 'admin':
+            return {
+                "event_id": self.booking_id,
+                "event_name": self.name,
+                "start_date": self.start_date.isoformat(),
+                "end_date": self.end_date.isoformat(),
+                "start_time": str(self.start_time),
+                "end_time": str(self.end_time),
+                "is_recurring": self.is_recurring,
+                "recurrence_rule": self.recurrence_rule,
+                "first_conflict_date": conflict_date.isoformat() if conflict_date else None
+            }
+        return {
+            "request_id": self.booking_id,
+            "rental_name": self.name,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "start_time": str(self.start_time),
+            "end_time": str(self.end_time),
+            "is_recurring": self.is_recurring,
+            "recurrence_rule": self.recurrence_rule,
+            "rental_status": self.status,
+            "first_conflict_date": conflict_date.isoformat() if conflict_date else None
+        }
+
+
+def bookings_conflict(proposed, existing):
+    """Return True if the proposed booking collides with an existing one"""
+    return proposed.recurrence.first_collision(existing.recurrence) is not None
+
+
+def collisions(proposed, candidates):
+    """(booking, first colliding date) pairs for the proposal, ordered by source and id"""
+    conflicts = []
+    for booking in candidates:
+        conflict_date = proposed.recurrence.first_collision(booking.recurrence)
+        if conflict_date is not None:
+            conflicts.append((booking, conflict_date))
+    conflicts.sort(key=lambda pair: (pair[0].source, pair[0].booking_id))
+    return conflicts
+
+
+def collisions_within(proposals):
+    """For each proposal, (other proposal's position, first colliding date) pairs"""
+    found = [[] for _ in proposals]
+    for i, first in enumerate(proposals):
+        for j in range(i + 1, len(proposals)):
+            conflict_date = first.recurrence.first_collision(proposals[j].recurrence)
+            if conflict_date is not None:
+                found[i].append((j, conflict_date))
+                found[j].append((i, conflict_date))
+    return found
+
+
+class IntervalTree:
+    """Static centered interval tree over (low, high, value) triples (inclusive bounds)"""
+
+    __slots__ = ('center', 'by_low', 'by_high', 'left', 'right')
+
+    def __init__(self, items):
+        lows = sorted(item[0] for item in items)
+        self.center = lows[len(lows) // 2]
+        here, left, right = [], [], []
+        for item in items:
+            if item[1] < self.center:
+                left.append(item)
+            elif item[0] > self.center:
+                right.append(item)
+            else:
+                here.append(item)
+        self.by_low = sorted(here, key=lambda item: item[0])
+        self.by_high = sorted(here, key=lambda item: item[1], reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlapping(self, low, high):
+        """Yield the values of every interval intersecting [low, high]"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if high < node.center:
+                for item in node.by_low:
+                    if item[0] > high:
+                        break
+                    yield item[2]
+                if node.left:
+                    stack.append(node.left)
+            elif low > node.center:
+                for item in node.by_high:
+                    if item[1] < low:
+                        break
+                    yield item[2]
+                if node.right:
+                    stack.append(node.right)
+            else:
+                for item in node.by_low:
+                    yield item[2]
+                if node.left:
+                    stack.append(node.left)
+                if node.right:
+                    stack.append(node.right)
+
+
+class ConflictIndex:
+    """
+    Bookings that block the rink, bucketed by recurrence pattern and indexed
+    by date range. The full set is loaded through `loader` on first use and
+    reloaded after `max_age` seconds so writes made by other instances are
+    picked up; writes made by this instance are applied with upsert/remove.
+    """
+
+    def __init__(self, loader, max_age=None):
+        self._loader = loader
+        if max_age is None:
+            max_age = float(os.environ.get('CONFLICT_INDEX_MAX_AGE', 60))
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._bookings = None
+        self._snapshot = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        """Drop everything; the next query reloads from the database"""
+        with self._lock:
+            self._bookings = None
+            self._snapshot = None
+
+    def upsert(self, booking):
+        with self._lock:
+            if self._bookings is None:
+                return
+            self._bookings[booking.key] = booking
+            self._snapshot = None
+
+    def remove(self, source, booking_id):
+        with self._lock:
+            if self._bookings is None:
+                return
+            if self._bookings.pop((source, booking_id), None) is not None:
+                self._snapshot = None
+
+    def current_snapshot(self):
+        """The queryable structure for the current bookings, rebuilt after any change"""
+        with self._lock:
+            stale = time.monotonic() - self._loaded_at > self.max_age
+            if self._bookings is None or stale:
+                self._bookings = {booking.key: booking for booking in self._loader()}
+                self._loaded_at = time.monotonic()
+                self._snapshot = None
+            if self._snapshot is None:
+                self._snapshot = self.build_snapshot(list(self._bookings.values()))
+            return self._snapshot
+
+    def build_snapshot(self, bookings):
+        """One interval tree per pattern bucket"""
+        grouped = {}
+        for booking in bookings:
+            grouped.setdefault(booking.bucket, []).append(
+                (booking.recurrence.anchor, booking.recurrence.last, booking))
+        return {bucket: IntervalTree(items) for bucket, items in grouped.items()}
+
+    def candidates(self, proposed, snapshot=None):
+        """Bookings whose pattern bucket, date range and daily window overlap the proposal"""
+        trees = snapshot if snapshot is not None else self.current_snapshot()
+        recurrence = proposed.recurrence
+        found = []
+        for bucket in proposed.search_buckets():
+            tree = trees.get(bucket)
+            if tree is None:
+                continue
+            for booking in tree.overlapping(recurrence.anchor, recurrence.last):
+                if recurrence.windows_overlap(booking.recurrence):
+                    found.append(booking)
+        return found
+
+    def find_conflicts(self, proposed):
+        return collisions(proposed, self.candidates(proposed))
+
+    def find_conflicts_many(self, proposals):
+        """find_conflicts for every proposal, all against the same snapshot"""
+        trees = self.current_snapshot()
+        return [collisions(proposed, self.candidates(proposed, trees)) for proposed in proposals]
+
+    def has_conflict(self, proposed):
+        return any(bookings_conflict(proposed, booking) for booking in self.candidates(proposed))
@@ -0,0 +1,242 @@
+"""
+Outgoing emails through a table (email_outbox, migrations/008_email_outbox.sql)
+instead of a Gmail call inside the request that causes them:
+
+    email_id = enqueue(conn, to_address, subject, html_body)
+    dispatcher.wake()
+
+A request only inserts a row. The Dispatcher's background thread claims due
+rows (FOR UPDATE SKIP LOCKED, so several instances can dispatch at once),
+sends them on a small thread pool through a transport, and records the
+result: sent with the provider's message id, or retried with growing delays
+until max_attempts, then failed.
+
+Transports have one method, send(to_address, subject, html_body) ->
+message id. GmailTransport sends through the Gmail API; FakeTransport keeps
+the messages in memory, for tests and local runs.
+"""
+import base64
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+
+import sqlalchemy
+
+
+# With a dedupe_key, enqueueing an email that is already queued returns the
+# existing row instead of adding a second one
+ENQUEUE_QUERY = sqlalchemy.text("""
+    INSERT INTO public.email_outbox (to_address, subject, html_body, dedupe_key)
+    VALUES (:to_address, :subject, :html_body, :dedupe_key)
+    ON CONFLICT (dedupe_key) DO UPDATE SET dedupe_key = EXCLUDED.dedupe_key
+    RETURNING email_id
+""")
+
+# Due rows are pending ones whose retry time has come and 'sending' ones whose
+# sender's lease ran out (it died before recording the result)
+CLAIM_QUERY = sqlalchemy.text("""
+    WITH due AS (
+        SELECT email_id FROM public.email_outbox
+        WHERE status IN ('pending', 'sending')
+        AND next_attempt_at <= NOW()
+        ORDER BY next_attempt_at, email_id
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.email_outbox o
+    SET status = 'sending',
+        attempts = o.attempts + 1,
+        next_attempt_at = NOW() + make_interval(secs => :lease_seconds)
+    FROM due
+    WHERE o.email_id = due.email_id
+    RETURNING o.email_id, o.to_address, o.subject, o.html_body, o.attempts
+""")
+
+SENT_QUERY = sqlalchemy.text("""
+    UPDATE public.email_outbox
+    SET status = 'sent', message_id = :message_id, last_error = NULL, sent_at = NOW()
+    WHERE email_id = :email_id
+""")
+
+# Only the attempt that claimed the row may mark it failed
+FAILED_QUERY = sqlalchemy.text("""
+    UPDATE public.email_outbox
+    SET status = CASE WHEN :final THEN 'failed' ELSE 'pending' END,
+        next_attempt_at = NOW() + make_interval(secs => :delay),
+        last_error = :error
+    WHERE email_id = :email_id AND status = 'sending' AND attempts = :attempts
+""")
+
+
+def enqueue(conn, to_address, subject, html_body, dedupe_key=None):
+    """Queue an email; returns its email_id"""
+    return conn.execute(ENQUEUE_QUERY, {
+        "to_address": to_address,
+        "subject": subject,
+        "html_body": html_body,
+        "dedupe_key": dedupe_key
+    }).scalar()
+
+
+def claim_due(conn, limit, lease_seconds):
+    """Up to `limit` due emails as dicts, marked 'sending' for `lease_seconds`"""
+    # A statement starting with WITH is not autocommitted
+    with conn.begin():
+        return [dict(row) for row in conn.execute(CLAIM_QUERY, {
+            "limit": limit,
+            "lease_seconds": lease_seconds
+        }).mappings()]
+
+
+def mark_sent(conn, email_id, message_id):
+    conn.execute(SENT_QUERY, {"email_id": email_id, "message_id": message_id})
+
+
+def mark_failed(conn, email, error, delay, final):
+    """Record a failed attempt of `email` (from claim_due): retry after `delay` seconds, or give up if `final`"""
+    conn.execute(FAILED_QUERY, {
+        "email_id": email['email_id'],
+        "attempts": email['attempts'],
+        "final": final,
+        "delay": delay,
+        "error": str(error)[:1000]
+    })
+
+
+class GmailTransport:
+    """
+    Sends through the Gmail API. httplib2, under the Gmail client, isn't
+    thread-safe, so each sender thread builds its own client with
+    build_service() (None when Gmail can't be authorized).
+    """
+
+    def __init__(self, build_service):
+        self.build_service = build_service
+        self._local = threading.local()
+
+    def send(self, to_address, subject, html_body):
+        service = getattr(self._local, 'service', None)
+        if not service:
+            service = self._local.service = self.build_service()
+        if not service:
+            raise RuntimeError("Gmail service unavailable")
+
+        message = MIMEText(html_body, 'html')
+        message['to'] = to_address
+        message['subject'] = subject
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+
+        sent_message = service.users().messages().send(
+            userId='me',
+            body={'raw': raw_message}
+        ).execute()
+        return sent_message.get('id')
+
+
+class FakeTransport:
+    """
+    Keeps every message in `sent` instead of sending it. The next `failures`
+    sends raise, to exercise retries.
+    """
+
+    def __init__(self, failures=0):
+        self.sent = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def send(self, to_address, subject, html_body):
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise RuntimeError("Fake transport failure")
+            self.sent.append({"to": to_address, "subject": subject, "html": html_body})
+            message_id = f"fake-{len(self.sent)}"
+        print(f"Fake email {message_id} to {to_address}: {subject}")
+        return message_id
+
+
+class Dispatcher:
+    """
+    Sends queued emails from a daemon thread, started by the first start() or
+    wake(). It looks for due emails every `poll_seconds`, or at once when
+    woken, and sends up to `workers` at a time. A failed attempt is retried
+    after base_delay * 2^n seconds plus jitter (at most max_delay), and the
+    email is marked failed after `max_attempts`.
+    """
+
+    def __init__(self, pool, transport, workers=2, max_attempts=5, poll_seconds=30,
+                 base_delay=30, max_delay=3600, lease_seconds=300):
+        self.pool = pool
+        self.transport = transport
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email')
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='email-dispatcher', daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Look for due emails now (after queueing one)"""
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Error dispatching emails: {str(e)}")
+                traceback.print_exc()
+
+    def drain(self, deadline=None):
+        """
+        Send due emails until none are left (or time.monotonic() passes
+        `deadline`); returns (sent, failed attempts)
+        """
+        sent = failed = 0
+        while deadline is None or time.monotonic() < deadline:
+            with self.pool.connect() as conn:
+                emails = claim_due(conn, self.workers, self.lease_seconds)
+            if not emails:
+                break
+            for ok in self._executor.map(self._send, emails):
+                if ok:
+                    sent += 1
+                else:
+                    failed += 1
+        return sent, failed
+
+    def retry_delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay + random.uniform(0, delay / 2)
+
+    def _send(self, email):
+        try:
+            message_id = self.transport.send(email['to_address'], email['subject'], email['html_body'])
+        except Exception as e:
+            final = email['attempts'] >= self.max_attempts
+            with self.pool.connect() as conn:
+                mark_failed(conn, email, e, self.retry_delay(email['attempts']), final)
+            print(f"Email {email['email_id']} to {email['to_address']} failed "
+                  f"(attempt {email['attempts']} of {self.max_attempts}): {str(e)}")
+            return False
+
+        with self.pool.connect() as conn:
+            mark_sent(conn, email['email_id'], message_id)
+        print(f"Email {email['email_id']} sent successfully to {email['to_address']}")
+        return True
@@ -0,0 +1,315 @@
+"""
+Monthly invoicing as a staged pipeline, so the database reads stay the same
+number of queries however many renters there are:
+
+    1. plan_month(): one grouped query gives every renter with unpaid
+       requests in the month, their total, the requests to bill and whether
+       an invoice for that month already exists; save_plan() stores it in
+       monthly_invoice_run (migrations/006_monthly_invoice_run.sql)
+    2. the caller takes each pending run through the Stripe steps,
+       checkpointing every step with save_progress()
+    3. record_finalized(): one statement inserts the monthly_invoice rows of
+       every finalized run and marks them recorded
+    4. the caller emails the recorded runs
+
+Because every step is checkpointed, a run that died halfway is picked up
+where it stopped, and the job can be split over several short invocations.
+
+Stage 2 is mostly waiting on Stripe, so it runs per renter on a thread pool
+(run_concurrently), with every Stripe call going through one TokenBucket to
+stay under Stripe's request rate and call_with_retries for rate limits and
+connection errors.
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import sqlalchemy
+
+
+# A renter is picked up for any unpaid approved or admin request in the month
+# but only billed for the approved ones (admin requests are not charged).
+PLAN_QUERY = sqlalchemy.text("""
+    SELECT
+        r.renter_id as user_id,
+        r.renter_email as user_email,
+        CONCAT(r.first_name, ' ', r.last_name) as user_name,
+        r.stripe_customer_id,
+        SUM(rr.amount) FILTER (WHERE rr.rental_status = 'approved') as total_amount,
+        array_agg(rr.request_id ORDER BY rr.start_date, rr.request_id)
+            FILTER (WHERE rr.rental_status = 'approved') as request_ids,
+        array_agg(rr.rental_name ORDER BY rr.start_date, rr.request_id)
+            FILTER (WHERE rr.rental_status = 'approved') as rental_names,
+        array_agg(TO_CHAR(rr.start_date, 'YYYY-MM-DD') ORDER BY rr.start_date, rr.request_id)
+            FILTER (WHERE rr.rental_status = 'approved') as start_dates,
+        array_agg(TO_CHAR(rr.end_date, 'YYYY-MM-DD') ORDER BY rr.start_date, rr.request_id)
+            FILTER (WHERE rr.rental_status = 'approved') as end_dates,
+        EXISTS (
+            SELECT 1 FROM public.monthly_invoice mi
+            WHERE mi.user_id = r.renter_id
+            AND mi.invoice_month = :month
+            AND mi.invoice_year = :year
+        ) as invoice_exists
+    FROM public.renter r
+    JOIN public.rental_request rr ON r.renter_id = rr.user_id
+    WHERE rr.rental_status IN ('approved', 'admin')
+    AND (rr.paid = FALSE OR rr.paid IS NULL)
+    AND rr.start_date >= :first_day AND rr.start_date < :after_last_day
+    GROUP BY r.renter_id
+    ORDER BY r.renter_id
+""")
+
+# Plans are saved as one JSON array. A plan may still change until its
+# Stripe invoice exists; after that it is fixed.
+SAVE_PLAN_QUERY = sqlalchemy.text("""
+    INSERT INTO public.monthly_invoice_run
+    (invoice_year, invoice_month, user_id, amount, request_ids, details)
+    SELECT :year, :month, plan.user_id, plan.amount, plan.request_ids, plan.details
+    FROM jsonb_to_recordset(CAST(:plans AS jsonb))
+        AS plan(user_id integer, amount numeric, request_ids integer[], details jsonb)
+    ON CONFLICT (invoice_year, invoice_month, user_id) DO UPDATE SET
+        amount = EXCLUDED.amount,
+        request_ids = EXCLUDED.request_ids,
+        details = EXCLUDED.details,
+        updated_at = NOW()
+    WHERE monthly_invoice_run.state = 'planned'
+    AND monthly_invoice_run.stripe_invoice_id IS NULL
+""")
+
+# Runs planned by an earlier invocation for renters who have nothing due any
+# more (paid, or their requests declined), as long as no Stripe invoice exists
+DROP_STALE_QUERY = sqlalchemy.text("""
+    DELETE FROM public.monthly_invoice_run
+    WHERE invoice_year = :year AND invoice_month = :month
+    AND state = 'planned'
+    AND stripe_invoice_id IS NULL
+    AND user_id NOT IN (
+        SELECT (plan->>'user_id')::integer FROM jsonb_array_elements(CAST(:plans AS jsonb)) AS plan
+    )
+""")
+
+PENDING_QUERY = sqlalchemy.text("""
+    SELECT
+        user_id, state, amount, request_ids, details, stripe_customer_id,
+        stripe_invoice_item_id, stripe_invoice_id, payment_link, attempts
+    FROM public.monthly_invoice_run
+    WHERE invoice_year = :year AND invoice_month = :month
+    AND state <> 'emailed'
+    ORDER BY user_id
+""")
+
+# Inserting the monthly_invoice rows and marking their runs recorded is one
+# statement, so one never happens without the other
+RECORD_QUERY = sqlalchemy.text("""
+    WITH recorded AS (
+        UPDATE public.monthly_invoice_run
+        SET state = 'recorded', updated_at = NOW()
+        WHERE invoice_year = :year AND invoice_month = :month
+        AND state = 'finalized'
+        RETURNING user_id, amount, payment_link, stripe_invoice_id
+    )
+    INSERT INTO public.monthly_invoice
+    (user_id, invoice_month, invoice_year, amount, payment_link, stripe_invoice_id)
+    SELECT recorded.user_id, :month, :year, recorded.amount, recorded.payment_link, recorded.stripe_invoice_id
+    FROM recorded
+    WHERE NOT EXISTS (
+        SELECT 1 FROM public.monthly_invoice mi
+        WHERE mi.stripe_invoice_id = recorded.stripe_invoice_id
+    )
+    RETURNING user_id
+""")
+
+RUN_STATES = ('planned', 'stripe_created', 'finalized', 'recorded', 'emailed')
+PROGRESS_COLUMNS = ('state', 'stripe_customer_id', 'stripe_invoice_item_id', 'stripe_invoice_id', 'payment_link')
+
+# First key of the advisory lock held while a month is being invoiced (see
+# reservations.LOCK_NAMESPACE)
+JOB_LOCK_NAMESPACE = 463
+
+
+def previous_month(today):
+    """(month, year) of the month before `today`"""
+    if today.month == 1:
+        return 12, today.year - 1
+    return today.month - 1, today.year
+
+
+def plan_month(conn, month, year):
+    """
+    Renters to invoice for month/year. Returns (to_invoice, already_invoiced,
+    nothing_due), lists of dicts with user_id, user_email, user_name,
+    stripe_customer_id, total_amount, request_ids, rental_names, start_dates
+    and end_dates.
+    """
+    first_day = date(year, month, 1)
+    after_last_day = date(year + month // 12, month % 12 + 1, 1)
+    rows = conn.execute(PLAN_QUERY, {
+        "month": month,
+        "year": year,
+        "first_day": first_day,
+        "after_last_day": after_last_day
+    }).mappings()
+
+    to_invoice, already_invoiced, nothing_due = [], [], []
+    for row in rows:
+        user = dict(row)
+        if user.pop('invoice_exists'):
+            already_invoiced.append(user)
+        elif not user['total_amount']:
+            nothing_due.append(user)
+        else:
+            to_invoice.append(user)
+    return to_invoice, already_invoiced, nothing_due
+
+
+def idempotency_key(user_id, month, year, step):
+    """Stripe idempotency key of one step of one renter's monthly invoice"""
+    return f"monthly-invoice-{year}-{month:02d}-user-{user_id}-{step}"
+
+
+def try_lock_month(conn, month, year):
+    """
+    Take the session advisory lock for invoicing month/year on `conn`; False
+    if another invocation holds it. Released by unlock_month or when the
+    connection closes.
+    """
+    return conn.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:namespace, :key)"), {
+        "namespace": JOB_LOCK_NAMESPACE,
+        "key": year * 100 + month
+    }).scalar()
+
+
+def unlock_month(conn, month, year):
+    conn.execute(sqlalchemy.text("SELECT pg_advisory_unlock(:namespace, :key)"), {
+        "namespace": JOB_LOCK_NAMESPACE,
+        "key": year * 100 + month
+    })
+
+
+def save_plan(conn, month, year, to_invoice):
+    """
+    Store the plan of each renter in `to_invoice` (from plan_month) as a run in
+    state 'planned', and drop the planned runs of renters no longer in it.
+    Runs whose Stripe invoice exists are left as they are.
+    """
+    plans = [{
+        "user_id": user['user_id'],
+        "amount": str(user['total_amount']),
+        "request_ids": user['request_ids'],
+        "details": {key: user[key] for key in
+                    ('user_email', 'user_name', 'rental_names', 'start_dates', 'end_dates')}
+    } for user in to_invoice]
+    params = {"month": month, "year": year, "plans": json.dumps(plans)}
+    with conn.begin():
+        conn.execute(DROP_STALE_QUERY, params)
+        if plans:
+            conn.execute(SAVE_PLAN_QUERY, params)
+
+
+def pending_runs(conn, month, year):
+    """Runs of month/year not yet emailed, as dicts"""
+    return [dict(row) for row in conn.execute(PENDING_QUERY, {"month": month, "year": year}).mappings()]
+
+
+def save_progress(conn, month, year, run, **fields):
+    """Checkpoint `run` (a dict from pending_runs): set the given columns in the table and in `run`"""
+    for column in fields:
+        if column not in PROGRESS_COLUMNS:
+            raise ValueError(f"Unknown monthly_invoice_run column {column}")
+    if fields.get('state', RUN_STATES[0]) not in RUN_STATES:
+        raise ValueError(f"Unknown monthly_invoice_run state {fields['state']}")
+    assignments = ", ".join(f"{column} = :{column}" for column in fields)
+    conn.execute(sqlalchemy.text(f"""
+        UPDATE public.monthly_invoice_run
+        SET {assignments}, last_error = NULL, updated_at = NOW()
+        WHERE invoice_year = :year AND invoice_month = :month AND user_id = :user_id
+    """), dict(fields, month=month, year=year, user_id=run['user_id']))
+    run.update(fields)
+
+
+def save_failure(conn, month, year, user_id, error):
+    """Count a failed attempt for a run and keep its error"""
+    conn.execute(sqlalchemy.text("""
+        UPDATE public.monthly_invoice_run
+        SET attempts = attempts + 1, last_error = :error, updated_at = NOW()
+        WHERE invoice_year = :year AND invoice_month = :month AND user_id = :user_id
+    """), {"month": month, "year": year, "user_id": user_id, "error": str(error)[:1000]})
+
+
+def record_finalized(conn, month, year):
+    """Insert the monthly_invoice rows of every finalized run and mark those runs recorded"""
+    # A statement starting with WITH is not autocommitted
+    with conn.begin():
+        return conn.execute(RECORD_QUERY, {"month": month, "year": year}).rowcount
+
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads: `rate` acquisitions per second on average,
+    with bursts of up to `burst` (by default calls are evenly spaced, so no
+    one-second window sees much more than `rate`). acquire() blocks until a
+    token is free.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # After sleeping exactly `wait` the refill can come out a rounding
+                # error short of 1, and a wait that small may not move the clock
+                if self._tokens >= 1 - 1e-9:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+def call_with_retries(call, limiter=None, retryable=(), attempts=4, base_delay=0.5, sleep=time.sleep):
+    """
+    call() after taking a token from `limiter`, retried up to `attempts` times
+    in all when it raises one of `retryable`, waiting base_delay * 2^n plus
+    jitter in between. The last error propagates.
+    """
+    for attempt in range(attempts):
+        if limiter:
+            limiter.acquire()
+        try:
+            return call()
+        except retryable as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * 2 ** attempt
+            print(f"Retrying after {type(e).__name__} (attempt {attempt + 1} of {attempts}): {e}")
+            sleep(delay + random.uniform(0, delay))
+
+
+def run_concurrently(items, work, workers):
+    """
+    work(item) for every item on up to `workers` threads. Returns
+    [(item, result, error)] in the order of `items`, error being the exception
+    work raised (result is then None) or None.
+    """
+    def run(item):
+        try:
+            return item, work(item), None
+        except Exception as e:
+            return item, None, e
+
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items))), thread_name_prefix='invoicing') as executor:
+        return list(executor.map(run, items))
@@ -0,0 +1,155 @@
+"""
+Local verification of Firebase ID tokens (VERIFY_TOKENS_LOCALLY=1).
+
+Firebase signs ID tokens with RS256 using Google's rotating x509 certificates
+published at CERTS_URL. CertificateKeyStore keeps those certificates in memory
+and in a JSON file on local disk, trusts them for the response's Cache-Control
+max-age, and refreshes them from a background thread shortly before they
+expire, so requests never wait on the download. If a refresh fails the last
+known certificates stay in use (they only ever verify Google's own signatures)
+and the refresh is retried.
+
+`fetch` is injectable: any callable returning ({key_id: pem_certificate},
+max_age_seconds) works, so tests can use a locally generated key set.
+"""
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+
+from google.auth import jwt
+
+
+CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+
+class KeyFetchError(Exception):
+    """No signing certificates could be loaded"""
+
+
+class TokenExpiredError(ValueError):
+    """The token was signed correctly but is past its exp"""
+
+
+def fetch_google_certs(url=CERTS_URL, timeout=10):
+    """Download the certificates and their Cache-Control max-age"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        certs = json.loads(response.read().decode('utf-8'))
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    return certs, int(match.group(1)) if match else 3600
+
+
+class CertificateKeyStore:
+    """Google signing certificates with memory + disk caching and background refresh"""
+
+    def __init__(self, project_id, cache_path=None, fetch=fetch_google_certs,
+                 refresh_margin=300, retry_delay=60, clock_skew=60):
+        self.project_id = project_id
+        self.cache_path = cache_path
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.clock_skew = clock_skew
+        self._certs = {}
+        self._expires = 0
+        self._last_fetch = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._load_from_disk()
+
+    def _load_from_disk(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path) as f:
+                saved = json.load(f)
+            self._certs = saved['certs']
+            self._expires = saved['expires']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_to_disk(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"certs": self._certs, "expires": self._expires}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not save signing certificates to {self.cache_path}: {e}")
+
+    def refresh(self):
+        """Fetch the certificates now; keeps the old ones and re-raises if that fails"""
+        with self._lock:
+            self._last_fetch = time.time()
+            certs, max_age = self.fetch()
+            self._certs = certs
+            self._expires = time.time() + max_age
+            self._save_to_disk()
+
+    def certs(self):
+        """Current certificates, fetching them first if there are none or they expired"""
+        if self._certs and self._expires > time.time():
+            return self._certs
+        try:
+            self.refresh()
+        except Exception as e:
+            if not self._certs:
+                raise KeyFetchError(f"Could not fetch signing certificates: {e}") from e
+            print(f"Refreshing signing certificates failed, using the previous set: {e}")
+        return self._certs
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._expires - self.refresh_margin - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Background refresh of signing certificates failed: {e}")
+                time.sleep(self.retry_delay)
+
+    def start_background_refresh(self):
+        """Keep the certificates fresh from a daemon thread (once per process)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, name='key-store-refresh', daemon=True)
+                self._thread.start()
+
+    def verify(self, token):
+        """
+        Decoded claims of a valid Firebase ID token for this project, with `uid`
+        set like firebase_admin's. Raises TokenExpiredError or ValueError.
+        """
+        header = jwt.decode_header(token)
+        if header.get('alg') != 'RS256':
+            raise ValueError(f"Unexpected token algorithm {header.get('alg')!r}")
+
+        certs = self.certs()
+        if header.get('kid') not in certs and time.time() - self._last_fetch > self.retry_delay:
+            # Signed with a key newer than ours: the certificates rotated early
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Refreshing signing certificates failed: {e}")
+            certs = self._certs
+
+        unverified = jwt.decode(token, verify=False)
+        if unverified.get('exp', 0) + self.clock_skew < time.time():
+            raise TokenExpiredError("Token expired")
+
+        claims = jwt.decode(token, certs=certs, audience=self.project_id,
+                            clock_skew_in_seconds=self.clock_skew)
+        if claims.get('iss') != f"https://securetoken.google.com/{self.project_id}":
+            raise ValueError("Token has an unexpected issuer")
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise ValueError("Token has an invalid subject")
+        if claims.get('auth_time', 0) > time.time() + self.clock_skew:
+            raise ValueError("Token auth_time is in the future")
+        claims['uid'] = subject
+        return claims
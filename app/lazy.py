@@ -0,0 +1,56 @@
+"""
+Deferred initialization of the app's external clients (Firebase, Cloud SQL,
+Stripe, Gmail) so that importing main on a cold App Engine instance doesn't
+pay for SDK imports, credential parsing or connector setup up front. Each
+client is built on first use, exactly once per process, even when several
+request threads need it at the same moment.
+"""
+import importlib
+import threading
+
+
+_UNSET = object()
+
+
+class Lazy:
+    """
+    Proxy that calls `factory` on first use and then behaves like its result:
+    attribute access is forwarded, so `pool.connect()` works unchanged. If the
+    factory raises, nothing is stored and the next use tries again.
+    """
+
+    def __init__(self, factory, name=None):
+        self._factory = factory
+        self._name = name or getattr(factory, '__name__', 'lazy')
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    self._value = self._factory()
+                value = self._value
+        return value
+
+    @property
+    def initialized(self):
+        return self._value is not _UNSET
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        state = 'initialized' if self.initialized else 'not initialized'
+        return f"<Lazy {self._name} ({state})>"
+
+
+def lazy_module(name, setup=None):
+    """Lazy proxy for module `name`, imported on first attribute access; setup(module) runs once"""
+    def load():
+        module = importlib.import_module(name)
+        if setup:
+            setup(module)
+        return module
+    return Lazy(load, name)
@@ -1,34 +1,49 @@
-from flask import Flask, render_template, request, jsonify, redirect, Blueprint 
+from flask import Flask, render_template, request, jsonify, redirect, Blueprint, Response
 import json
-from google.cloud.sql.connector import Connector
 import sqlalchemy
 from sqlalchemy import text, bindparam
 import os
-from datetime import datetime, timedelta
-import pg8000
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 from flask import request, jsonify
-from firebase_admin import auth, credentials, initialize_app
-import firebase_admin
 from functools import wraps 
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask import session
+from flask import session, g
 import traceback
+import threading
+import time
+import uuid
 import base64
-from email.mime.text import MIMEText
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import functions_framework
-import stripe
-
-
-# Initialize Firebase Admin SDK (only once)
-if not firebase_admin._apps:
-    cred = credentials.Certificate("firebase.json")
-    initialize_app(cred)
+from conflict_index import Booking, ConflictIndex, collisions_within
+import sql_conflicts
+from sql_conflicts import SqlConflictEngine
+from reservations import fetch_overlapping, lock_and_find_conflicts
+import occurrences
+import invoicing
+import email_outbox
+from recurrence import iter_dates, period_of
+from response_cache import FileBackend, MemoryBackend, ResponseCache, ScheduleVersion
+from schedule_hub import ScheduleHub
+from token_cache import VerifiedTokenCache
+from lazy import Lazy, lazy_module
+from stripe_customers import CustomerIdCache, customer_idempotency_key, match_customers
+
+
+# The Firebase Admin SDK, the database pool, Stripe and Gmail are set up on
+# first use rather than at import (see lazy.py), to keep cold starts short.
+def init_firebase():
+    """Initialize the Firebase Admin SDK (only once)"""
+    import firebase_admin
+    from firebase_admin import credentials
+    if not firebase_admin._apps:
+        cred = credentials.Certificate("firebase.json")
+        firebase_admin.initialize_app(cred)
+    return firebase_admin.get_app()
+
+firebase_app = Lazy(init_firebase)
+auth = lazy_module('firebase_admin.auth', setup=lambda module: firebase_app.get())
 
 load_dotenv('.env')
 
@@ -39,50 +54,76 @@ os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credential_path
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'default_dev_key')
 # Database configuration
-INSTANCE_CONNECTION_NAME = os.environ["INSTANCE_CONNECTION_NAME"]
-DB_USER = os.environ["DB_USER"]
-DB_PASS = os.environ["DB_PASS"]
-DB_NAME = os.environ["DB_NAME"]
-
-# Initialize the connector
-connector = Connector()
-
-def get_connection():
-    return connector.connect(
-        INSTANCE_CONNECTION_NAME,
-        "pg8000",
-        user=DB_USER,
-        password=DB_PASS,
-        db=DB_NAME
+# DATABASE_URL (e.g. postgresql+pg8000://postgres@localhost/icerink) points the
+# app at a plain local PostgreSQL instead of Cloud SQL, for local testing.
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+def create_pool():
+    """Create the connection pool (on first use of `pool`)"""
+    if DATABASE_URL:
+        return sqlalchemy.create_engine(
+            DATABASE_URL,
+            pool_size=5,
+            max_overflow=2,
+            pool_timeout=30,
+            pool_recycle=1800
+        )
+
+    from google.cloud.sql.connector import Connector
+
+    INSTANCE_CONNECTION_NAME = os.environ["INSTANCE_CONNECTION_NAME"]
+    DB_USER = os.environ["DB_USER"]
+    DB_PASS = os.environ["DB_PASS"]
+    DB_NAME = os.environ["DB_NAME"]
+
+    # Initialize the connector
+    connector = Connector()
+
+    def get_connection():
+        return connector.connect(
+            INSTANCE_CONNECTION_NAME,
+            "pg8000",
+            user=DB_USER,
+            password=DB_PASS,
+            db=DB_NAME
+        )
+
+    # Create connection pool
+    return sqlalchemy.create_engine(
+        "postgresql+pg8000://",
+        creator=get_connection,
+        pool_size=5,
+        max_overflow=2,
+        pool_timeout=30,
+        pool_recycle=1800
     )
 
-# Create connection pool
-pool = sqlalchemy.create_engine(
-    "postgresql+pg8000://",
-    creator=get_connection,
-    pool_size=5,
-    max_overflow=2,
-    pool_timeout=30,
-    pool_recycle=1800
-)
+pool = Lazy(create_pool)
 
 admin_routes = Blueprint('admin_routes', __name__)
 
-# Set up Stripe API key 
-stripe.api_key = os.environ.get('STRIPE_API_KEY')
+# Set up Stripe API key (stripe is imported on first use)
+def setup_stripe(module):
+    module.api_key = os.environ.get('STRIPE_API_KEY')
+    # e.g. a local stripe-mock (http://localhost:12111) when testing
+    if os.environ.get('STRIPE_API_BASE'):
+        module.api_base = os.environ['STRIPE_API_BASE']
+
+stripe = lazy_module('stripe', setup=setup_stripe)
 
 # Gmail API setup
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 CREDENTIALS_FILE = 'credentials.json'  # Keep your original credentials file
 load_dotenv('.env.gmail')  # Load Gmail credentials from .env file
 # Instead of writing to a file, we'll store the token in an environment variable
-gmail_service = None
 
-def get_gmail_service():
-    global gmail_service
-    if gmail_service:
-        return gmail_service
-    
+def build_gmail_service():
+    """Authorize and build the Gmail client, or None if that fails"""
+    from googleapiclient.discovery import build
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
     creds = None
     
     # Try to get token from environment variable instead of file
@@ -134,12 +175,91 @@ def get_gmail_service():
                 return None
     
     try:
-        gmail_service = build('gmail', 'v1', credentials=creds)
-        return gmail_service
+        return build('gmail', 'v1', credentials=creds)
     except Exception as e:
         print(f"Error building Gmail service: {e}")
         return None
 
+# Emails are queued in email_outbox (migrations/008_email_outbox.sql) and sent
+# by a background dispatcher on EMAIL_WORKERS threads, so requests don't wait
+# on Gmail. A failed send is retried with growing delays up to
+# EMAIL_MAX_ATTEMPTS times. EMAIL_TRANSPORT=fake keeps the emails in memory
+# (email_transport.sent) instead of sending them, for tests.
+EMAIL_TRANSPORT = os.environ.get('EMAIL_TRANSPORT', 'gmail')
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', 30))
+
+if EMAIL_TRANSPORT == 'fake':
+    email_transport = email_outbox.FakeTransport()
+else:
+    email_transport = email_outbox.GmailTransport(build_gmail_service)
+email_dispatcher = email_outbox.Dispatcher(
+    pool,
+    email_transport,
+    workers=EMAIL_WORKERS,
+    max_attempts=EMAIL_MAX_ATTEMPTS,
+    poll_seconds=EMAIL_POLL_SECONDS
+)
+# How long POST /api/admin/send_queued_emails keeps sending
+EMAIL_DRAIN_MAX_SECONDS = float(os.environ.get('EMAIL_DRAIN_MAX_SECONDS', 60))
+
+def queue_email(to_address, subject, html_body, dedupe_key=None, conn=None):
+    """Queue an email for the background dispatcher (on `conn` if given); returns its email_id"""
+    if conn is not None:
+        email_id = email_outbox.enqueue(conn, to_address, subject, html_body, dedupe_key)
+    else:
+        with pool.connect() as conn:
+            email_id = email_outbox.enqueue(conn, to_address, subject, html_body, dedupe_key)
+    email_dispatcher.wake()
+    return email_id
+
+
+# VERIFY_TOKENS_LOCALLY=1 checks ID token signatures against Google's certificates
+# cached in memory and in FIREBASE_CERTS_CACHE, refreshed in the background,
+# instead of letting the Firebase SDK fetch them when a request needs them.
+VERIFY_TOKENS_LOCALLY = os.environ.get('VERIFY_TOKENS_LOCALLY') == '1'
+
+def create_key_store():
+    from key_store import CertificateKeyStore
+    store = CertificateKeyStore(
+        firebase_app.project_id,
+        cache_path=os.environ.get('FIREBASE_CERTS_CACHE', '/tmp/firebase-certs.json')
+    )
+    store.start_background_refresh()
+    return store
+
+key_store = Lazy(create_key_store)
+
+if VERIFY_TOKENS_LOCALLY:
+    # Load the certificates in the background, not on the first request
+    threading.Thread(target=key_store.get, name='key-store-init', daemon=True).start()
+
+def verify_id_token(token):
+    """auth.verify_id_token, or the local key store when VERIFY_TOKENS_LOCALLY=1 (same exceptions)"""
+    if not VERIFY_TOKENS_LOCALLY:
+        return auth.verify_id_token(token)
+    from key_store import TokenExpiredError
+    try:
+        return key_store.verify(token)
+    except TokenExpiredError as e:
+        raise auth.ExpiredIdTokenError(str(e), e)
+    except ValueError as e:
+        raise auth.InvalidIdTokenError(str(e), e)
+
+# Verified ID tokens (until they expire) and admin lookups (for ADMIN_CACHE_TTL
+# seconds), so repeated API calls with one token skip signature checks and the
+# public.admin query. POST /api/admin/flush_auth_cache after editing public.admin.
+token_cache = VerifiedTokenCache(
+    max_entries=int(os.environ.get('AUTH_CACHE_SIZE', 1024)),
+    admin_ttl=int(os.environ.get('ADMIN_CACHE_TTL', 60))
+)
+
+def lookup_admin(email):
+    """Whether `email` is in public.admin"""
+    with pool.connect() as conn:
+        query = sqlalchemy.text("SELECT 1 FROM public.admin WHERE email = :email")
+        return conn.execute(query, {"email": email}).fetchone() is not None
 
 def require_admin(pool):
     """
@@ -156,18 +276,15 @@ def require_admin(pool):
                 return jsonify({'error': 'Unauthorized - Token missing in cookies'}), 401
 
             try:
-                # Verify Firebase ID token
-                decoded_token = auth.verify_id_token(token)
+                # Verify Firebase ID token (cached until it expires)
+                decoded_token = token_cache.verify(token, verify_id_token)
                 user_email = decoded_token.get('email')
 
                 if not user_email:
                     print(f"Authorization Error: Email missing in token payload (UID: {decoded_token.get('uid')})")
                     return jsonify({'error': 'Unauthorized - Email missing in token'}), 401
 
-                with pool.connect() as conn:
-                    query = sqlalchemy.text("SELECT 1 FROM public.admin WHERE email = :email")
-                    result = conn.execute(query, {"email": user_email}).fetchone()
-                    is_admin = result is not None
+                is_admin = token_cache.is_admin(user_email, lookup_admin)
 
                 if not is_admin:
                     print(f"Access Denied: '{user_email}' is not in public.admin")
@@ -190,6 +307,46 @@ def require_admin(pool):
         return wrapper
     return decorator
 
+# Cloud Scheduler jobs call the admin endpoints they run with an OIDC token
+# for this service account (--oidc-service-account-email)
+SCHEDULER_SERVICE_ACCOUNT = os.environ.get('SCHEDULER_SERVICE_ACCOUNT')
+
+def verify_scheduler_token(token):
+    """Claims of a Google-signed OIDC token issued to SCHEDULER_SERVICE_ACCOUNT for this URL"""
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import id_token
+    # --oidc-token-audience is the job's https URL
+    audience = f"https://{request.host}{request.path}"
+    claims = id_token.verify_oauth2_token(token, google_requests.Request(), audience=audience)
+    if not SCHEDULER_SERVICE_ACCOUNT or claims.get('email') != SCHEDULER_SERVICE_ACCOUNT \
+            or not claims.get('email_verified'):
+        raise ValueError(f"Token not issued to the scheduler's service account: {claims.get('email')}")
+    return claims
+
+def require_admin_or_scheduler(pool):
+    """
+    Like require_admin, but also lets in Cloud Scheduler: a request with an
+    Authorization: Bearer OIDC token for SCHEDULER_SERVICE_ACCOUNT.
+    """
+    def decorator(f):
+        as_admin = require_admin(pool)(f)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            auth_header = request.headers.get('Authorization', '')
+            if not auth_header.startswith('Bearer '):
+                return as_admin(*args, **kwargs)
+            try:
+                claims = verify_scheduler_token(auth_header.split('Bearer ', 1)[1])
+            except Exception as e:
+                print(f"Scheduler token rejected: {e}")
+                return jsonify({'error': 'Unauthorized - Invalid scheduler token'}), 401
+            print(f"Access Granted: scheduler '{claims.get('email')}' accessed {f.__name__}")
+            return f(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
 def require_authentication(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -200,8 +357,8 @@ def require_authentication(f):
             return jsonify({'error': 'Unauthorized - Token missing'}), 401
         
         try:
-            # Verify Firebase token
-            decoded_token = auth.verify_id_token(token)
+            # Verify Firebase token (cached until it expires)
+            decoded_token = token_cache.verify(token, verify_id_token)
             request.user_email = decoded_token.get('email')  # You can store user info in the request object
             return f(*args, **kwargs)
         except auth.InvalidIdTokenError:
@@ -213,6 +370,38 @@ def require_authentication(f):
     
     return wrapper
 
+def require_own_uid(f):
+    """Only the signed-in user (per the session) or an admin may read a <firebase_uid> route"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if session.get('firebase_uid') != kwargs.get('firebase_uid') and not session.get('is_admin'):
+            return jsonify({"error": "Unauthorized access"}), 403
+        return f(*args, **kwargs)
+    return wrapper
+
+def conditional_on_schedule(f):
+    """
+    ETag a GET endpoint with the schedule version. A matching If-None-Match
+    gets a 304 before the view runs, so the only SQL issued for it is the
+    version query.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        etag = schedule_version()
+        if etag is None:
+            return f(*args, **kwargs)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Make browsers revalidate (sending If-None-Match) instead of guessing
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
 
 @app.route('/check-admin', methods=['POST'])
 def check_admin():
@@ -224,7 +413,7 @@ def check_admin():
 
     try:
         # Verify the token first
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_id_token(token)
         user_email = decoded_token.get('email') # Use email from the verified token
 
         if not user_email:
@@ -260,7 +449,7 @@ def check_user():
     token = auth_header.split('Bearer ')[1]
 
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_id_token(token)
         firebase_uid = decoded_token.get('uid')
         email = decoded_token.get('email')
 
@@ -314,11 +503,32 @@ def cleanup_requests(request):
             delete_query = sqlalchemy.text("""
                 DELETE FROM public.rental_request
                 WHERE end_date < (NOW() - INTERVAL '4 months')
-                RETURNING request_id, renter_id, end_date
+                RETURNING request_id, user_id, end_date
             """)
             result = conn.execute(delete_query)
             deleted = result.fetchall()
 
+            for row in deleted:
+                booking_changed(conn, 'rental', row[0])
+
+            try:
+                # Change log for /api/admin/changes (migrations/003_schedule_change.sql);
+                # a 'pruned' marker remembers how far it was cut so stale cursors get a reset.
+                # A statement starting with WITH is not autocommitted
+                with conn.begin():
+                    conn.execute(sqlalchemy.text("""
+                        WITH pruned AS (
+                            DELETE FROM public.schedule_change
+                            WHERE changed_at < (NOW() - INTERVAL '30 days')
+                            RETURNING txid
+                        )
+                        INSERT INTO public.schedule_change (txid, source, row_id, op)
+                        SELECT MAX(txid), 'pruned', 0, 'P' FROM pruned
+                        HAVING COUNT(*) > 0
+                    """))
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                print(f"Could not prune schedule_change: {str(e)}")
+
             return jsonify({
                 "message": f"Deleted {len(deleted)} rental request(s)",
                 "deleted_requests": [
@@ -387,12 +597,12 @@ def home():
 @app.route('/u')
 @require_authentication
 def u():
-    return render_template('userrequest.html')
+    return render_template('userrequest.html', live_updates=STREAM_MAX_SUBSCRIBERS > 0)
 
 @app.route("/admin")
 @require_admin(pool)
 def admin():
-    return render_template("admin.html")
+    return render_template("admin.html", live_updates=STREAM_MAX_SUBSCRIBERS > 0)
 
 @app.route('/signup')
 def signup():
@@ -413,7 +623,7 @@ def register_user():
             return jsonify({"error": "Missing or invalid Authorization header"}), 401
 
         id_token = auth_header.split("Bearer ")[1]
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         firebase_uid = decoded_token['uid']
         email = decoded_token['email']
 
@@ -602,65 +812,33 @@ def admin_get_all_users():
 @app.route('/api/admin/all-requests')
 @require_admin(pool)
 def admin_get_all_requests():
-    """Get all rental requests for admin view"""
+    """
+    Rental requests for the admin user search, newest first, filtered and paged
+    in the database (see fetch_admin_request_page). The first page also
+    carries the count and payment summary of everything matching the filters.
+    """
     try:
         with pool.connect() as conn:
-            # Convert RowMapping to dictionary for JSON serialization
-            def row_to_dict(row):
-                return {key: value for key, value in row._mapping.items()}
-            
-            # Base query for all requests
-            query = sqlalchemy.text("""
-                SELECT 
-                    rr.request_id, 
-                    rr.rental_name, 
-                    rr.additional_desc, 
-                    TO_CHAR(rr.start_date, 'YYYY-MM-DD') as start_date,
-                    TO_CHAR(rr.end_date, 'YYYY-MM-DD') as end_date,
-                    TO_CHAR(rr.start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(rr.end_time, 'HH12:MI AM') as end_time,
-                    rr.is_recurring, 
-                    rr.recurrence_rule,
-                    rr.request_date,
-                    CASE 
-                        WHEN rr.rental_status = 'pending' THEN 'pending'
-                        WHEN rr.rental_status = 'approved' THEN 'approved'
-                        WHEN rr.rental_status = 'denied' THEN 'declined'
-                        ELSE rr.rental_status
-                    END as request_status,
-                    rr.amount,
-                    rr.paid,
-                    rr.declined_reason,
-                    r.renter_id as user_id,
-                    r.renter_email as user_email,
-                    CONCAT(r.first_name, ' ', r.last_name) as user_name,
-                    r.phone as user_phone,
-                    EXTRACT(MONTH FROM rr.start_date) as month,
-                    EXTRACT(YEAR FROM rr.start_date) as year
-                FROM public.rental_request rr
-                JOIN public.renter r ON rr.user_id = r.renter_id
-                ORDER BY rr.start_date DESC, rr.start_time
-            """)
-            
-            requests = [row_to_dict(row) for row in conn.execute(query)]
-            
-            # Calculate payment summaries
-            paid_total = sum(float(request['amount'] or 0) for request in requests if request['paid'])
-            unpaid_total = sum(float(request['amount'] or 0) for request in requests 
-                          if not request['paid'] and request['amount'] and request['request_status'] == 'approved')
-            all_total = sum(float(request['amount'] or 0) for request in requests if request['amount'])
-            
-            return jsonify({
+            columns = ADMIN_REQUEST_COLUMNS + """,
+                r.renter_id as user_id,
+                EXTRACT(MONTH FROM rr.start_date) as month,
+                EXTRACT(YEAR FROM rr.start_date) as year"""
+            requests, next_cursor = fetch_admin_request_page(
+                conn, request.args, columns, descending=True)
+
+            result = {
                 "requests": requests,
-                "count": len(requests),
-                "payment_summary": {
-                    "paid": paid_total,
-                    "unpaid": unpaid_total,
-                    "total": all_total
-                },
+                "next_cursor": next_cursor,
                 "success": True
-            })
+            }
+
+            if not request.args.get('after'):
+                result["count"], result["payment_summary"] = payment_summary(conn, request.args)
+
+            return jsonify(result)
             
+    except ValueError as e:
+        return jsonify({"error": str(e), "success": False}), 400
     except sqlalchemy.exc.SQLAlchemyError as e:
         print(f"Database error fetching all requests: {str(e)}")
         return jsonify({
@@ -674,6 +852,28 @@ def admin_get_all_requests():
             "success": False
         }), 500
 
+@app.route('/api/admin/payment-summary')
+@require_admin(pool)
+def admin_payment_summary():
+    """Count and payment totals for the admin filters, without the requests themselves"""
+    try:
+        with pool.connect() as conn:
+            count, summary = payment_summary(conn, request.args)
+            return jsonify({
+                "count": count,
+                "payment_summary": summary,
+                "success": True
+            })
+            
+    except ValueError as e:
+        return jsonify({"error": str(e), "success": False}), 400
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        print(f"Database error fetching payment summary: {str(e)}")
+        return jsonify({
+            "error": "Database error occurred",
+            "success": False
+        }), 500
+
 @app.route('/api/admin/update-request/<int:request_id>', methods=['POST'])
 @require_admin(pool)
 def update_request_status(request_id):
@@ -687,6 +887,16 @@ def update_request_status(request_id):
             return jsonify({'error': 'Invalid status', 'success': False}), 400
             
         with pool.connect() as conn:
+            trans = conn.begin()
+
+            # Approved and admin requests block their slot, so it must still be free
+            if status != 'denied':
+                free = reserve_request_slot(conn, request_id)
+                if free is None:
+                    return jsonify({'error': 'Request not found', 'success': False}), 404
+                if not free:
+                    return jsonify({'error': 'Schedule conflicts with existing bookings', 'success': False}), 409
+
             # Update the request status
             update_query = sqlalchemy.text("""
                 UPDATE public.rental_request
@@ -708,6 +918,10 @@ def update_request_status(request_id):
             
             if result.rowcount == 0:
                 return jsonify({'error': 'Request not found', 'success': False}), 404
+
+            booking_written(conn, 'rental', request_id)
+            trans.commit()
+            booking_changed(conn, 'rental', request_id, occurrences_written=True)
                 
             return jsonify({
                 'success': True,
@@ -729,7 +943,7 @@ def mark_request_paid(request_id):
                 UPDATE public.rental_request
                 SET paid = true
                 WHERE request_id = :request_id
-                RETURNING request_id
+                RETURNING request_id, user_id
             """)
             
             result = conn.execute(
@@ -742,6 +956,10 @@ def mark_request_paid(request_id):
             
             if result.rowcount == 0:
                 return jsonify({'error': 'Request not found', 'success': False}), 404
+
+            updated = result.fetchone()
+            schedule_changed()
+            payments_changed([updated.request_id], updated.user_id)
                 
             return jsonify({'success': True})
             
@@ -755,21 +973,93 @@ def user_search():
     """Render the user search page"""
     return render_template('user_search.html')
 
+# Largest start..end window (inclusive) a calendar endpoint will expand
+MAX_EVENT_WINDOW_DAYS = 92
+
+def parse_event_window(args):
+    """
+    Read ?start=YYYY-MM-DD&end=YYYY-MM-DD from the query string. Without them
+    the current month is used, the window the calendars load first (so it
+    shares their cache entry).
+    """
+    start = args.get('start')
+    end = args.get('end')
+    if not start and not end:
+        today = datetime.now().date()
+        first_day = today.replace(day=1)
+        next_month = (first_day + timedelta(days=31)).replace(day=1)
+        return first_day, next_month - timedelta(days=1)
+    if not start or not end:
+        raise ValueError("Both start and end are required")
+
+    start_date = date.fromisoformat(start)
+    end_date = date.fromisoformat(end)
+    if end_date < start_date:
+        raise ValueError("end must not be before start")
+    if (end_date - start_date).days + 1 > MAX_EVENT_WINDOW_DAYS:
+        raise ValueError(f"At most {MAX_EVENT_WINDOW_DAYS} days can be requested at once")
+    return start_date, end_date
+
+# Largest page a listing endpoint returns when ?limit= is given
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(values):
+    """Opaque keyset cursor holding the sort key of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """The sort key list from encode_cursor; ValueError if it isn't one"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def parse_page_args(args, key_length):
+    """
+    Read ?limit=N&after=<cursor> for keyset pagination. Returns (limit, after):
+    limit is None when the whole list was asked for, after is the decoded
+    sort key of the previous page's last row or None.
+    """
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    after = args.get('after')
+    if after:
+        after = decode_cursor(after)
+        if len(after) != key_length:
+            raise ValueError("Invalid cursor")
+    return limit, after or None
+
+def parse_status_filter(args, allowed):
+    """Read ?status=a,b into a list of allowed statuses (all of them if absent)"""
+    statuses = [status.strip() for status in args.get('status', '').split(',') if status.strip()]
+    unknown = [status for status in statuses if status not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown status: {', '.join(unknown)}")
+    return statuses or list(allowed)
+
 @app.route('/api/user_events/<firebase_uid>')
 @require_authentication
+@require_own_uid
+@conditional_on_schedule
 def get_user_events(firebase_uid):
     """API endpoint to fetch pending and approved events specific to a user"""
     try:
-        # Validate the requesting user matches the requested UID
-        if session.get('firebase_uid') != firebase_uid and not session.get('is_admin'):
-            return {"error": "Unauthorized access"}, 403
-            
-        # Calculate date range (1 year back and 6 months forward)
-        today = datetime.now().date()
-        start_date = today - timedelta(days=365)
-        end_date = today + timedelta(days=180)
+        try:
+            start_date, end_date = parse_event_window(request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
         
         with pool.connect() as conn:
+            if USE_OCCURRENCE_TABLE:
+                rows = occurrences.fetch_user_calendar(conn, firebase_uid, start_date, end_date)
+                return {"events": [format_event(row, row['occurrence_date']) for row in rows]}
+
             # Query rental requests for the specific user - only pending and approved
             rental_query = sqlalchemy.text("""
                 SELECT 
@@ -787,11 +1077,7 @@ def get_user_events(firebase_uid):
                 INNER JOIN public.renter ON public.rental_request.user_id = renter.renter_id
                 WHERE renter.firebase_uid = :firebase_uid
                 AND rental_status IN ('pending', 'approved','admin')
-                AND (
-                    (is_recurring = false AND start_date BETWEEN :start AND :end)
-                    OR 
-                    (is_recurring = true AND end_date >= :start)
-                )
+                AND start_date <= :end AND end_date >= :start
             """)
             
             rentals = conn.execute(
@@ -800,11 +1086,11 @@ def get_user_events(firebase_uid):
             ).mappings().all()
             
             # Process recurring events
-            all_events = process_recurring_events(
+            all_events = list(process_recurring_events(
                 rentals,
                 start_date,
                 end_date
-            )
+            ))
             
             return {"events": all_events}
             
@@ -812,6 +1098,251 @@ def get_user_events(firebase_uid):
         print(f"Error fetching user events: {str(e)}")
         return {"error": str(e)}, 500
 
+def load_blocking_bookings():
+    """Load every booking that blocks the rink (approved/admin requests and admin events)"""
+    with pool.connect() as conn:
+        rental_query = sqlalchemy.text("""
+            SELECT 
+                request_id, 
+                rental_name, 
+                start_date, 
+                end_date, 
+                start_time, 
+                end_time, 
+                is_recurring,
+                recurrence_rule,
+                rental_status
+            FROM public.rental_request
+            WHERE 
+                rental_status IN ('approved', 'admin')
+        """)
+        rental_results = conn.execute(rental_query).fetchall()
+
+        admin_query = sqlalchemy.text("""
+            SELECT 
+                event_id, 
+                event_name, 
+                start_date, 
+                end_date, 
+                start_time, 
+                end_time,
+                is_recurring,
+                recurrence_rule
+            FROM public.admin_event
+        """)
+        admin_results = conn.execute(admin_query).fetchall()
+
+    bookings = [Booking('rental', *row) for row in rental_results]
+    bookings += [Booking('admin', *row) for row in admin_results]
+    print(f"Loaded {len(bookings)} bookings into the conflict index")
+    return bookings
+
+# CONFLICT_ENGINE=sql asks PostgreSQL for candidates on every check (needs
+# migrations/001_booking_ranges.sql), CONFLICT_ENGINE=occurrences scans the
+# materialized booking_occurrence table (needs migrations/002_booking_occurrence.sql),
+# CONFLICT_ENGINE=numpy checks an in-process snapshot with vectorized masks;
+# the default keeps an in-process interval-tree index.
+CONFLICT_ENGINE = os.environ.get('CONFLICT_ENGINE', 'index')
+
+# USE_OCCURRENCE_TABLE=1 keeps booking_occurrence current on every write and
+# serves the calendars from it instead of expanding recurrences per request.
+USE_OCCURRENCE_TABLE = os.environ.get('USE_OCCURRENCE_TABLE') == '1' or CONFLICT_ENGINE == 'occurrences'
+
+# Cache for the public /api/events calendar. EVENTS_CACHE_DIR (e.g.
+# /tmp/events-cache) shares it between the gunicorn workers of an instance;
+# without it each worker keeps its own. No store is shared between instances:
+# entries are keyed by the schedule version, so a write made anywhere stops
+# them being served within SCHEDULE_VERSION_TTL seconds.
+EVENTS_CACHE_TTL = int(os.environ.get('EVENTS_CACHE_TTL', 300))
+EVENTS_CACHE_DIR = os.environ.get('EVENTS_CACHE_DIR')
+
+if EVENTS_CACHE_DIR:
+    events_cache = ResponseCache(FileBackend(EVENTS_CACHE_DIR), EVENTS_CACHE_TTL)
+else:
+    events_cache = ResponseCache(MemoryBackend(int(os.environ.get('EVENTS_CACHE_SIZE', 256))), EVENTS_CACHE_TTL)
+
+# Version of the schedule behind the ETags and the /api/events cache keys, read
+# from the change log (migrations/003_schedule_change.sql). Its triggers log
+# every write to rental_request, admin_event and renter profiles, whichever
+# instance or function makes it, so the version changes with every write: the
+# newest change_id, plus how many of the last 1000 ids are visible, which also
+# changes when a transaction that took a lower id commits after a higher one.
+SCHEDULE_VERSION_QUERY = sqlalchemy.text("""
+    SELECT COALESCE(MAX(change_id), 0), COUNT(*)
+    FROM public.schedule_change
+    WHERE change_id > (SELECT COALESCE(MAX(change_id), 0) FROM public.schedule_change) - 1000
+""")
+
+def read_schedule_version():
+    with pool.connect() as conn:
+        latest, recent = conn.execute(SCHEDULE_VERSION_QUERY).fetchone()
+    return f"{latest}-{recent}"
+
+# Each process reuses the version it read for SCHEDULE_VERSION_TTL seconds, so
+# cache hits and 304s within that time make no round-trip to Cloud SQL; a hit
+# after that runs SCHEDULE_VERSION_QUERY once for the next TTL. That query is
+# what lets other instances' writes show up within the TTL rather than when
+# entries expire (see deploy.txt). Writes made here are seen at once
+# (schedule_changed).
+SCHEDULE_VERSION_TTL = float(os.environ.get('SCHEDULE_VERSION_TTL', 2))
+schedule_versions = ScheduleVersion(read_schedule_version, SCHEDULE_VERSION_TTL)
+
+def schedule_version():
+    """
+    The current schedule version, fixed for the request; None when it can't
+    be read (migration 003 not applied, or the database is unreachable)
+    """
+    if 'schedule_version' not in g:
+        try:
+            g.schedule_version = schedule_versions.get()
+        except Exception as e:
+            print(f"Error reading the schedule version: {str(e)}")
+            g.schedule_version = None
+    return g.schedule_version
+
+# Live schedule updates pushed over /api/stream/schedule, off unless
+# STREAM_MAX_SUBSCRIBERS is set, so a default deploy only polls. App Engine
+# standard buffers responses, so a stream would only reach the browser when it
+# closes, and schedule_hub only sees writes made in this process. Turn it on
+# only on a platform that streams responses and with a single instance;
+# otherwise the admin dashboard polls /api/admin/changes (it also polls, less
+# often, while a stream is open). Each open stream holds a gunicorn thread (not
+# a database connection) for up to STREAM_MAX_SECONDS, after which the browser
+# reconnects.
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 0))
+STREAM_MAX_SECONDS = int(os.environ.get('STREAM_MAX_SECONDS', 55))
+schedule_hub = ScheduleHub(max_subscribers=STREAM_MAX_SUBSCRIBERS)
+
+if CONFLICT_ENGINE == 'sql':
+    conflict_engine = SqlConflictEngine(pool)
+elif CONFLICT_ENGINE == 'occurrences':
+    conflict_engine = occurrences.OccurrenceConflictEngine(pool)
+elif CONFLICT_ENGINE == 'numpy':
+    from conflict_kernel import VectorConflictIndex
+    conflict_engine = VectorConflictIndex(load_blocking_bookings)
+else:
+    conflict_engine = ConflictIndex(load_blocking_bookings)
+
+def sync_rental_in_index(conn, request_id):
+    """Bring one rental request's entry in the conflict index in line with the database"""
+    row = conn.execute(sqlalchemy.text("""
+        SELECT request_id, rental_name, start_date, end_date, start_time, end_time,
+               is_recurring, recurrence_rule, rental_status, user_id
+        FROM public.rental_request
+        WHERE request_id = :request_id
+    """), {"request_id": request_id}).fetchone()
+
+    if row and row.rental_status in ('approved', 'admin'):
+        conflict_engine.upsert(Booking('rental', *row[:9]))
+    else:
+        conflict_engine.remove('rental', int(request_id))
+    return row
+
+def sync_admin_event_in_index(conn, event_id):
+    """Bring one admin event's entry in the conflict index in line with the database"""
+    row = conn.execute(sqlalchemy.text("""
+        SELECT event_id, event_name, start_date, end_date, start_time, end_time,
+               is_recurring, recurrence_rule
+        FROM public.admin_event
+        WHERE event_id = :event_id
+    """), {"event_id": event_id}).fetchone()
+
+    if row:
+        conflict_engine.upsert(Booking('admin', *row))
+    else:
+        conflict_engine.remove('admin', int(event_id))
+    return row
+
+def booking_written(conn, source, booking_id):
+    """
+    Call inside the transaction that inserted a booking, before it commits:
+    when enabled, writes the booking's occurrence rows in that transaction, so
+    they are committed together with it, while reserve_slot's locks are still
+    held. CONFLICT_ENGINE=occurrences finds conflicts in those rows only.
+    """
+    if USE_OCCURRENCE_TABLE:
+        occurrences.refresh_booking(conn, source, booking_id)
+
+def booking_changed(conn, source, booking_id, occurrences_written=False):
+    """
+    Call after any write to a rental request ('rental') or admin event ('admin'):
+    updates the conflict index and, when enabled, the booking's occurrence rows
+    (unless booking_written already did), and pushes the change to stream
+    subscribers. Call it once the write is committed.
+    """
+    if source == 'admin':
+        row = sync_admin_event_in_index(conn, booking_id)
+    else:
+        row = sync_rental_in_index(conn, booking_id)
+    if USE_OCCURRENCE_TABLE and not occurrences_written:
+        occurrences.refresh_booking(conn, source, booking_id)
+    schedule_changed()
+    publish_booking_change(source, booking_id, row)
+
+def publish_booking_change(source, booking_id, row):
+    """
+    Push a 'booking' event with the booking's current row (or null once it is
+    gone). Approved bookings and admin events go to everyone; other rental
+    statuses go to admins and the renter, and everyone else just hears that
+    the booking is no longer on the calendar.
+    """
+    data = {"source": source, "id": int(booking_id), "booking": None}
+    public_data = None
+    owner = None
+    public = row is None or source == 'admin'
+    if row is not None:
+        status = 'admin' if source == 'admin' else row.rental_status
+        data["booking"] = {
+            "name": row[1],
+            "start_date": row.start_date.isoformat(),
+            "end_date": row.end_date.isoformat(),
+            "start_time": row.start_time.isoformat(timespec='minutes'),
+            "end_time": row.end_time.isoformat(timespec='minutes'),
+            "is_recurring": row.is_recurring,
+            "recurrence_rule": row.recurrence_rule,
+            "status": status
+        }
+        if source == 'rental':
+            owner = row.user_id
+            public = status in ('approved', 'admin')
+            public_data = {"source": source, "id": int(booking_id), "booking": None}
+    schedule_hub.publish('booking', data, owner=owner, public=public, public_data=public_data)
+
+def payments_changed(request_ids, renter_id=None):
+    """Push a 'payment' event to admins and the paying renter after requests are marked paid"""
+    schedule_hub.publish('payment', {"request_ids": [int(i) for i in request_ids], "paid": True},
+                         owner=renter_id)
+
+def schedule_changed():
+    """
+    Call after any write to rental_request, admin_event or a renter profile.
+    The schedule version already moved (so ETags stop matching everywhere);
+    this frees this instance's cached /api/events responses and its memoized
+    version at once.
+    """
+    schedule_versions.forget()
+    events_cache.invalidate()
+
+def parse_conflict_proposal(data):
+    """Build a proposed Booking from conflict-check form data"""
+    required_fields = ['start_date', 'end_date', 'start_time', 'end_time']
+    for field in required_fields:
+        if field not in data:
+            raise ValueError(f"Missing required field: {field}")
+
+    is_recurring = data.get('is_recurring', False)
+    return Booking(
+        None,
+        None,
+        None,
+        datetime.strptime(data['start_date'], '%m/%d/%Y').date(),
+        datetime.strptime(data['end_date'], '%m/%d/%Y').date(),
+        datetime.strptime(data['start_time'], '%I:%M %p').time(),
+        datetime.strptime(data['end_time'], '%I:%M %p').time(),
+        is_recurring,
+        data.get('recurrence_rule')
+    )
+
 @app.route('/api/check_conflicts', methods=['POST'])
 @require_authentication
 def check_conflicts():
@@ -819,305 +1350,121 @@ def check_conflicts():
         data = request.get_json()
         print("Received conflict check data:", data)
         
-        # Validate required fields
-        required_fields = ['start_date', 'end_date', 'start_time', 'end_time']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-
-        # Convert strings to date and time objects
-        proposed_start_date = datetime.strptime(data['start_date'], '%m/%d/%Y').date()
-        proposed_end_date = datetime.strptime(data['end_date'], '%m/%d/%Y').date()
-        proposed_start_time = datetime.strptime(data['start_time'], '%I:%M %p').time()
-        proposed_end_time = datetime.strptime(data['end_time'], '%I:%M %p').time()
-
-        proposed_is_recurring = data.get('is_recurring', False)
-        proposed_recurrence_rule = data.get('recurrence_rule')
-
-        with pool.connect() as conn:
-            rental_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    start_date, 
-                    end_date, 
-                    start_time, 
-                    end_time, 
-                    is_recurring,
-                    recurrence_rule,
-                    rental_status
-                FROM public.rental_request
-                WHERE 
-                    rental_status IN ('approved', 'admin')
-            """)
-            rental_results = conn.execute(rental_query).fetchall()
-
-            admin_query = sqlalchemy.text("""
-                SELECT 
-                    event_id, 
-                    event_name, 
-                    start_date, 
-                    end_date, 
-                    start_time, 
-                    end_time,
-                    is_recurring,
-                    recurrence_rule
-                FROM public.admin_event
-            """)
-            admin_results = conn.execute(admin_query).fetchall()
-
-            rental_conflicts_list = []
-            admin_conflicts_list = []
-
-            def times_overlap(t1_start, t1_end, t2_start, t2_end):
-                return t1_start <= t2_end and t1_end >= t2_start
-
-            def days_of_week_match(d1, d2):
-                return d1.weekday() == d2.weekday()
-
-            for rental in rental_results:
-                rental_id, rental_name, rental_start_date, rental_end_date, rental_start_time, rental_end_time, rental_is_recurring, rental_recurrence_rule, rental_status = rental
-                has_conflict = False
-
-                if not proposed_is_recurring and not rental_is_recurring:
-                    dates_overlap = proposed_start_date <= rental_end_date and proposed_end_date >= rental_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    has_conflict = dates_overlap and time_overlap
-
-                elif not proposed_is_recurring and rental_is_recurring:
-                    in_range = rental_start_date <= proposed_start_date <= rental_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    day_matches = rental_recurrence_rule != 'weekly' or days_of_week_match(proposed_start_date, rental_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and not rental_is_recurring:
-                    in_range = proposed_start_date <= rental_start_date <= proposed_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    day_matches = proposed_recurrence_rule != 'weekly' or days_of_week_match(rental_start_date, proposed_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and rental_is_recurring:
-                    dates_overlap = proposed_start_date <= rental_end_date and proposed_end_date >= rental_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-
-                    if proposed_recurrence_rule == 'daily' or rental_recurrence_rule == 'daily':
-                        pattern_conflict = True
-                    elif proposed_recurrence_rule == 'weekly' and rental_recurrence_rule == 'weekly':
-                        pattern_conflict = days_of_week_match(proposed_start_date, rental_start_date)
-                    else:
-                        pattern_conflict = True
-
-                    has_conflict = dates_overlap and time_overlap and pattern_conflict
-
-                if has_conflict:
-                    rental_conflicts_list.append({
-                        "request_id": rental_id,
-                        "rental_name": rental_name,
-                        "start_date": rental_start_date.isoformat(),
-                        "end_date": rental_end_date.isoformat(),
-                        "start_time": str(rental_start_time),
-                        "end_time": str(rental_end_time),
-                        "is_recurring": rental_is_recurring,
-                        "recurrence_rule": rental_recurrence_rule,
-                        "rental_status": rental_status
-                    })
+        try:
+            proposed = parse_conflict_proposal(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-            for admin in admin_results:
-                event_id, event_name, event_start_date, event_end_date, event_start_time, event_end_time, event_is_recurring, event_recurrence_rule = admin
-                has_conflict = False
-
-                if not proposed_is_recurring and not event_is_recurring:
-                    dates_overlap = proposed_start_date <= event_end_date and proposed_end_date >= event_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    has_conflict = dates_overlap and time_overlap
-
-                elif not proposed_is_recurring and event_is_recurring:
-                    in_range = event_start_date <= proposed_start_date <= event_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    day_matches = event_recurrence_rule != 'weekly' or days_of_week_match(proposed_start_date, event_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and not event_is_recurring:
-                    in_range = proposed_start_date <= event_start_date <= proposed_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    day_matches = proposed_recurrence_rule != 'weekly' or days_of_week_match(event_start_date, proposed_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and event_is_recurring:
-                    dates_overlap = proposed_start_date <= event_end_date and proposed_end_date >= event_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-
-                    if proposed_recurrence_rule == 'daily' or event_recurrence_rule == 'daily':
-                        pattern_conflict = True
-                    elif proposed_recurrence_rule == 'weekly' and event_recurrence_rule == 'weekly':
-                        pattern_conflict = days_of_week_match(proposed_start_date, event_start_date)
-                    else:
-                        pattern_conflict = True
-
-                    has_conflict = dates_overlap and time_overlap and pattern_conflict
-
-                if has_conflict:
-                    admin_conflicts_list.append({
-                        "event_id": event_id,
-                        "event_name": event_name,
-                        "start_date": event_start_date.isoformat(),
-                        "end_date": event_end_date.isoformat(),
-                        "start_time": str(event_start_time),
-                        "end_time": str(event_end_time),
-                        "is_recurring": event_is_recurring,
-                        "recurrence_rule": event_recurrence_rule
-                    })
+        conflicts = conflict_engine.find_conflicts(proposed)
+        rental_conflicts_list = [b.to_conflict_dict(day) for b, day in conflicts if b.source == 'rental']
+        admin_conflicts_list = [b.to_conflict_dict(day) for b, day in conflicts if b.source == 'admin']
 
-            return jsonify({
-                "has_conflicts": bool(rental_conflicts_list or admin_conflicts_list),
-                "rental_conflicts": rental_conflicts_list,
-                "admin_conflicts": admin_conflicts_list
-            })
+        return jsonify({
+            "has_conflicts": bool(rental_conflicts_list or admin_conflicts_list),
+            "rental_conflicts": rental_conflicts_list,
+            "admin_conflicts": admin_conflicts_list
+        })
 
     except Exception as e:
         print("Error checking conflicts:", str(e))
         return jsonify({"error": str(e)}), 500
 
-def check_for_conflicts(data):
+# Upper bound on the slots one /api/check_conflicts/batch call may check
+MAX_BATCH_SLOTS = 100
+
+@app.route('/api/check_conflicts/batch', methods=['POST'])
+@require_authentication
+def check_conflicts_batch():
+    """Check a list of proposed slots against the schedule and against each other"""
     try:
-        data = request.get_json()
-        print("Received conflict check data:", data)
-        
-        # Validate required fields
-        required_fields = ['start_date', 'end_date', 'start_time', 'end_time']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        data = request.get_json() or {}
+        slots = data.get('slots')
 
-        # Convert strings to date and time objects
-        proposed_start_date = datetime.strptime(data['start_date'], '%m/%d/%Y').date()
-        proposed_end_date = datetime.strptime(data['end_date'], '%m/%d/%Y').date()
-        proposed_start_time = datetime.strptime(data['start_time'], '%I:%M %p').time()
-        proposed_end_time = datetime.strptime(data['end_time'], '%I:%M %p').time()
+        if not isinstance(slots, list) or not slots:
+            return jsonify({"error": "Missing required field: slots"}), 400
+        if len(slots) > MAX_BATCH_SLOTS:
+            return jsonify({"error": f"At most {MAX_BATCH_SLOTS} slots can be checked at once"}), 400
 
-        proposed_is_recurring = data.get('is_recurring', False)
-        proposed_recurrence_rule = data.get('recurrence_rule')
+        print(f"Received batch conflict check for {len(slots)} slots")
 
-        with pool.connect() as conn:
-            rental_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    start_date, 
-                    end_date, 
-                    start_time, 
-                    end_time, 
-                    is_recurring,
-                    recurrence_rule,
-                    rental_status
-                FROM public.rental_request
-                WHERE 
-                    rental_status IN ('approved', 'admin')
-            """)
-            rental_results = conn.execute(rental_query).fetchall()
+        results = [None] * len(slots)
+        proposals = []
+        positions = []
+        for i, slot in enumerate(slots):
+            try:
+                proposals.append(parse_conflict_proposal(slot))
+                positions.append(i)
+            except (TypeError, ValueError) as e:
+                results[i] = {
+                    "index": i,
+                    "error": str(e),
+                    "has_conflicts": False,
+                    "rental_conflicts": [],
+                    "admin_conflicts": [],
+                    "batch_conflicts": []
+                }
 
-            admin_query = sqlalchemy.text("""
-                SELECT 
-                    event_id, 
-                    event_name, 
-                    start_date, 
-                    end_date, 
-                    start_time, 
-                    end_time,
-                    is_recurring,
-                    recurrence_rule
-                FROM public.admin_event
-            """)
-            admin_results = conn.execute(admin_query).fetchall()
-
-            rental_conflicts_list = []
-            admin_conflicts_list = []
-
-            def times_overlap(t1_start, t1_end, t2_start, t2_end):
-                return t1_start <= t2_end and t1_end >= t2_start
-
-            def days_of_week_match(d1, d2):
-                return d1.weekday() == d2.weekday()
-
-            for rental in rental_results:
-                rental_id, rental_name, rental_start_date, rental_end_date, rental_start_time, rental_end_time, rental_is_recurring, rental_recurrence_rule, rental_status = rental
-                has_conflict = False
-
-                if not proposed_is_recurring and not rental_is_recurring:
-                    dates_overlap = proposed_start_date <= rental_end_date and proposed_end_date >= rental_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    has_conflict = dates_overlap and time_overlap
-
-                elif not proposed_is_recurring and rental_is_recurring:
-                    in_range = rental_start_date <= proposed_start_date <= rental_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    day_matches = rental_recurrence_rule != 'weekly' or days_of_week_match(proposed_start_date, rental_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and not rental_is_recurring:
-                    in_range = proposed_start_date <= rental_start_date <= proposed_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-                    day_matches = proposed_recurrence_rule != 'weekly' or days_of_week_match(rental_start_date, proposed_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and rental_is_recurring:
-                    dates_overlap = proposed_start_date <= rental_end_date and proposed_end_date >= rental_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, rental_start_time, rental_end_time)
-
-                    if proposed_recurrence_rule == 'daily' or rental_recurrence_rule == 'daily':
-                        pattern_conflict = True
-                    elif proposed_recurrence_rule == 'weekly' and rental_recurrence_rule == 'weekly':
-                        pattern_conflict = days_of_week_match(proposed_start_date, rental_start_date)
-                    else:
-                        pattern_conflict = True
-
-                    has_conflict = dates_overlap and time_overlap and pattern_conflict
-
-                if has_conflict:
-                    return True
-
-            for admin in admin_results:
-                event_id, event_name, event_start_date, event_end_date, event_start_time, event_end_time, event_is_recurring, event_recurrence_rule = admin
-                has_conflict = False
-
-                if not proposed_is_recurring and not event_is_recurring:
-                    dates_overlap = proposed_start_date <= event_end_date and proposed_end_date >= event_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    has_conflict = dates_overlap and time_overlap
-
-                elif not proposed_is_recurring and event_is_recurring:
-                    in_range = event_start_date <= proposed_start_date <= event_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    day_matches = event_recurrence_rule != 'weekly' or days_of_week_match(proposed_start_date, event_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and not event_is_recurring:
-                    in_range = proposed_start_date <= event_start_date <= proposed_end_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-                    day_matches = proposed_recurrence_rule != 'weekly' or days_of_week_match(event_start_date, proposed_start_date)
-                    has_conflict = in_range and time_overlap and day_matches
-
-                elif proposed_is_recurring and event_is_recurring:
-                    dates_overlap = proposed_start_date <= event_end_date and proposed_end_date >= event_start_date
-                    time_overlap = times_overlap(proposed_start_time, proposed_end_time, event_start_time, event_end_time)
-
-                    if proposed_recurrence_rule == 'daily' or event_recurrence_rule == 'daily':
-                        pattern_conflict = True
-                    elif proposed_recurrence_rule == 'weekly' and event_recurrence_rule == 'weekly':
-                        pattern_conflict = days_of_week_match(proposed_start_date, event_start_date)
-                    else:
-                        pattern_conflict = True
-
-                    has_conflict = dates_overlap and time_overlap and pattern_conflict
-
-                if has_conflict:
-                    return True
-        return False
+        existing = conflict_engine.find_conflicts_many(proposals)
+        within = collisions_within(proposals)
+
+        for n, i in enumerate(positions):
+            rental_conflicts_list = [b.to_conflict_dict(day) for b, day in existing[n] if b.source == 'rental']
+            admin_conflicts_list = [b.to_conflict_dict(day) for b, day in existing[n] if b.source == 'admin']
+            batch_conflicts_list = [
+                {"index": positions[other], "first_conflict_date": day.isoformat()}
+                for other, day in within[n]
+            ]
+            results[i] = {
+                "index": i,
+                "has_conflicts": bool(rental_conflicts_list or admin_conflicts_list or batch_conflicts_list),
+                "rental_conflicts": rental_conflicts_list,
+                "admin_conflicts": admin_conflicts_list,
+                "batch_conflicts": batch_conflicts_list
+            }
+
+        return jsonify({
+            "has_conflicts": any(result["has_conflicts"] for result in results),
+            "results": results
+        })
 
     except Exception as e:
-        print("Error checking conflicts:", str(e))
+        print("Error checking batch conflicts:", str(e))
         return jsonify({"error": str(e)}), 500
 
+def reserve_slot(conn, proposed):
+    """
+    Lock the proposal's slot and return True if it is still free. Call inside a
+    transaction and INSERT the booking in that same transaction. A proposal
+    that is a stored booking (source and booking_id set) doesn't conflict
+    with itself.
+    """
+    if CONFLICT_ENGINE == 'sql':
+        fetch = sql_conflicts.fetch_candidates
+    elif CONFLICT_ENGINE == 'occurrences':
+        fetch = occurrences.fetch_candidates
+    else:
+        fetch = fetch_overlapping
+    conflicts = lock_and_find_conflicts(conn, proposed, fetch)
+    return not [booking for booking, _ in conflicts if booking.key != proposed.key]
+
+def reserve_request_slot(conn, request_id):
+    """
+    reserve_slot for a stored rental request about to become blocking
+    (approved or admin): locks the request's row and its slot. Returns
+    None if there is no such request, else whether the slot is free. Call
+    inside the transaction that updates its status.
+    """
+    row = conn.execute(sqlalchemy.text("""
+        SELECT request_id, rental_name, start_date, end_date, start_time, end_time,
+               is_recurring, recurrence_rule, rental_status
+        FROM public.rental_request
+        WHERE request_id = :request_id
+        FOR UPDATE
+    """), {"request_id": request_id}).fetchone()
+    if not row:
+        return None
+    return reserve_slot(conn, Booking('rental', *row))
+
 @app.route('/api/submit_request', methods=['POST'])
 @limiter.limit("10 per day")
 @require_authentication
@@ -1142,12 +1489,12 @@ def submit_request():
             'recurrence_rule': data.get('recurrence_rule', None) if data['is_recurring'] else None
         }
         
-        conflict_result = check_for_conflicts(conflict_data)
-        
-        if conflict_result:
-            return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
+        proposed = parse_conflict_proposal(conflict_data)
 
         with pool.connect() as conn:
+            # Check and insert in one transaction so concurrent submits can't double book
+            trans = conn.begin()
+
             # Get user_id from firebase_uid
             user_query = sqlalchemy.text("""
                 SELECT renter_id FROM public.renter 
@@ -1162,6 +1509,9 @@ def submit_request():
                 return jsonify({"error": "User not found"}), 404
                 
             user_id = user_result[0]
+
+            if not reserve_slot(conn, proposed):
+                return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
             
             # Insert the new request
             insert_query = sqlalchemy.text("""
@@ -1192,10 +1542,14 @@ def submit_request():
                 }
             )
             
+            request_id = result.fetchone()[0]
+            booking_written(conn, 'rental', request_id)
+            trans.commit()
+            booking_changed(conn, 'rental', request_id, occurrences_written=True)
             
             return jsonify({
                 "message": "Request submitted successfully",
-                "request_id": result.fetchone()[0]
+                "request_id": request_id
             })
             
     except Exception as e:
@@ -1225,12 +1579,12 @@ def submit_event():
             'recurrence_rule': data.get('recurrence_rule', None) if data['is_recurring'] else None
         }
 
-        conflict_result = check_for_conflicts(conflict_data)
-        
-        if conflict_result:
-            return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
+        proposed = parse_conflict_proposal(conflict_data)
 
         with pool.connect() as conn:
+            # Check and insert in one transaction so concurrent submits can't double book
+            trans = conn.begin()
+
             # Get user_id from firebase_uid
             user_query = sqlalchemy.text("""
                 SELECT admin_id FROM public.admin
@@ -1245,6 +1599,9 @@ def submit_event():
                 return jsonify({"error": "User not found"}), 404
                 
             admin_id = user_result[0]
+
+            if not reserve_slot(conn, proposed):
+                return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
             
             # Insert the new request
             insert_query = sqlalchemy.text("""
@@ -1274,10 +1631,14 @@ def submit_event():
                     "recurrence_rule": data.get('recurrence_rule', 'daily')                }
             )
             
+            event_id = result.fetchone()[0]
+            booking_written(conn, 'admin', event_id)
+            trans.commit()
+            booking_changed(conn, 'admin', event_id, occurrences_written=True)
             
             return jsonify({
                 "message": "Request submitted successfully",
-                "request_id": result.fetchone()[0]
+                "request_id": event_id
             })
             
     except Exception as e:
@@ -1342,12 +1703,11 @@ def submit_admin_request():
             'recurrence_rule': data.get('recurrence_rule', None) if data['is_recurring'] else None
         }
 
-        conflict_result = check_for_conflicts(conflict_data)
-        
-        if conflict_result:
-            return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
+        proposed = parse_conflict_proposal(conflict_data)
 
         with pool.connect() as conn:
+            # Check and insert in one transaction so concurrent submits can't double book
+            trans = conn.begin()
             
             # 1. Get user_id from email
             user_query = sqlalchemy.text("""
@@ -1363,6 +1723,9 @@ def submit_admin_request():
                 return jsonify({"error": "Target user not found"}), 404
                 
             user_id = user_result[0]
+
+            if not reserve_slot(conn, proposed):
+                return jsonify({"error": "Schedule conflicts with existing bookings"}), 409
             
             # 2. Insert the admin request
             insert_query = sqlalchemy.text("""
@@ -1395,6 +1758,9 @@ def submit_admin_request():
             )
             
             request_id = result.fetchone()[0]
+            booking_written(conn, 'rental', request_id)
+            trans.commit()
+            booking_changed(conn, 'rental', request_id, occurrences_written=True)
             
             # Send email notification to the user
             user_email = data['user_email']
@@ -1421,37 +1787,17 @@ def submit_admin_request():
             </html>
             """
             
-            # Send email via Gmail API
-            service = get_gmail_service()
-            if not service:
-                print("Error: Gmail service unavailable")
-                return jsonify({
-                    'success': True, 
-                    'message': 'Admin request created but email notification failed to send',
-                    'request_id': request_id,
-                    'email_sent': False
-                })
-            
-            message = MIMEText(email_body, 'html')
-            message['to'] = user_email
-            message['subject'] = email_subject
+            # Sent in the background (see queue_email)
+            email_id = queue_email(user_email, email_subject, email_body, conn=conn)
             
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            message_object = {'raw': raw_message}
-            
-            sent_message = service.users().messages().send(
-                userId='me', 
-                body=message_object
-            ).execute()
-            
-            print(f"Admin request notification email sent successfully to {user_email}")
+            print(f"Admin request notification email queued for {user_email}")
             
             return jsonify({
                 "success": True,
-                "message": "Admin request submitted successfully and notification sent",
+                "message": "Admin request submitted successfully and notification queued",
                 "request_id": request_id,
-                "email_sent": True,
-                "email_id": sent_message.get('id', None)
+                "email_queued": True,
+                "email_id": email_id
             })
         
     except Exception as e:
@@ -1459,142 +1805,91 @@ def submit_admin_request():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# Statuses the request listings return (as request_status) and filter on, and
+# the rental_status each comes from, in the order /api/user_requests lists them
+REQUEST_STATUSES = {'pending': 'pending', 'approved': 'approved', 'declined': 'denied', 'admin': 'admin'}
+REQUEST_STATUS_RANK_SQL = "CASE rr.rental_status " + " ".join(
+    f"WHEN '{rental_status}' THEN {rank}" for rank, rental_status in enumerate(REQUEST_STATUSES.values())
+) + " END"
+
 @app.route('/api/user_requests/<firebase_uid>')
 @require_authentication
+@require_own_uid
+@conditional_on_schedule
 def get_user_requests(firebase_uid):
-    """Get all requests (pending, accepted, and declined) for a specific user"""
+    """
+    Get a user's requests (pending, approved, declined and admin), optionally
+    only ?status=a,b, a page at a time with ?limit=N&after=<next_cursor>
+    """
     if not firebase_uid or not isinstance(firebase_uid, str):
         return jsonify({"error": "Invalid firebase_uid"}), 400
 
     try:
+        statuses = parse_status_filter(request.args, REQUEST_STATUSES)
+        limit, after = parse_page_args(request.args, 4)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        conditions = ["rr.rental_status IN :rental_statuses"]
+        params = {
+            "firebase_uid": firebase_uid,
+            "rental_statuses": [REQUEST_STATUSES[status] for status in statuses]
+        }
+        if after:
+            conditions.append(f"""({REQUEST_STATUS_RANK_SQL}, rr.start_date, rr.start_time, rr.request_id)
+                > (:after_rank, CAST(:after_date AS date), CAST(:after_time AS time), :after_id)""")
+            params.update(after_rank=after[0], after_date=after[1], after_time=after[2], after_id=after[3])
+
+        # One round trip: the renter lookup and every status at once. The LEFT
+        # JOIN still returns a (null) row for a renter with no requests.
+        query = sqlalchemy.text(f"""
+            SELECT
+                rr.request_id,
+                rr.rental_name,
+                rr.additional_desc,
+                TO_CHAR(rr.start_date, 'MM/DD/YYYY') as start_date,
+                TO_CHAR(rr.end_date, 'MM/DD/YYYY') as end_date,
+                TO_CHAR(rr.start_time, 'HH12:MI AM') as start_time,
+                TO_CHAR(rr.end_time, 'HH12:MI AM') as end_time,
+                rr.is_recurring,
+                rr.recurrence_rule,
+                rr.request_date,
+                CASE WHEN rr.rental_status = 'denied' THEN 'declined' ELSE rr.rental_status END as request_status,
+                CASE WHEN rr.rental_status = 'denied' THEN rr.declined_reason END as declined_reason,
+                {REQUEST_STATUS_RANK_SQL} as status_rank,
+                rr.start_date::text as sort_date,
+                rr.start_time::text as sort_time
+            FROM public.renter r
+            LEFT JOIN public.rental_request rr
+                ON rr.user_id = r.renter_id
+                AND {" AND ".join(conditions)}
+            WHERE r.firebase_uid = :firebase_uid
+            ORDER BY status_rank, rr.start_date, rr.start_time, rr.request_id
+            {"LIMIT :limit" if limit else ""}
+        """).bindparams(bindparam('rental_statuses', expanding=True))
+        if limit:
+            params["limit"] = limit + 1
+
         with pool.connect() as conn:
-            # Get user_id from firebase_uid
-            user_query = sqlalchemy.text("""
-                SELECT renter_id FROM public.renter 
-                WHERE firebase_uid = :firebase_uid
-            """)
-            user_result = conn.execute(
-                user_query,
-                {"firebase_uid": firebase_uid}
-            ).fetchone()
-            
-            if not user_result:
-                return jsonify({"error": "User not found"}), 404
-                
-            user_id = user_result[0]
-            
-            # Convert RowMapping to dictionary for JSON serialization
-            def row_to_dict(row):
-                return {key: value for key, value in row._mapping.items()}
-            
-            # Get pending requests
-            pending_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    additional_desc, 
-                    TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
-                    TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
-                    TO_CHAR(start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(end_time, 'HH12:MI AM') as end_time,
-                    is_recurring, 
-                    recurrence_rule,
-                    request_date,
-                    'pending' as request_status,
-                    NULL as declined_reason
-                FROM public.rental_request
-                WHERE user_id = :user_id 
-                AND rental_status = 'pending'
-                ORDER BY start_date, start_time
-            """)
-            
-            pending = [row_to_dict(row) for row in conn.execute(
-                pending_query,
-                {"user_id": user_id}
-            )]
-            
-            # Get accepted requests
-            accepted_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    additional_desc, 
-                    TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
-                    TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
-                    TO_CHAR(start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(end_time, 'HH12:MI AM') as end_time,
-                    is_recurring, 
-                    recurrence_rule,
-                    request_date,
-                    'approved' as request_status,
-                    NULL as declined_reason
-                FROM public.rental_request
-                WHERE user_id = :user_id 
-                AND rental_status = 'approved'
-                ORDER BY start_date, start_time
-            """)
-            
-            accepted = [row_to_dict(row) for row in conn.execute(
-                accepted_query,
-                {"user_id": user_id}
-            )]
+            rows = conn.execute(query, params).mappings().all()
+
+        if not rows:
+            return jsonify({"error": "User not found"}), 404
+
+        rows = [row for row in rows if row['request_id'] is not None]
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last['status_rank'], last['sort_date'], last['sort_time'], last['request_id']])
+
+        hidden = ('status_rank', 'sort_date', 'sort_time')
+        return jsonify({
+            "requests": [{key: value for key, value in row.items() if key not in hidden} for row in rows],
+            "next_cursor": next_cursor
+        })
 
-            # Get admin requests
-            admin_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    additional_desc, 
-                    TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
-                    TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
-                    TO_CHAR(start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(end_time, 'HH12:MI AM') as end_time,
-                    is_recurring, 
-                    recurrence_rule,
-                    request_date,
-                    'admin' as request_status,
-                    NULL as declined_reason
-                FROM public.rental_request
-                WHERE user_id = :user_id 
-                AND rental_status = 'admin'
-                ORDER BY start_date, start_time
-            """)
-            
-            admin = [row_to_dict(row) for row in conn.execute(
-                admin_query,
-                {"user_id": user_id}
-            )]
-            
-            # Get declined requests with reason
-            declined_query = sqlalchemy.text("""
-                SELECT 
-                    request_id, 
-                    rental_name, 
-                    additional_desc, 
-                    TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
-                    TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
-                    TO_CHAR(start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(end_time, 'HH12:MI AM') as end_time,
-                    is_recurring, 
-                    recurrence_rule,
-                    request_date,
-                    'declined' as request_status,
-                    declined_reason
-                FROM public.rental_request
-                WHERE user_id = :user_id 
-                AND rental_status = 'denied'
-                ORDER BY start_date, start_time
-            """)
-            
-            declined = [row_to_dict(row) for row in conn.execute(
-                declined_query,
-                {"user_id": user_id}
-            )]
-            
-            return jsonify({
-                "requests": pending + accepted + declined + admin
-            })
-            
     except sqlalchemy.exc.SQLAlchemyError as e:
         print(f"Database error fetching requests for {firebase_uid}: {str(e)}")
         return jsonify({"error": "Database error occurred"}), 500
@@ -1661,21 +1956,13 @@ def admin_get_user_requests(user_id):
             user_result = conn.execute(user_query, {"user_id": user_id}).fetchone()
             user = row_to_dict(user_result) if user_result else None
             
-            # Calculate payment summaries
-            paid_total = sum(float(request['amount'] or 0) for request in requests if request['paid'])
-            unpaid_total = sum(float(request['amount'] or 0) for request in requests 
-                          if not request['paid'] and request['amount'] and request['request_status'] in ('approved','admin'))
-            all_total = sum(float(request['amount'] or 0) for request in requests if request['amount'])
+            _, summary = payment_summary(conn, {"user_id": user_id}, unpaid_statuses=('approved', 'admin'))
             
             return jsonify({
                 "requests": requests,
                 "user": user,
                 "count": len(requests),
-                "payment_summary": {
-                    "paid": paid_total,
-                    "unpaid": unpaid_total,
-                    "total": all_total
-                },
+                "payment_summary": summary,
                 "success": True
             })
             
@@ -1692,8 +1979,203 @@ def admin_get_user_requests(user_id):
             "success": False
         }), 500
 
+# Row shapes of the admin dashboard lists, shared with /api/admin/changes
+ADMIN_EVENT_SELECT = """
+        SELECT 
+            event_id,
+            event_name as rental_name,
+            additional_desc as description,
+            TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
+            TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
+            TO_CHAR(start_time, 'HH12:MI AM') as start_time,
+            TO_CHAR(end_time, 'HH12:MI AM') as end_time,
+            is_recurring,
+            recurrence_rule,
+            created_date,
+            admin_id
+        FROM public.admin_event
+"""
+
+ADMIN_REQUEST_COLUMNS = """
+            rr.request_id, 
+            rr.rental_name, 
+            rr.additional_desc, 
+            TO_CHAR(rr.start_date, 'YYYY-MM-DD') as start_date,
+            TO_CHAR(rr.end_date, 'YYYY-MM-DD') as end_date,
+            TO_CHAR(rr.start_time, 'HH12:MI AM') as start_time,
+            TO_CHAR(rr.end_time, 'HH12:MI AM') as end_time,
+            rr.is_recurring, 
+            rr.recurrence_rule,
+            rr.request_date as request_date,
+            CASE 
+                WHEN rr.rental_status = 'pending' THEN 'pending'
+                WHEN rr.rental_status = 'approved' THEN 'approved'
+                WHEN rr.rental_status = 'denied' THEN 'declined'
+                ELSE rr.rental_status
+            END as request_status,
+            rr.amount as amount,
+            rr.paid as paid,
+            rr.declined_reason,
+            r.renter_email as user_email,
+            CONCAT(r.first_name, ' ', r.last_name) as user_name,
+            r.phone as user_phone
+"""
+
+ADMIN_REQUEST_FROM = """
+        FROM public.rental_request rr
+        JOIN public.renter r ON rr.user_id = r.renter_id
+"""
+
+ADMIN_REQUEST_SELECT = "SELECT" + ADMIN_REQUEST_COLUMNS + ADMIN_REQUEST_FROM
+
+# Default page size of the admin request listings (?limit= overrides it)
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', 100))
+
+def parse_admin_filters(args):
+    """
+    Validated values of the admin listings' filters: ?status=a,b ?payment=paid|unpaid
+    ?month=M ?year=YYYY ?user_id=N. Raises ValueError for bad values.
+    """
+    filters = {}
+    if args.get('status'):
+        statuses = parse_status_filter(args, REQUEST_STATUSES)
+        filters["rental_statuses"] = [REQUEST_STATUSES[status] for status in statuses]
+
+    payment = args.get('payment')
+    if payment and payment not in ('paid', 'unpaid'):
+        raise ValueError("payment must be paid or unpaid")
+    filters["payment"] = payment
+
+    month = int(args['month']) if args.get('month') else None
+    year = int(args['year']) if args.get('year') else None
+    if month is not None and not 1 <= month <= 12:
+        raise ValueError("month must be between 1 and 12")
+    if year:
+        # Date ranges rather than EXTRACT so the indexes apply
+        if month:
+            filters["first_day"] = date(year, month, 1)
+            filters["after_last_day"] = date(year + month // 12, month % 12 + 1, 1)
+        else:
+            filters["first_day"], filters["after_last_day"] = date(year, 1, 1), date(year + 1, 1, 1)
+    elif month:
+        filters["month"] = month
+
+    if args.get('user_id'):
+        filters["user_id"] = int(args['user_id'])
+    return filters
+
+def date_and_user_conditions(filters, date_column, user_column):
+    """SQL conditions and parameters for the month/year and user_id filters"""
+    conditions = []
+    params = {}
+    if "first_day" in filters:
+        conditions.append(f"{date_column} >= :first_day AND {date_column} < :after_last_day")
+        params.update(first_day=filters["first_day"], after_last_day=filters["after_last_day"])
+    elif "month" in filters:
+        conditions.append(f"EXTRACT(MONTH FROM {date_column}) = :month")
+        params["month"] = filters["month"]
+    if "user_id" in filters:
+        conditions.append(f"{user_column} = :user_id")
+        params["user_id"] = filters["user_id"]
+    return conditions, params
+
+def admin_request_filters(args):
+    """SQL conditions on rental_request rr and their parameters for the admin listings' filters"""
+    filters = parse_admin_filters(args)
+    conditions, params = date_and_user_conditions(filters, "rr.start_date", "rr.user_id")
+    if "rental_statuses" in filters:
+        conditions.append("rr.rental_status IN :rental_statuses")
+        params["rental_statuses"] = filters["rental_statuses"]
+    if filters["payment"] == 'paid':
+        conditions.append("rr.paid")
+    elif filters["payment"] == 'unpaid':
+        conditions.append("NOT COALESCE(rr.paid, false) AND COALESCE(rr.amount, 0) <> 0")
+    return conditions, params
+
+def payment_summary(conn, args, unpaid_statuses=('approved',)):
+    """
+    Count and paid/unpaid/total amounts of the requests matching the admin
+    filters, summed from rental_payment_summary (one row per renter, month and
+    status, kept current by a trigger; migrations/005_rental_payment_summary.sql).
+    Unpaid only counts requests in `unpaid_statuses`.
+    """
+    filters = parse_admin_filters(args)
+    conditions, params = date_and_user_conditions(filters, "s.month", "s.user_id")
+    if "rental_statuses" in filters:
+        conditions.append("s.rental_status IN :rental_statuses")
+        params["rental_statuses"] = filters["rental_statuses"]
+    if filters["payment"] != 'paid':
+        params["unpaid_statuses"] = list(unpaid_statuses)
+
+    # Columns for (count, paid, unpaid, total) under the ?payment= filter
+    unpaid = "SUM(s.unpaid_amount) FILTER (WHERE s.rental_status IN :unpaid_statuses)"
+    columns = {
+        None: ("s.request_count", "SUM(s.paid_amount)", unpaid, "SUM(s.total_amount)"),
+        'paid': ("s.paid_count", "SUM(s.paid_amount)", "0", "SUM(s.paid_amount)"),
+        'unpaid': ("s.unpaid_count", "0", unpaid, "SUM(s.unpaid_amount)"),
+    }[filters["payment"]]
+
+    query = sqlalchemy.text(f"""
+        SELECT
+            COALESCE(SUM({columns[0]}), 0) as count,
+            COALESCE({columns[1]}, 0) as paid,
+            COALESCE({columns[2]}, 0) as unpaid,
+            COALESCE({columns[3]}, 0) as total
+        FROM public.rental_payment_summary s
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+    """)
+    for name in ("rental_statuses", "unpaid_statuses"):
+        if f":{name}" in query.text:
+            query = query.bindparams(bindparam(name, expanding=True))
+
+    summary = conn.execute(query, params).fetchone()
+    return int(summary.count), {
+        "paid": float(summary.paid),
+        "unpaid": float(summary.unpaid),
+        "total": float(summary.total)
+    }
+
+def fetch_admin_request_page(conn, args, columns, descending=False):
+    """
+    One page of rental requests in (start_date, start_time, request_id) order,
+    filtered per admin_request_filters, paged with ?limit=N&after=<next_cursor>.
+    Returns (rows, next_cursor).
+    """
+    conditions, params = admin_request_filters(args)
+    limit, after = parse_page_args(args, 3)
+    limit = limit or ADMIN_PAGE_SIZE
+
+    params["limit"] = limit + 1
+    if after:
+        conditions.append(f"""(rr.start_date, rr.start_time, rr.request_id)
+            {'<' if descending else '>'} (CAST(:after_date AS date), CAST(:after_time AS time), :after_id)""")
+        params.update(after_date=after[0], after_time=after[1], after_id=after[2])
+
+    direction = "DESC" if descending else "ASC"
+    query = sqlalchemy.text(f"""
+        SELECT {columns},
+            rr.start_date::text as sort_date,
+            rr.start_time::text as sort_time
+        {ADMIN_REQUEST_FROM}
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY rr.start_date {direction}, rr.start_time {direction}, rr.request_id {direction}
+        LIMIT :limit
+    """)
+    if "rental_statuses" in params:
+        query = query.bindparams(bindparam('rental_statuses', expanding=True))
+
+    rows = [dict(row) for row in conn.execute(query, params).mappings()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['sort_date'], rows[-1]['sort_time'], rows[-1]['request_id']])
+    for row in rows:
+        del row['sort_date'], row['sort_time']
+    return rows, next_cursor
+
 @app.route('/api/admin/events')
 @require_admin(pool)
+@conditional_on_schedule
 def get_admin_event():
     """Get all admin events (which are considered pre-approved)"""
     try:
@@ -1703,20 +2185,7 @@ def get_admin_event():
                 return {key: value for key, value in row._mapping.items()}
             
             # Get all admin events
-            query = sqlalchemy.text("""
-                SELECT 
-                    event_id,
-                    event_name as rental_name,
-                    additional_desc as description,
-                    TO_CHAR(start_date, 'MM/DD/YYYY') as start_date,
-                    TO_CHAR(end_date, 'MM/DD/YYYY') as end_date,
-                    TO_CHAR(start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(end_time, 'HH12:MI AM') as end_time,
-                    is_recurring,
-                    recurrence_rule,
-                    created_date,
-                    admin_id
-                FROM public.admin_event
+            query = sqlalchemy.text(ADMIN_EVENT_SELECT + """
                 ORDER BY start_date, start_time
             """)
             
@@ -1735,57 +2204,25 @@ def get_admin_event():
 
 @app.route('/api/admin/requests')
 @require_admin(pool)
+@conditional_on_schedule
 def get_all_requests():
-    """Get all rental requests with user information for admin view"""
+    """
+    Rental requests with user information for the admin dashboard, a page at a
+    time (see fetch_admin_request_page for the filters and paging parameters)
+    """
     try:
         with pool.connect() as conn:
-            # Convert RowMapping to dictionary for JSON serialization
-            def row_to_dict(row):
-                return {key: value for key, value in row._mapping.items()}
-            
-            # Get all requests with user information
-            query = sqlalchemy.text("""
-                SELECT 
-                    rr.request_id, 
-                    rr.rental_name, 
-                    rr.additional_desc, 
-                    TO_CHAR(rr.start_date, 'YYYY-MM-DD') as start_date,
-                    TO_CHAR(rr.end_date, 'YYYY-MM-DD') as end_date,
-                    TO_CHAR(rr.start_time, 'HH12:MI AM') as start_time,
-                    TO_CHAR(rr.end_time, 'HH12:MI AM') as end_time,
-                    rr.is_recurring, 
-                    rr.recurrence_rule,
-                    rr.request_date as request_date,
-                    CASE 
-                        WHEN rr.rental_status = 'pending' THEN 'pending'
-                        WHEN rr.rental_status = 'approved' THEN 'approved'
-                        WHEN rr.rental_status = 'denied' THEN 'declined'
-                        ELSE rr.rental_status
-                    END as request_status,
-                    rr.amount as amount,
-                    rr.paid as paid,
-                    rr.declined_reason,
-                    r.renter_email as user_email,
-                    CONCAT(r.first_name, ' ', r.last_name) as user_name,
-                    r.phone as user_phone
-                FROM public.rental_request rr
-                JOIN public.renter r ON rr.user_id = r.renter_id
-                ORDER BY 
-                    CASE WHEN rr.rental_status = 'pending' THEN 1
-                         WHEN rr.rental_status = 'approved' THEN 2
-                         ELSE 3 END,
-                    rr.start_date, 
-                    rr.start_time
-            """)
-            
-            requests = [row_to_dict(row) for row in conn.execute(query)]
+            requests, next_cursor = fetch_admin_request_page(conn, request.args, ADMIN_REQUEST_COLUMNS)
             
             return jsonify({
                 "requests": requests,
                 "count": len(requests),
+                "next_cursor": next_cursor,
                 "success": True
             })
             
+    except ValueError as e:
+        return jsonify({"error": str(e), "success": False}), 400
     except sqlalchemy.exc.SQLAlchemyError as e:
         print(f"Database error fetching all requests: {str(e)}")
         return jsonify({
@@ -1799,6 +2236,110 @@ def get_all_requests():
             "success": False
         }), 500
 
+@app.route('/api/stream/schedule')
+@require_authentication
+def stream_schedule():
+    """
+    Server-Sent Events stream of schedule changes: 'booking' and 'payment'
+    events carrying only the affected rows, and 'reset' when the client
+    missed too much and should reload. Renters only see public bookings and
+    their own; admins see everything. No database connection is held open.
+    """
+    if not STREAM_MAX_SUBSCRIBERS:
+        return jsonify({"error": "Live updates are disabled"}), 404
+
+    firebase_uid = session.get('firebase_uid')
+    is_admin = bool(session.get('is_admin'))
+    renter_id = None
+    if firebase_uid:
+        with pool.connect() as conn:
+            renter_id = conn.execute(
+                sqlalchemy.text("SELECT renter_id FROM public.renter WHERE firebase_uid = :uid"),
+                {"uid": firebase_uid}
+            ).scalar()
+
+    subscription = schedule_hub.subscribe(renter_id, is_admin, request.headers.get('Last-Event-ID'))
+    if subscription is None:
+        # Browsers retry on their own; the pages keep polling meanwhile
+        return jsonify({"error": "Too many open streams"}), 503
+
+    response = Response(schedule_hub.stream(subscription, STREAM_MAX_SECONDS),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Covers clients that disconnect before the generator ever runs
+    response.call_on_close(lambda: schedule_hub.unsubscribe(subscription))
+    return response
+
+@app.route('/api/admin/changes')
+@require_admin(pool)
+def get_admin_changes():
+    """
+    Requests and admin events changed since ?since=<cursor> (see
+    migrations/003_schedule_change.sql), for the dashboard to patch its
+    lists in place. Without `since` only the current cursor is returned;
+    take it before a full load and pass it to the next call.
+    """
+    since = request.args.get('since')
+    if since is not None and not since.isdigit():
+        return jsonify({"error": "Invalid cursor", "success": False}), 400
+
+    try:
+        with pool.connect() as conn:
+            # Every transaction below this id has finished, so no change under it can still appear
+            cursor = conn.execute(sqlalchemy.text(
+                "SELECT pg_snapshot_xmin(pg_current_snapshot())::text"
+            )).scalar()
+
+            if since is None:
+                return jsonify({"cursor": cursor, "success": True})
+
+            pruned = conn.execute(sqlalchemy.text(
+                "SELECT MAX(txid)::text FROM public.schedule_change WHERE source = 'pruned'"
+            )).scalar()
+            if pruned is not None and int(since) <= int(pruned):
+                # Cleanup has dropped changes this cursor still needs; reload everything
+                return jsonify({"cursor": cursor, "reset": True, "success": True})
+
+            changes = conn.execute(sqlalchemy.text("""
+                SELECT DISTINCT source, row_id
+                FROM public.schedule_change
+                WHERE txid >= CAST(:since AS xid8) AND txid < CAST(:cursor AS xid8)
+            """), {"since": since, "cursor": cursor}).fetchall()
+
+            request_ids = [row.row_id for row in changes if row.source == 'rental']
+            event_ids = [row.row_id for row in changes if row.source == 'admin']
+
+            requests = []
+            if request_ids:
+                query = sqlalchemy.text(ADMIN_REQUEST_SELECT + " WHERE rr.request_id = ANY(:ids)")
+                requests = [dict(row._mapping) for row in conn.execute(query, {"ids": request_ids})]
+
+            events = []
+            if event_ids:
+                query = sqlalchemy.text(ADMIN_EVENT_SELECT + " WHERE event_id = ANY(:ids)")
+                events = [dict(row._mapping) for row in conn.execute(query, {"ids": event_ids})]
+
+            found_requests = {row['request_id'] for row in requests}
+            found_events = {row['event_id'] for row in events}
+
+            return jsonify({
+                "cursor": cursor,
+                "reset": False,
+                "requests": requests,
+                "events": events,
+                "deleted_requests": [i for i in request_ids if i not in found_requests],
+                "deleted_events": [i for i in event_ids if i not in found_events],
+                "success": True
+            })
+
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        print(f"Database error fetching admin changes: {str(e)}")
+        return jsonify({"error": "Database error occurred", "success": False}), 500
+    except Exception as e:
+        print(f"Unexpected error fetching admin changes: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred", "success": False}), 500
+
 @app.route('/api/admin/mark_paid/<requestId>', methods=['POST'])
 @require_admin(pool)
 def mark_paid(requestId):
@@ -1838,18 +2379,22 @@ def mark_paid(requestId):
                 SELECT 
                     u.request_id,
                     u.rental_name,
+                    u.user_id,
                     r.renter_email as user_email,
                     u.amount
                 FROM updated u
                 JOIN public.renter r ON u.user_id = r.renter_id
             """)
             
-            result = conn.execute(
-                update_query,
-                {"request_id": requestId}
-            ).fetchone()
+            # A statement starting with WITH is not autocommitted
+            with conn.begin():
+                result = conn.execute(
+                    update_query,
+                    {"request_id": requestId}
+                ).fetchone()
 
-            
+            schedule_changed()
+            payments_changed([result.request_id], result.user_id)
 
             return jsonify({
                 "success": True,
@@ -1891,6 +2436,7 @@ def delete_admin_event(event_id):
             if not result:
                 return jsonify({"error": "Event not found"}), 404
                 
+            booking_changed(conn, 'admin', result[0])
             
             return jsonify({"success": True, "message": "Event deleted"})
             
@@ -1932,6 +2478,7 @@ def edit_event(eventId):
             if not result:
                 return jsonify({"error": "Request not found"}), 404
 
+            booking_changed(conn, 'admin', result[0])
             
             return jsonify({"success": True, "message": "Request updated"})
 
@@ -1960,6 +2507,16 @@ def approve_request(request_id):
         
         # Update request status in database
         with pool.connect() as conn:
+            # Pending requests don't block, so two overlapping ones could both
+            # be approved; check the slot and approve in one transaction
+            trans = conn.begin()
+
+            free = reserve_request_slot(conn, request_id)
+            if free is None:
+                return jsonify({'error': 'Request not found'}), 404
+            if not free:
+                return jsonify({'error': 'Schedule conflicts with existing bookings'}), 409
+
             update_query = sqlalchemy.text("""
                 UPDATE public.rental_request 
                 SET rental_status = 'approved', amount = :amount
@@ -1977,6 +2534,9 @@ def approve_request(request_id):
             
             # Get returned values if they weren't provided in the request
             row = result.fetchone()
+            booking_written(conn, 'rental', request_id)
+            trans.commit()
+            booking_changed(conn, 'rental', request_id, occurrences_written=True)
             if row:
                 if not user_email:
                     user_email = row[0]
@@ -2004,41 +2564,22 @@ def approve_request(request_id):
             </html>
             """
             
-            # Send email via Gmail API
-            service = get_gmail_service()
-            if not service:
-                print("Error: Gmail service unavailable")
-                return jsonify({
-                    'success': True, 
-                    'message': 'Request approved but email notification failed to send',
-                    'email_sent': False
-                })
-            
-            message = MIMEText(email_body, 'html')
-            message['to'] = user_email
-            message['subject'] = email_subject
-            
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            message_object = {'raw': raw_message}
+            # Sent in the background (see queue_email)
+            email_id = queue_email(user_email, email_subject, email_body)
             
-            sent_message = service.users().messages().send(
-                userId='me', 
-                body=message_object
-            ).execute()
-            
-            print(f"Approval email sent successfully to {user_email}")
+            print(f"Approval email queued for {user_email}")
             
             return jsonify({
                 'success': True,
-                'message': 'Request approved and notification sent',
-                'email_sent': True,
-                'email_id': sent_message.get('id', None)
+                'message': 'Request approved and notification queued',
+                'email_queued': True,
+                'email_id': email_id
             })
         
         return jsonify({
             'success': True,
             'message': 'Request approved successfully',
-            'email_sent': False
+            'email_queued': False
         })
     
     except Exception as e:
@@ -2081,6 +2622,7 @@ def decline_request(request_id):
             
             # Get returned values if they weren't provided in the request
             row = result.fetchone()
+            booking_changed(conn, 'rental', request_id)
             if row:
                 if not user_email:
                     user_email = row[0]
@@ -2107,41 +2649,22 @@ def decline_request(request_id):
             </html>
             """
             
-            # Send email via Gmail API
-            service = get_gmail_service()
-            if not service:
-                print("Error: Gmail service unavailable")
-                return jsonify({
-                    'success': True, 
-                    'message': 'Request declined but email notification failed to send',
-                    'email_sent': False
-                })
-            
-            message = MIMEText(email_body, 'html')
-            message['to'] = user_email
-            message['subject'] = email_subject
-            
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            message_object = {'raw': raw_message}
+            # Sent in the background (see queue_email)
+            email_id = queue_email(user_email, email_subject, email_body)
             
-            sent_message = service.users().messages().send(
-                userId='me', 
-                body=message_object
-            ).execute()
-            
-            print(f"Decline email sent successfully to {user_email}")
+            print(f"Decline email queued for {user_email}")
             
             return jsonify({
                 'success': True,
-                'message': 'Request declined and notification sent',
-                'email_sent': True,
-                'email_id': sent_message.get('id', None)
+                'message': 'Request declined and notification queued',
+                'email_queued': True,
+                'email_id': email_id
             })
         
         return jsonify({
             'success': True,
             'message': 'Request declined successfully',
-            'email_sent': False
+            'email_queued': False
         })
     
     except Exception as e:
@@ -2183,6 +2706,8 @@ def update_request_amount(request_id):
         # Check if any row was updated
         if result.rowcount == 0:
             return jsonify({"error": "Request not found or not in approved status"}), 404
+
+        schedule_changed()
         
         return jsonify({
             "message": "Amount updated successfully",
@@ -2227,6 +2752,8 @@ def update_event_amount(event_id):
         # Check if any row was updated
         if result.rowcount == 0:
             return jsonify({"error": "Admin event not found"}), 404
+
+        schedule_changed()
         
         return jsonify({
             "message": "Amount updated successfully",
@@ -2263,6 +2790,7 @@ def delete_request(request_id):
                 WHERE request_id = :request_id
             """)
             conn.execute(delete_query, {"request_id": request_id})
+            booking_changed(conn, 'rental', int(request_id))
             
             # Commit the transaction to make it persistent
             
@@ -2274,116 +2802,196 @@ def delete_request(request_id):
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/events')
+@conditional_on_schedule
 def get_events():
-    """API endpoint to fetch events"""
+    """API endpoint to fetch events between ?start= and ?end= (see parse_event_window)"""
     try:
-        # Calculate date range (1 year back and 6 months forward)
-        today = datetime.now().date()
-        start_date = today - timedelta(days=365)
-        end_date = today + timedelta(days=180)
-        
-        with pool.connect() as conn:
-            # Query approved rental requests
-            rental_query = sqlalchemy.text("""
-                SELECT 
-                    request_id as id,
-                    rental_name as name,
-                    additional_desc as description,
-                    start_time::text as start_time,
-                    end_time::text as end_time,
-                    start_date::text as start_date,
-                    end_date::text as end_date,
-                    rental_status as status,
-                    is_recurring,
-                    recurrence_rule
-                FROM public.rental_request 
-                WHERE rental_status = 'approved'
-                AND (
-                    (is_recurring = false AND start_date BETWEEN :start AND :end)
-                    OR 
-                    (is_recurring = true AND end_date >= :start)
-                )
-            """)
-            
-            rentals = conn.execute(
-                rental_query, 
-                {"start": start_date, "end": end_date}
-            ).mappings().all()
-            
-            # Query admin events
-            admin_query = sqlalchemy.text("""
-                SELECT 
-                    event_id as id,
-                    event_name as name,
-                    additional_desc as description,
-                    start_time::text as start_time,
-                    end_time::text as end_time,
-                    start_date::text as start_date,
-                    end_date::text as end_date,
-                    'admin' as status,
-                    is_recurring,
-                    recurrence_rule
-                FROM public.admin_event
-                WHERE (
-                    (is_recurring = false AND start_date BETWEEN :start AND :end)
-                    OR 
-                    (is_recurring = true AND end_date >= :start)
-                )
-            """)
-            
-            admin_event = conn.execute(
-                admin_query,
-                {"start": start_date, "end": end_date}
-            ).mappings().all()
-            
-            # Combine and process recurring events
-            all_events = process_recurring_events(
-                rentals + admin_event,
-                start_date,
-                end_date
-            )
-            
-            return {"events": all_events}
+        try:
+            start_date, end_date = parse_event_window(request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        # Served from the cache when the schedule hasn't changed. Without a
+        # version (e.g. the database is down), keep serving entries made with
+        # the last one read; they still follow this instance's writes and the
+        # TTL.
+        version = schedule_version() or schedule_versions.last()
+        generation = events_cache.generation() if version is None else f"{events_cache.generation()}:{version}"
+        cache_key = f"{start_date.isoformat()}:{end_date.isoformat()}"
+        cached = events_cache.get(generation, cache_key)
+        if cached is not None:
+            return cached
+
+        response = {"events": load_calendar_events(start_date, end_date)}
+        events_cache.set(generation, cache_key, response)
+        return response
             
     except Exception as e:
         return {"error": str(e)}, 500
 
-def process_recurring_events(events, start_date, end_date):
-    """Expand recurring events into individual occurrences"""
-    processed_events = []
-    
-    for event in events:
-        if not event['is_recurring']:
-            # Single event - just format it
-            processed_events.append(format_event(event, event['start_date']))
-            continue
+def load_calendar_events(start_date, end_date):
+    """Approved requests and admin events between start_date and end_date, one entry per occurrence"""
+    with pool.connect() as conn:
+        if USE_OCCURRENCE_TABLE:
+            rows = occurrences.fetch_calendar(conn, start_date, end_date)
+            return [format_event(row, row['occurrence_date']) for row in rows]
+
+        # Query approved rental requests
+        rental_query = sqlalchemy.text("""
+            SELECT 
+                request_id as id,
+                rental_name as name,
+                additional_desc as description,
+                start_time::text as start_time,
+                end_time::text as end_time,
+                start_date::text as start_date,
+                end_date::text as end_date,
+                rental_status as status,
+                is_recurring,
+                recurrence_rule
+            FROM public.rental_request 
+            WHERE rental_status = 'approved'
+            AND start_date <= :end AND end_date >= :start
+        """)
         
-        # Handle recurring events
-        current_date = datetime.strptime(event['start_date'], '%Y-%m-%d').date()
-        end_date_recur = min(
-            datetime.strptime(event['end_date'], '%Y-%m-%d').date(),
+        rentals = conn.execute(
+            rental_query, 
+            {"start": start_date, "end": end_date}
+        ).mappings().all()
+        
+        # Query admin events
+        admin_query = sqlalchemy.text("""
+            SELECT 
+                event_id as id,
+                event_name as name,
+                additional_desc as description,
+                start_time::text as start_time,
+                end_time::text as end_time,
+                start_date::text as start_date,
+                end_date::text as end_date,
+                'admin' as status,
+                is_recurring,
+                recurrence_rule
+            FROM public.admin_event
+            WHERE start_date <= :end AND end_date >= :start
+        """)
+        
+        admin_event = conn.execute(
+            admin_query,
+            {"start": start_date, "end": end_date}
+        ).mappings().all()
+        
+        # Combine and process recurring events
+        all_events = list(process_recurring_events(
+            rentals + admin_event,
+            start_date,
             end_date
-        )
+        ))
         
-        if event['recurrence_rule'] == 'daily':
-            while current_date <= end_date_recur:
-                processed_events.append(format_event(event, current_date))
-                current_date += timedelta(days=1)       
-        elif event['recurrence_rule'] == 'weekly':
-            original_weekday = current_date.weekday()
-            while current_date <= end_date_recur:
-                if current_date.weekday() == original_weekday:
-                    processed_events.append(format_event(event, current_date))
-                current_date += timedelta(days=1)
-    
-    return processed_events
+        return all_events
+
+@app.cli.command('rebuild-occurrences')
+def rebuild_occurrences_command():
+    """Rebuild booking_occurrence from rental_request and admin_event"""
+    with pool.connect() as conn:
+        count = occurrences.rebuild_all(conn)
+    print(f"Rebuilt booking_occurrence: {count} occurrence(s)")
+
+@app.route('/api/admin/rebuild_occurrences', methods=['POST'])
+@require_admin(pool)
+def rebuild_occurrences():
+    """Rebuild booking_occurrence (backfill after migrations/002_booking_occurrence.sql)"""
+    try:
+        with pool.connect() as conn:
+            count = occurrences.rebuild_all(conn)
+        events_cache.invalidate()
+        print(f"Rebuilt booking_occurrence: {count} occurrence(s)")
+        return jsonify({"success": True, "occurrences": count})
+    except Exception as e:
+        print(f"Error rebuilding occurrences: {str(e)}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+@app.route('/api/admin/flush_auth_cache', methods=['POST'])
+@require_admin(pool)
+def flush_auth_cache():
+    """Forget cached tokens and admin lookups on this instance (after editing public.admin)"""
+    token_cache.flush()
+    print("Flushed the verified-token and admin caches")
+    return jsonify({"success": True})
+
+@app.cli.command('send-queued-emails')
+def send_queued_emails_command():
+    """Send every due email in email_outbox now"""
+    sent, failed = email_dispatcher.drain()
+    print(f"Sent {sent} queued email(s), {failed} failed attempt(s)")
+
+@functions_framework.http
+@app.route('/api/admin/send_queued_emails', methods=['POST'])
+@require_admin_or_scheduler(pool)
+def send_queued_emails():
+    """Send due emails now, e.g. ones an instance queued before it shut down (for Cloud Scheduler)"""
+    try:
+        sent, failed = email_dispatcher.drain(time.monotonic() + EMAIL_DRAIN_MAX_SECONDS)
+        print(f"Sent {sent} queued email(s), {failed} failed attempt(s)")
+        return jsonify({"success": True, "sent": sent, "failed": failed})
+    except Exception as e:
+        print(f"Error sending queued emails: {str(e)}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+@app.route('/api/admin/email_outbox')
+@require_admin(pool)
+def get_email_outbox():
+    """Number of queued emails per status, and the latest ones that failed or are being retried"""
+    try:
+        with pool.connect() as conn:
+            counts = {row.status: row.count for row in conn.execute(sqlalchemy.text("""
+                SELECT status, COUNT(*) as count FROM public.email_outbox GROUP BY status
+            """))}
+            problems = conn.execute(sqlalchemy.text("""
+                SELECT email_id, to_address, subject, status, attempts, last_error,
+                       next_attempt_at, created_at
+                FROM public.email_outbox
+                WHERE last_error IS NOT NULL AND status <> 'sent'
+                ORDER BY created_at DESC
+                LIMIT 50
+            """)).mappings()
+            return jsonify({
+                "success": True,
+                "counts": counts,
+                "problems": [dict(row) for row in problems]
+            })
+    except Exception as e:
+        print(f"Error reading the email outbox: {str(e)}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+def process_recurring_events(events, start_date, end_date):
+    """
+    Lazily expand events into one formatted entry per occurrence between
+    start_date and end_date. Steps by the rule's period (see
+    recurrence.PERIOD_DAYS) rather than testing every day. Only what was
+    booked is shown: one-off events once, on their start date, and recurring
+    events with a rule we don't know not at all.
+    """
+    for event in events:
+        period = period_of(event['is_recurring'], event['recurrence_rule'], strict=True)
+        if period is None:
+            continue
+        # Everything but the date is the same for every occurrence
+        template = format_event(event, event['start_date'])
+        first_day = date.fromisoformat(event['start_date'])
+        last_day = date.fromisoformat(event['end_date']) if event['is_recurring'] else first_day
+
+        for day in iter_dates(first_day, last_day, period, start_date, end_date):
+            occurrence = dict(template)
+            occurrence['date'] = day.isoformat()
+            yield occurrence
 
 def format_event(event, date):
     """Format an event for the frontend"""
     if isinstance(date, str):
         date_str = date
     else:
-        date_str = date.strftime('%Y-%m-%d')
+        date_str = date.isoformat()
     time_str = f"{event['start_time']} - {event['end_time']}"
     
     return {
@@ -2433,8 +3041,9 @@ def update_profile():
             
             if result.rowcount == 0:
                 return jsonify({"error": "User not found"}), 404
-                
             
+            # The admin request listings show renter names, emails and phones
+            schedule_changed()
             
             return jsonify({
                 "success": True,
@@ -2471,10 +3080,13 @@ def send_invoice():
             check_query = sqlalchemy.text(
                 """
                 SELECT 
-                    payment_link,
-                    paid
-                FROM public.rental_request 
-                WHERE request_id = :request_id
+                    rr.payment_link,
+                    rr.paid,
+                    rr.user_id,
+                    CONCAT(r.first_name, ' ', r.last_name) as user_name
+                FROM public.rental_request rr
+                LEFT JOIN public.renter r ON rr.user_id = r.renter_id
+                WHERE rr.request_id = :request_id
                 """
             )
             result = conn.execute(check_query, {"request_id": request_id}).fetchone()
@@ -2501,34 +3113,36 @@ def send_invoice():
         # Create a new Invoice if needed
         if create_new_invoice:
             try:
-                # 1. Create a Customer
-                customer = stripe.Customer.create(
-                    email=user_email,
+                # 1. The renter's Stripe customer (created once, then saved on the renter)
+                if not result:
+                    return jsonify({'error': 'Request not found'}), 404
+                customer_id = stripe_customer_for(result.user_id, user_email, result.user_name)
+
+                # 2. Create Invoice with auto_advance=True to automatically finalize
+                customer_id, invoice = create_customer_invoice(
+                    result.user_id, user_email, result.user_name,
+                    customer_id,
+                    str(uuid.uuid4()),
+                    collection_method='send_invoice',
+                    days_until_due=7,
+                    auto_advance=True,  # Automatically finalize the invoice
                     metadata={"request_id": str(request_id)}
                 )
+                print(f"Invoice created: {invoice}")
 
-                # 2. Create Invoice Item and wait for it to complete
-                invoice_item = stripe.InvoiceItem.create(
-                    customer=customer.id,
+                # 3. Add the Invoice Item to it
+                invoice_item = stripe_call(
+                    stripe.InvoiceItem.create,
+                    customer=customer_id,
+                    invoice=invoice.id,
                     amount=int(amount * 100),  # Amount in cents
                     currency='usd',
                     description=f'Rental: {rental_name} ({start_date} to {end_date})'
                 )
                 print(f"Invoice item created: {invoice_item}")
 
-                # 3. Create Invoice with auto_advance=True to automatically finalize
-                invoice = stripe.Invoice.create(
-                    customer=customer.id,
-                    collection_method='send_invoice',
-                    days_until_due=7,
-                    auto_advance=True,  # Automatically finalize the invoice
-                    metadata={"request_id": str(request_id)},
-                    pending_invoice_items_behavior='include'
-                )
-                print(f"Invoice created: {invoice}")
-
                 # 4. Explicitly finalize the invoice (not needed if auto_advance=True)
-                finalized_invoice = stripe.Invoice.finalize_invoice(invoice.id)
+                finalized_invoice = stripe_call(stripe.Invoice.finalize_invoice, invoice.id)
                 print(f"Finalized invoice: {finalized_invoice}")
 
                 payment_link = finalized_invoice.hosted_invoice_url
@@ -2551,7 +3165,7 @@ def send_invoice():
                         "payment_link": payment_link,
                         "request_id": request_id
                     })
-                    
+                schedule_changed()
 
                 print(f"Created new invoice for request {request_id}")
 
@@ -2580,30 +3194,15 @@ def send_invoice():
         </html>
         """
 
-        # Send email via Gmail API
-        service = get_gmail_service()
-        if not service:
-            print("Error: Gmail service unavailable")
-            return jsonify({'error': 'Email service unavailable'}), 500
-
-        message = MIMEText(email_body, 'html')
-        message['to'] = user_email
-        message['subject'] = email_subject
+        # Sent in the background (see queue_email)
+        email_id = queue_email(user_email, email_subject, email_body)
 
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        message_object = {'raw': raw_message}
-
-        sent_message = service.users().messages().send(
-            userId='me', 
-            body=message_object
-        ).execute()
-
-        print(f"Email sent successfully to {user_email} with {'existing' if not create_new_invoice else 'new'} invoice link")
+        print(f"Email queued for {user_email} with {'existing' if not create_new_invoice else 'new'} invoice link")
 
         return jsonify({
             'success': True,
             'message': 'Invoice sent successfully',
-            'email_id': sent_message.get('id', None),
+            'email_id': email_id,
             'payment_link': payment_link,
             'is_new_invoice': create_new_invoice
         })
@@ -2620,210 +3219,380 @@ def generate_monthly_invoices():
     """
     Cloud Run function to generate monthly invoices for all users with unpaid rental requests
     This can be triggered by Cloud Scheduler on a monthly basis
+
+    Progress is kept per user in monthly_invoice_run, so calling it again
+    resumes an interrupted run. Each call stops starting new work after
+    INVOICE_JOB_MAX_SECONDS and reports how many users remain.
     """
     try:
-        # Get previous month and year
-        now = datetime.now()
-        # Calculate previous month
-        if now.month == 1:  # January
-            previous_month = 12
-            previous_year = now.year - 1
-        else:
-            previous_month = now.month - 1
-            previous_year = now.year
-        
+        previous_month, previous_year = invoicing.previous_month(datetime.now())
         print(f"Generating monthly invoices for previous month: {previous_month}/{previous_year}")
+        deadline = time.monotonic() + INVOICE_JOB_MAX_SECONDS
         
-        # Find all users with unpaid rental requests
+        with pool.connect() as lock_conn:
+            # The lock is per session; autocommit so holding it doesn't also keep a
+            # transaction (and the snapshot /api/admin/changes waits on) open all run
+            lock_conn = lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+            if not invoicing.try_lock_month(lock_conn, previous_month, previous_year):
+                print(f"Monthly invoicing for {previous_month}/{previous_year} is already running")
+                return jsonify({'error': 'Monthly invoicing is already running'}), 409
+            try:
+                return jsonify(run_monthly_invoicing(previous_month, previous_year, deadline))
+            finally:
+                invoicing.unlock_month(lock_conn, previous_month, previous_year)
+    
+    except Exception as e:
+        print(f"Error generating monthly invoices: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# Seconds one call of the invoicing job keeps starting new work; the rest is
+# left for the next call
+INVOICE_JOB_MAX_SECONDS = float(os.environ.get('INVOICE_JOB_MAX_SECONDS', 480))
+
+def run_monthly_invoicing(month, year, deadline):
+    """Plan, create, record and email the month's invoices, resuming saved progress; returns the report"""
+    # 1. Plan: every user's total and requests in one query, saved as runs
+    with pool.connect() as conn:
+        to_invoice, already_invoiced, nothing_due = invoicing.plan_month(conn, month, year)
+        invoicing.save_plan(conn, month, year, to_invoice)
+        runs = invoicing.pending_runs(conn, month, year)
+    stripe_customer_ids.prime({user['user_id']: user['stripe_customer_id'] for user in to_invoice})
+    
+    print(f"Found {len(to_invoice) + len(already_invoiced) + len(nothing_due)} users with unpaid rental requests")
+    for user in already_invoiced:
+        print(f"Monthly invoice already exists for user {user['user_id']} for {month}/{year}")
+    for user in nothing_due:
+        print(f"No unpaid rentals found for user {user['user_id']}")
+    
+    # 2. Take each run through the Stripe steps, several users at a time
+    in_stripe = [run for run in runs if run['state'] in ('planned', 'stripe_created')]
+    results = invoicing.run_concurrently(
+        in_stripe,
+        lambda run: advance_invoice_run(run, month, year, deadline),
+        INVOICE_WORKERS
+    )
+    failed = []
+    for run, _, error in results:
+        if error is None:
+            continue
+        failed.append(run['user_id'])
+        if isinstance(error, stripe.error.StripeError):
+            print(f"Stripe error for user {run['user_id']}: {str(error)}")
+        else:
+            print(f"Error creating invoice for user {run['user_id']}: {str(error)}")
+            traceback.print_exception(type(error), error, error.__traceback__)
         with pool.connect() as conn:
-            # Get all users with unpaid requests that haven't been included in a monthly invoice yet
-            query = sqlalchemy.text("""
-            WITH users_with_requests AS (
-                SELECT DISTINCT 
-                    r.renter_id as user_id,
-                    r.renter_email as user_email,
-                    CONCAT(r.first_name, ' ', r.last_name) as user_name
-                FROM 
-                    public.renter r
-                JOIN 
-                    public.rental_request rr ON r.renter_id = rr.user_id
-                WHERE 
-                    rr.rental_status in ('approved','admin') 
-                    AND (rr.paid = FALSE OR rr.paid IS NULL)
-                    AND EXTRACT(MONTH FROM rr.start_date) = :month
-                    AND EXTRACT(YEAR FROM rr.start_date) = :year
+            invoicing.save_failure(conn, month, year, run['user_id'], error)
+    
+    # 3. Record every finalized invoice at once
+    with pool.connect() as conn:
+        invoices_created = invoicing.record_finalized(conn, month, year)
+    for run in runs:
+        if run['state'] == 'finalized':
+            run['state'] = 'recorded'
+    
+    # 4. Send the emails with the invoice links
+    emails_sent = 0
+    for run in runs:
+        if run['state'] != 'recorded' or time.monotonic() > deadline:
+            continue
+        details = run['details']
+        sent = send_monthly_invoice_email(
+            user_email=details['user_email'],
+            user_name=details['user_name'],
+            amount=run['amount'],
+            payment_link=run['payment_link'],
+            month=month,
+            year=year,
+            rental_names=details['rental_names'],
+            start_dates=details['start_dates'],
+            end_dates=details['end_dates'],
+            dedupe_key=invoicing.idempotency_key(run['user_id'], month, year, 'email')
+        )
+        with pool.connect() as conn:
+            if sent:
+                invoicing.save_progress(conn, month, year, run, state='emailed')
+                emails_sent += 1
+            else:
+                invoicing.save_failure(conn, month, year, run['user_id'], "Invoice email was not sent")
+    
+    remaining = sum(1 for run in runs if run['state'] != 'emailed')
+    return {
+        'success': True,
+        'invoices_created': invoices_created,
+        'invoices_skipped': len(already_invoiced),
+        'invoices_failed': failed,
+        'emails_sent': emails_sent,
+        'remaining': remaining,
+        'complete': remaining == 0,
+        'month': month,
+        'year': year
+    }
+
+# The monthly invoicing job creates invoices on INVOICE_WORKERS threads; all of
+# its Stripe calls share stripe_limiter (STRIPE_RATE_LIMIT requests per second,
+# below Stripe's own limit of 25/s in test mode and 100/s live)
+INVOICE_WORKERS = int(os.environ.get('INVOICE_WORKERS', 4))
+STRIPE_RATE_LIMIT = float(os.environ.get('STRIPE_RATE_LIMIT', 20))
+STRIPE_MAX_ATTEMPTS = int(os.environ.get('STRIPE_MAX_ATTEMPTS', 4))
+stripe_limiter = invoicing.TokenBucket(STRIPE_RATE_LIMIT)
+
+def stripe_call(method, *args, idempotent=True, **params):
+    """
+    Call a Stripe API method through stripe_limiter, retrying rate limits,
+    connection errors and Stripe server errors with backoff. Calls that
+    create something get one idempotency key shared by all attempts, so a
+    retry after a lost response can't create it twice.
+    """
+    if idempotent:
+        params.setdefault('idempotency_key', str(uuid.uuid4()))
+    retryable = (stripe.error.RateLimitError, stripe.error.APIConnectionError, stripe.error.APIError)
+    return invoicing.call_with_retries(
+        lambda: method(*args, **params),
+        limiter=stripe_limiter,
+        retryable=retryable,
+        attempts=STRIPE_MAX_ATTEMPTS
+    )
+
+# Stripe customer id of each renter, saved on the renter and kept in memory
+# (migrations/007_renter_stripe_customer.sql)
+stripe_customer_ids = CustomerIdCache(int(os.environ.get('STRIPE_CUSTOMER_CACHE_SIZE', 4096)))
+
+def stripe_customer_fields(customer):
+    """id, email, created and metadata.user_id of a Stripe customer, for stripe_customers.match_customers"""
+    metadata = customer['metadata'] if 'metadata' in customer else {}
+    return {
+        "id": customer['id'],
+        "email": customer['email'] if 'email' in customer else None,
+        "created": customer['created'] if 'created' in customer else 0,
+        "metadata": {"user_id": metadata['user_id'] if metadata and 'user_id' in metadata else None}
+    }
+
+def stripe_customer_for(renter_id, email, name=None, replacing=None):
+    """
+    Stripe customer id of a renter: from memory, from renter.stripe_customer_id,
+    or else an existing Stripe customer with the renter's email or a new one,
+    which is then saved on the renter. `replacing` is the customer id just
+    forgotten because Stripe no longer has it.
+    """
+    def resolve(renter_id):
+        select_query = sqlalchemy.text(
+            "SELECT stripe_customer_id FROM public.renter WHERE renter_id = :renter_id"
+        )
+        with pool.connect() as conn:
+            saved = conn.execute(select_query, {"renter_id": renter_id}).scalar()
+        if saved:
+            return saved
+        
+        customers = stripe_call(stripe.Customer.list, email=email, limit=10, idempotent=False)
+        found = match_customers([{"renter_id": renter_id, "email": email}],
+                                [stripe_customer_fields(customer) for customer in customers.data])
+        if renter_id in found:
+            customer_id = found[renter_id]
+            print(f"Using existing Stripe customer {customer_id} for renter {renter_id}")
+        else:
+            customer = stripe_call(
+                stripe.Customer.create,
+                email=email,
+                name=name,
+                metadata={"user_id": str(renter_id)},
+                idempotency_key=customer_idempotency_key(renter_id, email, name, replacing)
             )
-            SELECT 
-                u.user_id,
-                u.user_email,
-                u.user_name,
-                COALESCE(
-                    (SELECT EXISTS(
-                        SELECT 1 FROM public.monthly_invoice 
-                        WHERE user_id = u.user_id 
-                        AND invoice_month = :month 
-                        AND invoice_year = :year
-                    )), FALSE
-                ) as invoice_exists
-            FROM 
-                users_with_requests u
-            """)
-            
-            users = conn.execute(query, {"month": previous_month, "year": previous_year}).fetchall()
+            customer_id = customer.id
+            print(f"Created new Stripe customer {customer_id} for renter {renter_id}")
         
-        print(f"Found {len(users)} users with unpaid rental requests")
+        # Keep whichever id was saved first if another instance got there too
+        save_query = sqlalchemy.text("""
+            UPDATE public.renter
+            SET stripe_customer_id = :customer_id
+            WHERE renter_id = :renter_id AND stripe_customer_id IS NULL
+        """)
+        with pool.connect() as conn:
+            conn.execute(save_query, {"customer_id": customer_id, "renter_id": renter_id})
+            return conn.execute(select_query, {"renter_id": renter_id}).scalar() or customer_id
+    
+    return stripe_customer_ids.get(renter_id, resolve)
+
+def forget_stripe_customer(renter_id, customer_id):
+    """Drop a renter's saved customer id, e.g. after the customer was deleted in Stripe"""
+    stripe_customer_ids.forget(renter_id)
+    with pool.connect() as conn:
+        conn.execute(sqlalchemy.text("""
+            UPDATE public.renter
+            SET stripe_customer_id = NULL
+            WHERE renter_id = :renter_id AND stripe_customer_id = :customer_id
+        """), {"renter_id": renter_id, "customer_id": customer_id})
+
+def backfill_stripe_customers():
+    """
+    Link every renter without a saved Stripe customer to an existing one
+    (see stripe_customers.match_customers), reading Stripe's customer list
+    once instead of searching per renter. Renters with no customer yet get
+    one on their first invoice. Returns (renters checked, renters linked).
+    """
+    with pool.connect() as conn:
+        renters = [dict(row) for row in conn.execute(sqlalchemy.text("""
+            SELECT renter_id, renter_email as email
+            FROM public.renter
+            WHERE stripe_customer_id IS NULL
+        """)).mappings()]
+    if not renters:
+        return 0, 0
+    
+    customers = []
+    page = stripe_call(stripe.Customer.list, limit=100, idempotent=False)
+    while True:
+        customers += [stripe_customer_fields(customer) for customer in page.data]
+        if not page.has_more:
+            break
+        page = stripe_call(stripe.Customer.list, limit=100, starting_after=page.data[-1].id, idempotent=False)
+    
+    matches = match_customers(renters, customers)
+    if not matches:
+        return len(renters), 0
+    with pool.connect() as conn:
+        result = conn.execute(sqlalchemy.text("""
+            UPDATE public.renter r
+            SET stripe_customer_id = m.customer_id
+            FROM unnest(CAST(:renter_ids AS integer[]), CAST(:customer_ids AS varchar[]))
+                AS m(renter_id, customer_id)
+            WHERE r.renter_id = m.renter_id AND r.stripe_customer_id IS NULL
+        """), {"renter_ids": list(matches), "customer_ids": list(matches.values())})
+    stripe_customer_ids.prime(matches)
+    return len(renters), result.rowcount
+
+@app.cli.command('backfill-stripe-customers')
+def backfill_stripe_customers_command():
+    """Save the existing Stripe customer of each renter (after migrations/007_renter_stripe_customer.sql)"""
+    checked, linked = backfill_stripe_customers()
+    print(f"Linked {linked} of {checked} renter(s) to their Stripe customer")
+
+@app.route('/api/admin/backfill_stripe_customers', methods=['POST'])
+@require_admin(pool)
+def backfill_stripe_customers_route():
+    """Save the existing Stripe customer of each renter (after migrations/007_renter_stripe_customer.sql)"""
+    try:
+        checked, linked = backfill_stripe_customers()
+        print(f"Linked {linked} of {checked} renter(s) to their Stripe customer")
+        return jsonify({"success": True, "renters_checked": checked, "renters_linked": linked})
+    except Exception as e:
+        print(f"Error backfilling Stripe customers: {str(e)}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+def create_customer_invoice(renter_id, email, name, customer_id, idempotency_key, **params):
+    """
+    Invoice.create for a renter's Stripe customer. If Stripe no longer has
+    that customer, the saved id is dropped and the invoice goes to the
+    renter's customer resolved anew. Returns (customer_id, invoice).
+
+    Customers are shared by all of a renter's invoices, so invoices are made
+    with pending_invoice_items_behavior='exclude' and get their item attached
+    afterwards (InvoiceItem.create(invoice=...)); a pending item left by a
+    failed attempt can then never end up on another invoice.
+    """
+    params.setdefault('pending_invoice_items_behavior', 'exclude')
+    try:
+        return customer_id, stripe_call(stripe.Invoice.create, customer=customer_id,
+                                        idempotency_key=idempotency_key, **params)
+    except stripe.error.InvalidRequestError as e:
+        if e.code != 'resource_missing' or e.param != 'customer':
+            raise
+    print(f"Stripe customer {customer_id} of renter {renter_id} no longer exists")
+    forget_stripe_customer(renter_id, customer_id)
+    customer_id = stripe_customer_for(renter_id, email, name, replacing=customer_id)
+    return customer_id, stripe_call(stripe.Invoice.create, customer=customer_id,
+                                    idempotency_key=f"{idempotency_key}-{customer_id}", **params)
+
+def invoice_item_of(line):
+    """Id (ii_...) of the invoice item behind an invoice line (il_...)"""
+    if 'invoice_item' in line and line['invoice_item']:
+        return line['invoice_item']
+    # Newer API versions move it under the line's parent
+    parent = line['parent'] if 'parent' in line else None
+    if parent and 'invoice_item_details' in parent and parent['invoice_item_details']:
+        return parent['invoice_item_details']['invoice_item']
+    return None
+
+def advance_invoice_run(run, month, year, deadline):
+    """
+    Take one user's run (see invoicing.pending_runs) through the Stripe steps
+    it hasn't finished, checkpointing after each: customer, draft invoice,
+    its invoice item (stripe_created), finalize (finalized). Does nothing
+    once the job's deadline has passed.
+    """
+    if time.monotonic() > deadline:
+        return run['state']
+    
+    user_id = run['user_id']
+    details = run['details']
+    key = lambda step: invoicing.idempotency_key(user_id, month, year, step)
+    
+    def checkpoint(**fields):
+        with pool.connect() as conn:
+            invoicing.save_progress(conn, month, year, run, **fields)
+    
+    if run['state'] == 'planned':
+        print(f"Creating monthly invoice for user {user_id} in the amount of ${run['amount']}")
         
-        invoices_created = 0
-        invoices_skipped = 0
+        # 1. The user's Stripe customer (saved on the renter after the first invoice)
+        if not run['stripe_customer_id']:
+            checkpoint(stripe_customer_id=stripe_customer_for(user_id, details['user_email'], details['user_name']))
         
-        for user in users:
-            user_id = user.user_id
-            user_email = user.user_email
-            user_name = user.user_name
-            invoice_exists = user.invoice_exists
-            
-            if invoice_exists:
-                print(f"Monthly invoice already exists for user {user_id} for {previous_month}/{previous_year}")
-                invoices_skipped += 1
-                continue
-            
-            # Calculate total amount due for this user for the previous month
-            with pool.connect() as conn:
-                amount_query = sqlalchemy.text("""
-                SELECT 
-                    SUM(amount) as total_amount,
-                    array_agg(request_id) as request_ids,
-                    array_agg(rental_name) as rental_names,
-                    array_agg(TO_CHAR(start_date, 'YYYY-MM-DD')) as start_dates,
-                    array_agg(TO_CHAR(end_date, 'YYYY-MM-DD')) as end_dates
-                FROM 
-                    public.rental_request
-                WHERE 
-                    user_id = :user_id
-                    AND rental_status = 'approved'
-                    AND (paid = FALSE OR paid IS NULL)
-                    AND EXTRACT(MONTH FROM start_date) = :month
-                    AND EXTRACT(YEAR FROM start_date) = :year
-                """)
-                
-                result = conn.execute(amount_query, {
-                    "user_id": user_id,
-                    "month": previous_month,
-                    "year": previous_year
-                }).fetchone()
-                
-                if not result or not result.total_amount:
-                    print(f"No unpaid rentals found for user {user_id}")
-                    continue
-                
-                total_amount = result.total_amount
-                request_ids = result.request_ids
-                rental_names = result.rental_names
-                start_dates = result.start_dates
-                end_dates = result.end_dates
-            
-            print(f"Creating monthly invoice for user {user_id} in the amount of ${total_amount}")
-            
-            # Create a Stripe invoice
-            try:
-                # 1. Create or retrieve Customer
-                customers = stripe.Customer.list(email=user_email, limit=1)
-                
-                if customers and customers.data:
-                    customer = customers.data[0]
-                    print(f"Using existing Stripe customer: {customer.id}")
-                else:
-                    customer = stripe.Customer.create(
-                        email=user_email,
-                        name=user_name,
-                        metadata={"user_id": str(user_id)}
-                    )
-                    print(f"Created new Stripe customer: {customer.id}")
-                
-                # 2. Create Invoice Item
-                invoice_description = f"Monthly Invoice - {previous_month}/{previous_year}"
-                
-                invoice_item = stripe.InvoiceItem.create(
-                    customer=customer.id,
-                    amount=int(total_amount * 100),  # Amount in cents
-                    currency='usd',
-                    description=invoice_description
-                )
-                
-                # 3. Create Invoice with auto_advance=True to automatically finalize
-                invoice = stripe.Invoice.create(
-                    customer=customer.id,
-                    collection_method='send_invoice',
-                    days_until_due=7,
-                    auto_advance=True,
-                    metadata={
-                        "user_id": str(user_id),
-                        "month": str(previous_month),
-                        "year": str(previous_year),
-                        "request_ids": ",".join(map(str, request_ids))
-                    },
-                    pending_invoice_items_behavior='include'
-                )
-                
-                # 4. Explicitly finalize the invoice
-                finalized_invoice = stripe.Invoice.finalize_invoice(invoice.id)
-                payment_link = finalized_invoice.hosted_invoice_url
-                
-                # 5. Insert record into monthly_invoice table
-                with pool.connect() as conn:
-                    insert_query = sqlalchemy.text("""
-                    INSERT INTO public.monthly_invoice 
-                    (user_id, invoice_month, invoice_year, amount, payment_link, stripe_invoice_id)
-                    VALUES (:user_id, :month, :year, :amount, :payment_link, :stripe_invoice_id)
-                    """)
-                    
-                    conn.execute(insert_query, {
-                        "user_id": user_id,
-                        "month": previous_month,
-                        "year": previous_year,
-                        "amount": total_amount,
-                        "payment_link": payment_link,
-                        "stripe_invoice_id": invoice.id
-                    })
-                
-                # 6. Send email with invoice link
-                send_monthly_invoice_email(
-                    user_email=user_email,
-                    user_name=user_name,
-                    amount=total_amount,
-                    payment_link=payment_link,
-                    month=previous_month,
-                    year=previous_year,
-                    rental_names=rental_names,
-                    start_dates=start_dates,
-                    end_dates=end_dates
-                )
-                
-                invoices_created += 1
-                
-            except stripe.error.StripeError as e:
-                print(f"Stripe error for user {user_id}: {str(e)}")
-                continue
-            except Exception as e:
-                print(f"Error creating invoice for user {user_id}: {str(e)}")
-                traceback.print_exc()
-                continue
+        # 2. Create the Invoice (a draft until its item is attached)
+        resumed = bool(run['stripe_invoice_id'])
+        if not resumed:
+            customer_id, invoice = create_customer_invoice(
+                user_id, details['user_email'], details['user_name'],
+                run['stripe_customer_id'],
+                key('invoice'),
+                collection_method='send_invoice',
+                days_until_due=7,
+                auto_advance=True,
+                metadata={
+                    "user_id": str(user_id),
+                    "month": str(month),
+                    "year": str(year),
+                    "request_ids": ",".join(map(str, run['request_ids']))
+                }
+            )
+            checkpoint(stripe_customer_id=customer_id, stripe_invoice_id=invoice.id)
         
-        return jsonify({
-            'success': True,
-            'invoices_created': invoices_created,
-            'invoices_skipped': invoices_skipped,
-            'month': previous_month,
-            'year': previous_year
-        })
+        # 3. Add the Invoice Item to it, unless an interrupted attempt already did
+        lines = []
+        if resumed:
+            draft = stripe_call(stripe.Invoice.retrieve, run['stripe_invoice_id'], idempotent=False)
+            lines = draft['lines']['data'] if 'lines' in draft else []
+        if lines:
+            invoice_item_id = invoice_item_of(lines[0])
+        else:
+            invoice_item_id = stripe_call(
+                stripe.InvoiceItem.create,
+                customer=run['stripe_customer_id'],
+                invoice=run['stripe_invoice_id'],
+                amount=int(run['amount'] * 100),  # Amount in cents
+                currency='usd',
+                description=f"Monthly Invoice - {month}/{year}",
+                idempotency_key=key('invoice-item')
+            ).id
+        checkpoint(state='stripe_created', stripe_invoice_item_id=invoice_item_id)
     
-    except Exception as e:
-        print(f"Error generating monthly invoices: {str(e)}")
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    if run['state'] == 'stripe_created':
+        # 4. Explicitly finalize the invoice
+        try:
+            finalized_invoice = stripe_call(stripe.Invoice.finalize_invoice, run['stripe_invoice_id'],
+                                            idempotency_key=key('finalize'))
+        except stripe.error.InvalidRequestError:
+            # Finalized by an earlier attempt whose idempotency key has expired
+            finalized_invoice = stripe_call(stripe.Invoice.retrieve, run['stripe_invoice_id'], idempotent=False)
+            if finalized_invoice.status == 'draft':
+                raise
+        checkpoint(state='finalized', payment_link=finalized_invoice.hosted_invoice_url)
+    
+    return run['state']
 
-def send_monthly_invoice_email(user_email, user_name, amount, payment_link, month, year, rental_names, start_dates, end_dates):
-    """Send monthly invoice email to user"""
+def send_monthly_invoice_email(user_email, user_name, amount, payment_link, month, year, rental_names, start_dates, end_dates, dedupe_key=None):
+    """Queue the monthly invoice email to a user"""
     try:
         # Create a table of rentals
         rental_rows = ""
@@ -2868,24 +3637,11 @@ def send_monthly_invoice_email(user_email, user_name, amount, payment_link, mont
         </html>
         """
         
-        # Send email via Gmail API
-        service = get_gmail_service()
-        if not service:
-            raise Exception("Gmail service unavailable")
+        # Sent in the background (see queue_email); queueing the same invoice
+        # again when the job is resumed is a no-op
+        queue_email(user_email, email_subject, email_body, dedupe_key=dedupe_key)
         
-        message = MIMEText(email_body, 'html')
-        message['to'] = user_email
-        message['subject'] = email_subject
-        
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        message_object = {'raw': raw_message}
-        
-        sent_message = service.users().messages().send(
-            userId='me', 
-            body=message_object
-        ).execute()
-        
-        print(f"Monthly invoice email sent successfully to {user_email}")
+        print(f"Monthly invoice email queued for {user_email}")
         
         return True
     
@@ -2961,7 +3717,10 @@ def stripe_webhook():
                             })
                             
                             print(f"✅ Updated {req_result.rowcount} rental requests to paid status")
-                
+
+                schedule_changed()
+                if request_ids:
+                    payments_changed(request_id_list, int(user_id))
                 return jsonify({'status': 'success', 'type': 'monthly_invoice'}), 200
             
             except Exception as db_error:
@@ -2980,10 +3739,15 @@ def stripe_webhook():
                 with pool.connect() as conn:
                     with conn.begin():
                         update_query = sqlalchemy.text(
-                            "UPDATE public.rental_request SET paid = TRUE WHERE request_id = :request_id"
+                            "UPDATE public.rental_request SET paid = TRUE WHERE request_id = :request_id "
+                            "RETURNING user_id"
                         )
                         result = conn.execute(update_query, {"request_id": request_id})
                         print(f"✅ DB updated for request_id={request_id}, rows affected: {result.rowcount}")
+                        updated = result.fetchone()
+                schedule_changed()
+                if updated:
+                    payments_changed([request_id], updated.user_id)
             except Exception as db_error:
                 print("❌ Database error:", db_error)
                 return jsonify({'error': str(db_error)}), 500
@@ -0,0 +1,47 @@
+-- Range columns and GiST indexes used by the SQL conflict engine
+-- (CONFLICT_ENGINE=sql). date_span is the booking's date range and
+-- time_window its daily window in minutes after midnight, both inclusive.
+--
+-- The columns are generated, so adding them backfills every existing row
+-- and later inserts/updates keep them current without any application code.
+
+ALTER TABLE public.rental_request
+    ADD COLUMN IF NOT EXISTS date_span daterange
+        GENERATED ALWAYS AS (
+            daterange(LEAST(start_date, end_date), GREATEST(start_date, end_date), '[]')
+        ) STORED,
+    ADD COLUMN IF NOT EXISTS time_window int4range
+        GENERATED ALWAYS AS (
+            int4range(
+                LEAST(EXTRACT(HOUR FROM start_time) * 60 + EXTRACT(MINUTE FROM start_time),
+                      EXTRACT(HOUR FROM end_time) * 60 + EXTRACT(MINUTE FROM end_time))::int,
+                GREATEST(EXTRACT(HOUR FROM start_time) * 60 + EXTRACT(MINUTE FROM start_time),
+                         EXTRACT(HOUR FROM end_time) * 60 + EXTRACT(MINUTE FROM end_time))::int,
+                '[]')
+        ) STORED;
+
+ALTER TABLE public.admin_event
+    ADD COLUMN IF NOT EXISTS date_span daterange
+        GENERATED ALWAYS AS (
+            daterange(LEAST(start_date, end_date), GREATEST(start_date, end_date), '[]')
+        ) STORED,
+    ADD COLUMN IF NOT EXISTS time_window int4range
+        GENERATED ALWAYS AS (
+            int4range(
+                LEAST(EXTRACT(HOUR FROM start_time) * 60 + EXTRACT(MINUTE FROM start_time),
+                      EXTRACT(HOUR FROM end_time) * 60 + EXTRACT(MINUTE FROM end_time))::int,
+                GREATEST(EXTRACT(HOUR FROM start_time) * 60 + EXTRACT(MINUTE FROM start_time),
+                         EXTRACT(HOUR FROM end_time) * 60 + EXTRACT(MINUTE FROM end_time))::int,
+                '[]')
+        ) STORED;
+
+-- Only approved/admin requests block the rink, so the request index is partial.
+CREATE INDEX IF NOT EXISTS rental_request_blocking_span_idx
+    ON public.rental_request USING gist (date_span, time_window)
+    WHERE rental_status IN ('approved', 'admin');
+
+CREATE INDEX IF NOT EXISTS admin_event_span_idx
+    ON public.admin_event USING gist (date_span, time_window);
+
+ANALYZE public.rental_request;
+ANALYZE public.admin_event;
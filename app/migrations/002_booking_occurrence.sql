@@ -0,0 +1,24 @@
+-- One row per concrete day a booking occurs on (USE_OCCURRENCE_TABLE=1 or
+-- CONFLICT_ENGINE=occurrences). source is 'rental' (rental_request.request_id)
+-- or 'admin' (admin_event.event_id). Rental rows exist for pending, approved
+-- and admin requests; denied requests have none.
+--
+-- The application keeps the table current on every write. After creating it,
+-- or after running with the table switched off, backfill it with
+--     FLASK_APP=main flask rebuild-occurrences
+-- or POST /api/admin/rebuild_occurrences.
+
+CREATE TABLE IF NOT EXISTS public.booking_occurrence (
+    source varchar(10) NOT NULL,
+    booking_id integer NOT NULL,
+    occurrence_date date NOT NULL,
+    start_time time NOT NULL,
+    end_time time NOT NULL,
+    PRIMARY KEY (source, booking_id, occurrence_date)
+);
+
+-- Calendar reads and conflict checks scan a date range, then filter on time.
+CREATE INDEX IF NOT EXISTS booking_occurrence_date_idx
+    ON public.booking_occurrence (occurrence_date, start_time, end_time);
+
+ANALYZE public.booking_occurrence;
@@ -0,0 +1,70 @@
+-- Change log behind /api/admin/changes (delta sync for the admin dashboard).
+-- Triggers add one row per inserted, updated or deleted rental_request or
+-- admin_event, plus one row per request of a renter whose profile changed
+-- (the dashboard shows renter name, email and phone next to each request).
+--
+-- txid is the writing transaction's id. The endpoint only returns rows whose
+-- transaction is older than every transaction still running, and uses that
+-- horizon as the next cursor, so a change is never skipped because its
+-- transaction committed after a later one. Needs PostgreSQL 13 or newer.
+--
+-- cleanup_requests prunes rows older than 30 days and leaves a 'pruned' row
+-- carrying the newest txid it removed; a dashboard whose cursor is not past
+-- that is told to reload everything.
+
+CREATE TABLE IF NOT EXISTS public.schedule_change (
+    change_id bigserial PRIMARY KEY,
+    txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    source varchar(10) NOT NULL,
+    row_id integer NOT NULL,
+    op char(1) NOT NULL,
+    changed_at timestamptz NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS schedule_change_txid_idx
+    ON public.schedule_change (txid);
+
+CREATE OR REPLACE FUNCTION public.log_rental_request_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO public.schedule_change (source, row_id, op) VALUES ('rental', OLD.request_id, 'D');
+    ELSE
+        INSERT INTO public.schedule_change (source, row_id, op) VALUES ('rental', NEW.request_id, LEFT(TG_OP, 1));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.log_admin_event_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO public.schedule_change (source, row_id, op) VALUES ('admin', OLD.event_id, 'D');
+    ELSE
+        INSERT INTO public.schedule_change (source, row_id, op) VALUES ('admin', NEW.event_id, LEFT(TG_OP, 1));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.log_renter_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO public.schedule_change (source, row_id, op)
+    SELECT 'rental', request_id, 'U' FROM public.rental_request WHERE user_id = NEW.renter_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rental_request_change ON public.rental_request;
+CREATE TRIGGER rental_request_change
+    AFTER INSERT OR UPDATE OR DELETE ON public.rental_request
+    FOR EACH ROW EXECUTE FUNCTION public.log_rental_request_change();
+
+DROP TRIGGER IF EXISTS admin_event_change ON public.admin_event;
+CREATE TRIGGER admin_event_change
+    AFTER INSERT OR UPDATE OR DELETE ON public.admin_event
+    FOR EACH ROW EXECUTE FUNCTION public.log_admin_event_change();
+
+DROP TRIGGER IF EXISTS renter_change ON public.renter;
+CREATE TRIGGER renter_change
+    AFTER UPDATE OF first_name, last_name, renter_email, phone ON public.renter
+    FOR EACH ROW EXECUTE FUNCTION public.log_renter_change();
@@ -0,0 +1,10 @@
+-- Indexes behind the keyset-paginated admin listings (/api/admin/all-requests
+-- and /api/admin/requests): pages are read in (start_date, start_time,
+-- request_id) order, optionally for a single renter, so each page is an
+-- index range scan no matter how much history the table holds.
+
+CREATE INDEX IF NOT EXISTS rental_request_listing_idx
+    ON public.rental_request (start_date, start_time, request_id);
+
+CREATE INDEX IF NOT EXISTS rental_request_user_listing_idx
+    ON public.rental_request (user_id, start_date, start_time, request_id);
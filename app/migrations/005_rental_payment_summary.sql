@@ -0,0 +1,109 @@
+-- Per-renter, per-month payment totals behind the admin payment summary cards
+-- (/api/admin/all-requests, /api/admin/user-requests, /api/admin/payment-summary).
+-- One row per (user_id, month of start_date, rental_status), so the cards are
+-- a SUM over a handful of rows instead of over every request.
+--
+-- A trigger on rental_request keeps the rows current for every write that
+-- changes amount, paid, rental_status, start_date or user_id: approvals,
+-- amount edits, mark-paid, the Stripe webhook, deletes by cleanup_requests.
+-- unpaid_count / unpaid_amount only count requests that are not paid and have
+-- a non-zero amount, like the ?payment=unpaid filter.
+--
+-- The last statement rebuilds the table from rental_request under a lock, so
+-- this file is also the way to repair it if it ever drifts.
+
+CREATE TABLE IF NOT EXISTS public.rental_payment_summary (
+    user_id integer NOT NULL,
+    month date NOT NULL,
+    rental_status varchar(20) NOT NULL,
+    request_count integer NOT NULL DEFAULT 0,
+    paid_count integer NOT NULL DEFAULT 0,
+    unpaid_count integer NOT NULL DEFAULT 0,
+    paid_amount numeric NOT NULL DEFAULT 0,
+    unpaid_amount numeric NOT NULL DEFAULT 0,
+    total_amount numeric NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, rental_status)
+);
+
+CREATE INDEX IF NOT EXISTS rental_payment_summary_month_idx
+    ON public.rental_payment_summary (month);
+
+CREATE OR REPLACE FUNCTION public.add_rental_payment(
+    p_user_id integer, p_start_date date, p_status varchar, p_paid boolean, p_amount numeric, p_sign integer
+) RETURNS void AS $$
+DECLARE
+    amount numeric := COALESCE(p_amount, 0);
+    paid boolean := COALESCE(p_paid, false);
+BEGIN
+    IF p_user_id IS NULL OR p_start_date IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO public.rental_payment_summary AS s (
+        user_id, month, rental_status, request_count, paid_count, unpaid_count,
+        paid_amount, unpaid_amount, total_amount
+    ) VALUES (
+        p_user_id, date_trunc('month', p_start_date)::date, COALESCE(p_status, ''),
+        p_sign,
+        CASE WHEN paid THEN p_sign ELSE 0 END,
+        CASE WHEN NOT paid AND amount <> 0 THEN p_sign ELSE 0 END,
+        CASE WHEN paid THEN p_sign * amount ELSE 0 END,
+        CASE WHEN NOT paid THEN p_sign * amount ELSE 0 END,
+        p_sign * amount
+    )
+    ON CONFLICT (user_id, month, rental_status) DO UPDATE SET
+        request_count = s.request_count + EXCLUDED.request_count,
+        paid_count = s.paid_count + EXCLUDED.paid_count,
+        unpaid_count = s.unpaid_count + EXCLUDED.unpaid_count,
+        paid_amount = s.paid_amount + EXCLUDED.paid_amount,
+        unpaid_amount = s.unpaid_amount + EXCLUDED.unpaid_amount,
+        total_amount = s.total_amount + EXCLUDED.total_amount;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.track_rental_payment() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM public.add_rental_payment(OLD.user_id, OLD.start_date, OLD.rental_status, OLD.paid, OLD.amount, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.add_rental_payment(NEW.user_id, NEW.start_date, NEW.rental_status, NEW.paid, NEW.amount, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.rebuild_rental_payment_summary() RETURNS integer AS $$
+DECLARE
+    rebuilt integer;
+BEGIN
+    LOCK TABLE public.rental_request IN SHARE MODE;
+    DELETE FROM public.rental_payment_summary;
+    INSERT INTO public.rental_payment_summary (
+        user_id, month, rental_status, request_count, paid_count, unpaid_count,
+        paid_amount, unpaid_amount, total_amount
+    )
+    SELECT
+        user_id,
+        date_trunc('month', start_date)::date,
+        COALESCE(rental_status, ''),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE paid),
+        COUNT(*) FILTER (WHERE NOT COALESCE(paid, false) AND COALESCE(amount, 0) <> 0),
+        COALESCE(SUM(amount) FILTER (WHERE paid), 0),
+        COALESCE(SUM(amount) FILTER (WHERE NOT COALESCE(paid, false)), 0),
+        COALESCE(SUM(amount), 0)
+    FROM public.rental_request
+    WHERE user_id IS NOT NULL AND start_date IS NOT NULL
+    GROUP BY 1, 2, 3;
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rental_payment_change ON public.rental_request;
+CREATE TRIGGER rental_payment_change
+    AFTER INSERT OR DELETE OR UPDATE OF amount, paid, rental_status, start_date, user_id
+    ON public.rental_request
+    FOR EACH ROW EXECUTE FUNCTION public.track_rental_payment();
+
+SELECT public.rebuild_rental_payment_summary();
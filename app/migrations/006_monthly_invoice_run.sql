@@ -0,0 +1,40 @@
+-- Progress of the monthly invoicing job, one row per renter and month, so a
+-- run that dies halfway (timeout, deploy, Stripe outage) is resumed instead
+-- of started over.
+--
+-- state moves planned -> stripe_created -> finalized -> recorded -> emailed:
+--     planned         the Stripe customer and draft invoice ids are saved
+--                     here as soon as they exist; until the invoice exists
+--                     each invocation re-plans amount and requests, and
+--                     drops the run if the renter has nothing due any more
+--     stripe_created  the invoice item was added to that invoice
+--     finalized       it was finalized (payment_link)
+--     recorded        the monthly_invoice row was inserted, in the same
+--                     statement that set this state
+--     emailed         the invoice email was queued (email_outbox)
+-- Each Stripe call uses an idempotency key made of user, month, year and
+-- step, so repeating a step whose result was lost does not create a second
+-- object.
+
+CREATE TABLE IF NOT EXISTS public.monthly_invoice_run (
+    invoice_year integer NOT NULL,
+    invoice_month integer NOT NULL,
+    user_id integer NOT NULL REFERENCES public.renter (renter_id),
+    state varchar(20) NOT NULL DEFAULT 'planned'
+        CHECK (state IN ('planned', 'stripe_created', 'finalized', 'recorded', 'emailed')),
+    amount numeric(10,2) NOT NULL,
+    request_ids integer[] NOT NULL,
+    details jsonb NOT NULL,
+    stripe_customer_id varchar(255),
+    stripe_invoice_item_id varchar(255),
+    stripe_invoice_id varchar(255),
+    payment_link varchar(255),
+    attempts integer NOT NULL DEFAULT 0,
+    last_error text,
+    updated_at timestamp NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (invoice_year, invoice_month, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS monthly_invoice_run_pending_idx
+    ON public.monthly_invoice_run (invoice_year, invoice_month)
+    WHERE state <> 'emailed';
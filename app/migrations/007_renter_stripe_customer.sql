@@ -0,0 +1,9 @@
+-- Stripe customer of each renter, so invoices reuse one customer instead of
+-- creating a new one per invoice (send_invoice) or searching Stripe by email
+-- every month (the invoicing job). Filled on first use; existing customers
+-- can be linked all at once with `flask backfill-stripe-customers` or
+-- POST /api/admin/backfill_stripe_customers.
+
+ALTER TABLE public.renter
+    ADD COLUMN IF NOT EXISTS stripe_customer_id varchar(255);
+
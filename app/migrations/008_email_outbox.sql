@@ -0,0 +1,30 @@
+-- Outgoing emails, sent in the background instead of inside the request that
+-- causes them (approvals, declines, admin requests, invoices).
+--
+-- status moves pending -> sending -> sent, or back to pending with a later
+-- next_attempt_at after a failed attempt, or to failed after the last one.
+-- While a row is 'sending', next_attempt_at is the end of the sender's lease:
+-- if the process dies before recording the result, the row is sent again
+-- once the lease runs out.
+-- dedupe_key (optional) makes enqueueing the same email twice a no-op, e.g.
+-- when the monthly invoicing job is resumed.
+
+CREATE TABLE IF NOT EXISTS public.email_outbox (
+    email_id bigserial PRIMARY KEY,
+    to_address varchar(255) NOT NULL,
+    subject text NOT NULL,
+    html_body text NOT NULL,
+    dedupe_key varchar(255) UNIQUE,
+    status varchar(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt_at timestamp NOT NULL DEFAULT NOW(),
+    last_error text,
+    message_id varchar(255),
+    created_at timestamp NOT NULL DEFAULT NOW(),
+    sent_at timestamp
+);
+
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx
+    ON public.email_outbox (next_attempt_at)
+    WHERE status IN ('pending', 'sending');
@@ -0,0 +1,239 @@
+"""
+Materialized booking occurrences (USE_OCCURRENCE_TABLE=1).
+
+public.booking_occurrence (migrations/002_booking_occurrence.sql) holds one
+row per concrete day a booking takes the ice, so calendar reads and conflict
+checks become range scans over dates instead of expanding recurrence rules
+in Python on every request. Rows are rebuilt for a booking whenever it is
+created, approved, declined, edited or deleted, and rebuild_all() backfills
+the whole table.
+"""
+import sqlalchemy
+
+from conflict_index import Booking, bookings_conflict, collisions
+from recurrence import PERIOD_DAYS
+
+
+# Rental statuses that show up on a calendar (pending only on the renter's own)
+OCCURRING_STATUSES = ('pending', 'approved', 'admin')
+
+
+def period_sql(alias):
+    """SQL expression for a booking's period in days, matching recurrence.Recurrence"""
+    cases = " ".join(f"WHEN '{rule}' THEN {days}" for rule, days in PERIOD_DAYS.items())
+    return f"CASE WHEN {alias}.is_recurring THEN (CASE {alias}.recurrence_rule {cases} ELSE 1 END) ELSE 1 END"
+
+
+def shown_sql(alias):
+    """
+    SQL condition on an occurrence `o` of booking `alias` that the calendars
+    show, matching main.process_recurring_events: one-off bookings only on
+    their start date, recurring ones only with a rule in PERIOD_DAYS. The
+    table itself keeps period_sql's conservative rows for the conflict checks.
+    """
+    rules = ", ".join(f"'{rule}'" for rule in PERIOD_DAYS)
+    return (f"(CASE WHEN {alias}.is_recurring THEN {alias}.recurrence_rule IN ({rules}) "
+            f"ELSE o.occurrence_date = {alias}.start_date END)")
+
+
+RENTAL_OCCURRENCES_INSERT = f"""
+    INSERT INTO public.booking_occurrence (source, booking_id, occurrence_date, start_time, end_time)
+    SELECT 'rental', rr.request_id, day::date, rr.start_time, rr.end_time
+    FROM public.rental_request rr
+    CROSS JOIN LATERAL generate_series(
+        rr.start_date::timestamp, rr.end_date::timestamp,
+        make_interval(days => {period_sql('rr')})
+    ) AS day
+    WHERE rr.rental_status IN {OCCURRING_STATUSES}
+"""
+
+ADMIN_OCCURRENCES_INSERT = f"""
+    INSERT INTO public.booking_occurrence (source, booking_id, occurrence_date, start_time, end_time)
+    SELECT 'admin', ae.event_id, day::date, ae.start_time, ae.end_time
+    FROM public.admin_event ae
+    CROSS JOIN LATERAL generate_series(
+        ae.start_date::timestamp, ae.end_date::timestamp,
+        make_interval(days => {period_sql('ae')})
+    ) AS day
+"""
+
+
+def refresh_booking(conn, source, booking_id):
+    """Replace one booking's occurrences with what its current row says (none if it is gone)"""
+    if not conn.in_transaction():
+        with conn.begin():
+            return refresh_booking(conn, source, booking_id)
+
+    conn.execute(sqlalchemy.text("""
+        DELETE FROM public.booking_occurrence
+        WHERE source = :source AND booking_id = :booking_id
+    """), {"source": source, "booking_id": booking_id})
+
+    if source == 'admin':
+        insert_query = ADMIN_OCCURRENCES_INSERT + " WHERE ae.event_id = :booking_id"
+    else:
+        insert_query = RENTAL_OCCURRENCES_INSERT + " AND rr.request_id = :booking_id"
+    conn.execute(sqlalchemy.text(insert_query), {"booking_id": booking_id})
+
+
+def rebuild_all(conn):
+    """Rebuild the whole table from rental_request and admin_event; returns the row count"""
+    with conn.begin():
+        conn.execute(sqlalchemy.text("DELETE FROM public.booking_occurrence"))
+        conn.execute(sqlalchemy.text(RENTAL_OCCURRENCES_INSERT))
+        conn.execute(sqlalchemy.text(ADMIN_OCCURRENCES_INSERT))
+        count = conn.execute(sqlalchemy.text("SELECT COUNT(*) FROM public.booking_occurrence")).scalar()
+    return count
+
+
+CONFLICT_CANDIDATE_QUERY = sqlalchemy.text("""
+    SELECT DISTINCT
+        'rental' as source,
+        rr.request_id as booking_id,
+        rr.rental_name as name,
+        rr.start_date,
+        rr.end_date,
+        rr.start_time,
+        rr.end_time,
+        rr.is_recurring,
+        rr.recurrence_rule,
+        rr.rental_status as status
+    FROM public.booking_occurrence o
+    JOIN public.rental_request rr ON o.source = 'rental' AND rr.request_id = o.booking_id
+    WHERE o.occurrence_date BETWEEN :first_day AND :last_day
+    AND mod(o.occurrence_date - CAST(:first_day AS date), :period) = 0
+    AND o.start_time <= :end_time AND o.end_time >= :start_time
+    AND rr.rental_status IN ('approved', 'admin')
+    UNION
+    SELECT DISTINCT
+        'admin' as source,
+        ae.event_id as booking_id,
+        ae.event_name as name,
+        ae.start_date,
+        ae.end_date,
+        ae.start_time,
+        ae.end_time,
+        ae.is_recurring,
+        ae.recurrence_rule,
+        NULL as status
+    FROM public.booking_occurrence o
+    JOIN public.admin_event ae ON o.source = 'admin' AND ae.event_id = o.booking_id
+    WHERE o.occurrence_date BETWEEN :first_day AND :last_day
+    AND mod(o.occurrence_date - CAST(:first_day AS date), :period) = 0
+    AND o.start_time <= :end_time AND o.end_time >= :start_time
+""")
+
+
+def fetch_candidates(conn, proposed):
+    """Blocking bookings with an occurrence on one of the proposal's days and an overlapping window"""
+    if proposed.end_date < proposed.start_date:
+        return []
+    rows = conn.execute(CONFLICT_CANDIDATE_QUERY, {
+        "first_day": proposed.start_date,
+        "last_day": proposed.end_date,
+        "period": proposed.recurrence.period,
+        "start_time": proposed.start_time,
+        "end_time": proposed.end_time
+    }).fetchall()
+    return [Booking(*row) for row in rows]
+
+
+CALENDAR_QUERY = sqlalchemy.text(f"""
+    SELECT
+        rr.request_id as id,
+        rr.rental_name as name,
+        rr.additional_desc as description,
+        rr.start_time::text as start_time,
+        rr.end_time::text as end_time,
+        o.occurrence_date::text as occurrence_date,
+        rr.rental_status as status,
+        rr.is_recurring,
+        rr.recurrence_rule
+    FROM public.booking_occurrence o
+    JOIN public.rental_request rr ON o.source = 'rental' AND rr.request_id = o.booking_id
+    WHERE o.occurrence_date BETWEEN :start AND :end
+    AND rr.rental_status = 'approved'
+    AND {shown_sql('rr')}
+    UNION ALL
+    SELECT
+        ae.event_id as id,
+        ae.event_name as name,
+        ae.additional_desc as description,
+        ae.start_time::text as start_time,
+        ae.end_time::text as end_time,
+        o.occurrence_date::text as occurrence_date,
+        'admin' as status,
+        ae.is_recurring,
+        ae.recurrence_rule
+    FROM public.booking_occurrence o
+    JOIN public.admin_event ae ON o.source = 'admin' AND ae.event_id = o.booking_id
+    WHERE o.occurrence_date BETWEEN :start AND :end
+    AND {shown_sql('ae')}
+    ORDER BY occurrence_date, start_time
+""")
+
+USER_CALENDAR_QUERY = sqlalchemy.text(f"""
+    SELECT
+        rr.request_id as id,
+        rr.rental_name as name,
+        rr.additional_desc as description,
+        rr.start_time::text as start_time,
+        rr.end_time::text as end_time,
+        o.occurrence_date::text as occurrence_date,
+        rr.rental_status as status,
+        rr.is_recurring,
+        rr.recurrence_rule
+    FROM public.booking_occurrence o
+    JOIN public.rental_request rr ON o.source = 'rental' AND rr.request_id = o.booking_id
+    INNER JOIN public.renter ON rr.user_id = renter.renter_id
+    WHERE o.occurrence_date BETWEEN :start AND :end
+    AND renter.firebase_uid = :firebase_uid
+    AND rr.rental_status IN ('pending', 'approved', 'admin')
+    AND {shown_sql('rr')}
+    ORDER BY o.occurrence_date, rr.start_time
+""")
+
+
+def fetch_calendar(conn, start_date, end_date):
+    """Approved requests and admin events occurring between start_date and end_date"""
+    return conn.execute(CALENDAR_QUERY, {"start": start_date, "end": end_date}).mappings().all()
+
+
+def fetch_user_calendar(conn, firebase_uid, start_date, end_date):
+    """One renter's pending/approved/admin requests occurring between start_date and end_date"""
+    return conn.execute(USER_CALENDAR_QUERY, {
+        "firebase_uid": firebase_uid,
+        "start": start_date,
+        "end": end_date
+    }).mappings().all()
+
+
+class OccurrenceConflictEngine:
+    """Conflict engine that range-scans booking_occurrence (CONFLICT_ENGINE=occurrences)"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def candidates(self, proposed):
+        with self._pool.connect() as conn:
+            return fetch_candidates(conn, proposed)
+
+    def find_conflicts(self, proposed):
+        return collisions(proposed, self.candidates(proposed))
+
+    def find_conflicts_many(self, proposals):
+        with self._pool.connect() as conn:
+            return [collisions(proposed, fetch_candidates(conn, proposed)) for proposed in proposals]
+
+    def has_conflict(self, proposed):
+        return any(bookings_conflict(proposed, booking) for booking in self.candidates(proposed))
+
+    # The table is kept current by refresh_booking, nothing is cached here.
+    def upsert(self, booking):
+        pass
+
+    def remove(self, source, booking_id):
+        pass
+
+    def invalidate(self):
+        pass
@@ -0,0 +1,119 @@
+"""
+Recurrence algebra for bookings.
+
+Every booking is an arithmetic progression of days plus a daily time window:
+it occurs on anchor, anchor + period, anchor + 2 * period, ... up to
+anchor + span (ordinal days), between window_start and window_end (minutes
+after midnight, both inclusive). Two bookings collide when their windows
+overlap and the progressions share a day, which is a pair of congruences we
+can solve directly instead of walking the calendar.
+"""
+from datetime import date
+from math import gcd
+
+
+# Days between occurrences for each recurrence rule we understand.
+PERIOD_DAYS = {
+    'daily': 1,
+    'weekly': 7,
+    'biweekly': 14,
+}
+
+
+def minutes_of(t):
+    """Minutes after midnight for a datetime.time"""
+    return t.hour * 60 + t.minute
+
+
+def period_of(is_recurring, recurrence_rule, strict=False):
+    """
+    Days between occurrences. One-off bookings cover every day from start to
+    end; recurring bookings with a rule we don't know are treated as daily so
+    they can only ever report too many conflicts, never too few. With
+    strict=True (for showing bookings rather than checking them) an unknown
+    rule gives None instead.
+    """
+    if not is_recurring:
+        return 1
+    return PERIOD_DAYS.get(recurrence_rule) if strict else PERIOD_DAYS.get(recurrence_rule, 1)
+
+
+def iter_dates(first_day, last_day, period, window_start, window_end):
+    """
+    Lazily yield first_day, first_day + period, ... up to last_day, limited to
+    window_start..window_end. Jumps straight to the first occurrence inside
+    the window instead of walking the calendar day by day.
+    """
+    anchor = first_day.toordinal()
+    low = window_start.toordinal()
+    high = min(last_day, window_end).toordinal()
+    if low > anchor:
+        anchor += -(-(low - anchor) // period) * period
+    for ordinal in range(anchor, high + 1, period):
+        yield date.fromordinal(ordinal)
+
+
+class Recurrence:
+    """An (anchor, period, span, daily window) description of a booking"""
+
+    __slots__ = ('anchor', 'period', 'span', 'window_start', 'window_end')
+
+    def __init__(self, anchor, period, span, window_start, window_end):
+        self.anchor = anchor
+        self.period = period
+        self.span = span
+        self.window_start = window_start
+        self.window_end = window_end
+
+    @classmethod
+    def from_booking(cls, start_date, end_date, start_time, end_time, is_recurring, recurrence_rule):
+        """Build from a booking's columns; see period_of for how the rule is read"""
+        period = period_of(is_recurring, recurrence_rule)
+        anchor = start_date.toordinal()
+        return cls(anchor, period, end_date.toordinal() - anchor,
+                   minutes_of(start_time), minutes_of(end_time))
+
+    @property
+    def last(self):
+        """Ordinal of the last day the booking can occur on"""
+        return self.anchor + self.span
+
+    @property
+    def weekday(self):
+        """Weekday of every occurrence, or None if the booking falls on several weekdays"""
+        if self.period % 7 == 0 or self.span < self.period:
+            return date.fromordinal(self.anchor).weekday()
+        return None
+
+    def windows_overlap(self, other):
+        return self.window_start <= other.window_end and self.window_end >= other.window_start
+
+    def occurs_on(self, ordinal):
+        return self.anchor <= ordinal <= self.last and (ordinal - self.anchor) % self.period == 0
+
+    def first_common_day(self, other):
+        """First ordinal day both bookings occur on, ignoring the time windows, or None"""
+        low = max(self.anchor, other.anchor)
+        high = min(self.last, other.last)
+        if low > high:
+            return None
+
+        # Solve x = self.anchor (mod p1) and x = other.anchor (mod p2).
+        g = gcd(self.period, other.period)
+        offset = other.anchor - self.anchor
+        if offset % g:
+            return None
+        modulus = other.period // g
+        steps = (offset // g) * pow(self.period // g, -1, modulus) % modulus
+        solution = self.anchor + self.period * steps
+        lcm = self.period * modulus
+
+        first = low + (solution - low) % lcm
+        return first if first <= high else None
+
+    def first_collision(self, other):
+        """First date both bookings occupy the ice at the same time, or None"""
+        if not self.windows_overlap(other):
+            return None
+        day = self.first_common_day(other)
+        return date.fromordinal(day) if day is not None else None
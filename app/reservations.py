@@ -0,0 +1,90 @@
+"""
+Conflict-check-and-insert in one transaction.
+
+Two submits for the same slot used to be able to both pass the conflict
+check before either INSERT committed. Callers now open a transaction, call
+lock_and_find_conflicts() and only INSERT if it returns nothing. The check
+takes transaction-scoped advisory locks on every (weekday, hour) bucket the
+proposal touches, so two bookings that could collide always share a lock
+and are serialized, while bookings in different buckets go through in
+parallel.
+"""
+import sqlalchemy
+
+from conflict_index import Booking, collisions
+
+
+# First key of the two-key advisory lock, so our locks can't clash with
+# advisory locks taken for anything else.
+LOCK_NAMESPACE = 462
+
+LOCK_QUERY = sqlalchemy.text("SELECT pg_advisory_xact_lock(:namespace, :bucket)")
+
+# Same candidates as sql_conflicts.CANDIDATE_QUERY, using the plain columns
+# so it works before migrations/001_booking_ranges.sql has been applied.
+OVERLAP_QUERY = sqlalchemy.text("""
+    SELECT
+        'rental' as source,
+        request_id as booking_id,
+        rental_name as name,
+        start_date,
+        end_date,
+        start_time,
+        end_time,
+        is_recurring,
+        recurrence_rule,
+        rental_status as status
+    FROM public.rental_request
+    WHERE rental_status IN ('approved', 'admin')
+    AND start_date <= :last_day AND end_date >= :first_day
+    UNION ALL
+    SELECT
+        'admin' as source,
+        event_id as booking_id,
+        event_name as name,
+        start_date,
+        end_date,
+        start_time,
+        end_time,
+        is_recurring,
+        recurrence_rule,
+        NULL as status
+    FROM public.admin_event
+    WHERE start_date <= :last_day AND end_date >= :first_day
+""")
+
+
+def slot_lock_buckets(proposed):
+    """Sorted (weekday * 24 + hour) buckets the proposal can occupy"""
+    recurrence = proposed.recurrence
+    if recurrence.weekday is not None:
+        weekdays = {recurrence.weekday}
+    else:
+        days = range(recurrence.anchor, recurrence.last + 1, recurrence.period)
+        weekdays = {(ordinal - 1) % 7 for ordinal in days[:7]}  # date.fromordinal(1) is a Monday
+    first_hour = recurrence.window_start // 60
+    last_hour = min(recurrence.window_end // 60, 23)
+    return sorted(weekday * 24 + hour for weekday in weekdays for hour in range(first_hour, last_hour + 1))
+
+
+def fetch_overlapping(conn, proposed):
+    """Blocking bookings whose date range overlaps the proposal's"""
+    rows = conn.execute(OVERLAP_QUERY, {
+        "first_day": proposed.start_date,
+        "last_day": proposed.end_date
+    }).fetchall()
+    return [Booking(*row) for row in rows]
+
+
+def lock_and_find_conflicts(conn, proposed, fetch=fetch_overlapping):
+    """
+    Lock the proposal's slot buckets and return its (booking, date) conflicts.
+    Must run inside a transaction on `conn`; the locks are held until it ends,
+    so an INSERT made in the same transaction can't race another submit.
+    `fetch(conn, proposed)` loads the candidate bookings, e.g.
+    sql_conflicts.fetch_candidates or occurrences.fetch_candidates.
+    """
+    for bucket in slot_lock_buckets(proposed):
+        conn.execute(LOCK_QUERY, {"namespace": LOCK_NAMESPACE, "bucket": bucket})
+
+    return collisions(proposed, fetch(conn, proposed))
@@ -0,0 +1,188 @@
+"""
+Response cache for read-mostly JSON endpoints (the public /api/events).
+
+Entries live for at most `ttl` seconds and every write to the schedule calls
+invalidate(). Each entry is stored under the cache's current generation, and
+invalidate() moves to a new, random generation. A response computed while a
+write was happening is therefore stored under the old generation and never
+served.
+
+Backends only need get(key), set(key, value, ttl), generation() and
+bump_generation():
+    MemoryBackend   in-process LRU (default; one copy per gunicorn worker)
+    FileBackend     JSON files in a directory shared by every worker on the
+                    instance, so a write seen by one worker clears them all
+
+Neither is shared between instances. What keeps instances from serving a
+response another one has made stale is the schedule version in the keys,
+which ScheduleVersion memoizes for a second or so per process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def new_generation():
+    """A fresh opaque generation token (random, so restarts never reuse one)"""
+    return uuid.uuid4().hex[:12]
+
+
+class MemoryBackend:
+    """Thread-safe LRU dict with per-entry expiry"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generation = new_generation()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation = new_generation()
+            self._entries.clear()
+
+
+class FileBackend:
+    """One JSON file per entry in `directory` plus a shared generation file"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._generation_path = os.path.join(directory, 'generation')
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _write(self, path, text):
+        # Write then rename so readers in other workers never see half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry['expires'] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry['value']
+
+    def set(self, key, value, ttl):
+        self._write(self._path(key), json.dumps({"expires": time.time() + ttl, "value": value}))
+
+    def generation(self):
+        try:
+            with open(self._generation_path) as f:
+                generation = f.read()
+        except OSError:
+            generation = ''
+        if not generation:
+            # First use (or the directory was wiped); if two workers race
+            # here, the loser's entries simply become unreachable.
+            generation = new_generation()
+            self._write(self._generation_path, generation)
+        return generation
+
+    def bump_generation(self):
+        self._write(self._generation_path, new_generation())
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class ResponseCache:
+    """TTL + invalidate-on-write cache in front of a backend"""
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def generation(self):
+        """Read once before building a response and pass to get/set"""
+        return self.backend.generation()
+
+    def get(self, generation, key):
+        return self.backend.get(f"{generation}:{key}")
+
+    def set(self, generation, key, value):
+        self.backend.set(f"{generation}:{key}", value, self.ttl)
+
+    def invalidate(self):
+        self.backend.bump_generation()
+
+
+
+class ScheduleVersion:
+    """
+    Keeps the version returned by `read` (a database query) for `ttl` seconds,
+    so requests within that time don't touch the database. forget() makes the
+    next get() read it again: call it after this process writes.
+    """
+
+    def __init__(self, read, ttl=1.0, clock=time.monotonic):
+        self.read = read
+        self.ttl = ttl
+        self.clock = clock
+        self._value = None
+        self._expires = 0
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._value is not None and self.clock() < self._expires:
+                return self._value
+            epoch = self._epoch
+        value = self.read()
+        with self._lock:
+            # A read that started before forget() may predate the write
+            if epoch == self._epoch:
+                self._value = value
+                self._expires = self.clock() + self.ttl
+        return value
+
+    def last(self):
+        """The last version read, however old (None before the first read)"""
+        return self._value
+
+    def forget(self):
+        with self._lock:
+            self._epoch += 1
+            self._expires = 0
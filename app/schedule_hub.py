@@ -0,0 +1,142 @@
+"""
+In-process fan-out of schedule changes to Server-Sent Events subscribers.
+
+Write paths call publish() after they commit; every /api/stream/schedule
+connection holds a Subscription (a bounded queue) and no database
+connection. The last `history` events are kept so a browser reconnecting
+with Last-Event-ID gets what it missed; if it fell further behind than
+that, or the process restarted in between, it is sent a `reset` event and
+should reload.
+
+Only one process sees its own publishes: run gunicorn with threads rather
+than several worker processes so every request shares one hub.
+"""
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class Subscription:
+    """One stream connection: who it is for and its pending events"""
+
+    def __init__(self, renter_id, is_admin, queue_size):
+        self.renter_id = renter_id
+        self.is_admin = is_admin
+        self.events = queue.Queue(queue_size)
+
+    def payload(self, event):
+        """What this subscriber may see of an event, or None to skip it"""
+        if self.is_admin or event['public'] or (
+                event['owner'] is not None and event['owner'] == self.renter_id):
+            return event['data']
+        return event['public_data']
+
+
+class ScheduleHub:
+    """Thread-safe publish/subscribe hub with a short replay history"""
+
+    def __init__(self, max_subscribers=4, history=200, queue_size=100):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        # Event ids are "<boot>:<n>" so ids from before a restart are recognized
+        self._boot = uuid.uuid4().hex[:8]
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, name, data, owner=None, public=False, public_data=None):
+        """
+        Send `data` as event `name`. Admins get everything; renters get public
+        events and those whose owner is their renter_id, and everyone else gets
+        `public_data` instead (if given).
+        """
+        with self._lock:
+            event = {"id": next(self._ids), "name": name, "data": data, "owner": owner,
+                     "public": public, "public_data": public_data}
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            self._deliver_event(subscription, event)
+
+    def _deliver_event(self, subscription, event):
+        data = subscription.payload(event)
+        if data is not None:
+            self._deliver(subscription, {"id": event['id'], "name": event['name'], "data": data})
+
+    def _deliver(self, subscription, message):
+        try:
+            subscription.events.put_nowait(message)
+        except queue.Full:
+            # The client isn't keeping up; drop its backlog and tell it to reload
+            while True:
+                try:
+                    subscription.events.get_nowait()
+                except queue.Empty:
+                    break
+            subscription.events.put_nowait(self._reset_event(message['id']))
+
+    def _reset_event(self, number):
+        return {"id": number, "name": "reset", "data": {}}
+
+    def _parse_event_id(self, last_event_id):
+        """Sequence number of one of our event ids, or None if it isn't one"""
+        boot, _, number = (last_event_id or '').partition(':')
+        if boot != self._boot or not number.isdigit():
+            return None
+        return int(number)
+
+    def subscribe(self, renter_id, is_admin, last_event_id=None):
+        """
+        Register a subscriber, or return None if the hub is full. last_event_id
+        is the browser's Last-Event-ID header when it reconnects.
+        """
+        subscription = Subscription(renter_id, is_admin, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscription)
+            history = list(self._history)
+            latest = history[-1]['id'] if history else 0
+
+        if last_event_id:
+            last = self._parse_event_id(last_event_id)
+            if last is None or (history and history[0]['id'] > last + 1):
+                self._deliver(subscription, self._reset_event(latest))
+            else:
+                for event in history:
+                    if event['id'] > last:
+                        self._deliver_event(subscription, event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stream(self, subscription, max_seconds, keepalive=15):
+        """
+        Generator of SSE text for a subscription. Ends after max_seconds (the
+        browser's EventSource reconnects on its own) and unsubscribes when done.
+        """
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = subscription.events.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (f"id: {self._boot}:{event['id']}\n"
+                       f"event: {event['name']}\n"
+                       f"data: {json.dumps(event['data'])}\n\n")
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,106 @@
+"""
+Conflict engine that lets PostgreSQL pick the candidate bookings.
+
+Needs the date_span/time_window range columns and GiST indexes from
+migrations/001_booking_ranges.sql. Enabled with CONFLICT_ENGINE=sql.
+"""
+import sqlalchemy
+
+from conflict_index import Booking, ConflictIndex, bookings_conflict, collisions
+
+
+CANDIDATE_QUERY = sqlalchemy.text("""
+    SELECT 
+        'rental' as source,
+        request_id as booking_id,
+        rental_name as name,
+        start_date,
+        end_date,
+        start_time,
+        end_time,
+        is_recurring,
+        recurrence_rule,
+        rental_status as status
+    FROM public.rental_request
+    WHERE rental_status IN ('approved', 'admin')
+    AND date_span && daterange(:first_day, :last_day, '[]')
+    AND time_window && int4range(:window_start, :window_end, '[]')
+    UNION ALL
+    SELECT 
+        'admin' as source,
+        event_id as booking_id,
+        event_name as name,
+        start_date,
+        end_date,
+        start_time,
+        end_time,
+        is_recurring,
+        recurrence_rule,
+        NULL as status
+    FROM public.admin_event
+    WHERE date_span && daterange(:first_day, :last_day, '[]')
+    AND time_window && int4range(:window_start, :window_end, '[]')
+""")
+
+
+def fetch_candidates_between(conn, first_day, last_day, window_start, window_end):
+    """Bookings overlapping the given date range and daily window (minutes), via one indexed query"""
+    if last_day < first_day or window_end < window_start:
+        return []
+    rows = conn.execute(CANDIDATE_QUERY, {
+        "first_day": first_day,
+        "last_day": last_day,
+        "window_start": window_start,
+        "window_end": window_end
+    }).fetchall()
+    return [Booking(*row) for row in rows]
+
+
+def fetch_candidates(conn, proposed):
+    """Bookings whose date range and daily window overlap the proposal"""
+    recurrence = proposed.recurrence
+    return fetch_candidates_between(conn, proposed.start_date, proposed.end_date,
+                                    recurrence.window_start, recurrence.window_end)
+
+
+class SqlConflictEngine:
+    """Same interface as ConflictIndex, but every query goes to the database"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def candidates(self, proposed):
+        with self._pool.connect() as conn:
+            return fetch_candidates(conn, proposed)
+
+    def find_conflicts(self, proposed):
+        return collisions(proposed, self.candidates(proposed))
+
+    def find_conflicts_many(self, proposals):
+        """find_conflicts for every proposal, loading the candidates for all of them in one query"""
+        valid = [p for p in proposals if p.recurrence.span >= 0]
+        if not valid:
+            return [[] for _ in proposals]
+        with self._pool.connect() as conn:
+            bookings = fetch_candidates_between(
+                conn,
+                min(p.start_date for p in valid),
+                max(p.end_date for p in valid),
+                min(p.recurrence.window_start for p in valid),
+                max(p.recurrence.window_end for p in valid)
+            )
+        snapshot = ConflictIndex(lambda: bookings, max_age=float('inf'))
+        return snapshot.find_conflicts_many(proposals)
+
+    def has_conflict(self, proposed):
+        return any(bookings_conflict(proposed, booking) for booking in self.candidates(proposed))
+
+    # Nothing is cached, so there is nothing to keep in sync.
+    def upsert(self, booking):
+        pass
+
+    def remove(self, source, booking_id):
+        pass
+
+    def invalidate(self):
+        pass
@@ -0,0 +1,61 @@
+"""
+Cold-start benchmark: times `import main` and the first request in fresh
+Python processes, the way a new App Engine instance starts.
+
+    cd app
+    python startup_benchmark.py --runs 5 --path /api/events
+
+It needs the same environment as the app itself (DATABASE_URL for a local
+database, firebase.json, ...). The first request goes through Flask's test
+client, so it includes whatever main sets up on first use but not gunicorn.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_request": finished - imported,
+                  "status": response.status_code}))
+"""
+
+
+def run_once(path):
+    """Import main and serve `path` once in a new interpreter; returns the timings in seconds"""
+    result = subprocess.run([sys.executable, '-c', PROBE, path], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        raise SystemExit(f"Benchmark run failed with exit code {result.returncode}")
+    # main prints its own messages, the timings are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(name, values):
+    millis = [value * 1000 for value in values]
+    print(f"{name:<14} median {statistics.median(millis):8.1f} ms   "
+          f"min {min(millis):8.1f} ms   max {max(millis):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time `import main` and the first request")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/', help="URL of the first request")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, first request GET {args.path} -> {runs[-1]['status']}")
+    summarize("import main", [run['import'] for run in runs])
+    summarize("first request", [run['first_request'] for run in runs])
+    summarize("total", [run['import'] + run['first_request'] for run in runs])
+
+
+if __name__ == '__main__':
+    main()
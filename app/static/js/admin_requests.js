@@ -1,9 +1,54 @@
+// How often the dashboard asks /api/admin/changes for other admins' edits:
+// often while the live stream (/api/stream/schedule) is off or disconnected,
+// rarely while it is open, for writes made on other instances that it misses
+const CHANGE_POLL_INTERVAL_MS = 30000;
+const STREAM_OPEN_POLL_INTERVAL_MS = 120000;
+
+// Local copy of the lists, patched in place from /api/admin/changes
+const adminState = {
+  requests: new Map(),  // request_id -> request row
+  events: new Map(),    // event_id -> admin event row
+  cursor: null,         // change cursor the lists are current up to
+  streamOpen: false     // whether /api/stream/schedule is currently connected
+};
+
 /**
  * Initialize the admin requests module
  */
 function initAdminRequestsModule() {
   loadAllRequests();
   setupAdminRequestControls();
+  openScheduleStream();
+
+  let lastPoll = Date.now();
+  setInterval(() => {
+    const interval = adminState.streamOpen ? STREAM_OPEN_POLL_INTERVAL_MS : CHANGE_POLL_INTERVAL_MS;
+    if (document.hidden || Date.now() - lastPoll < interval) return;
+    lastPoll = Date.now();
+    syncChanges();
+  }, CHANGE_POLL_INTERVAL_MS);
+}
+
+/**
+ * Listen for schedule changes pushed by the server. Events only say which rows
+ * changed; the full rows still come from /api/admin/changes.
+ */
+function openScheduleStream() {
+  if (!window.EventSource || !window.LIVE_UPDATES) return;
+
+  const stream = new EventSource('/api/stream/schedule');
+  stream.onopen = () => {
+    // Catch up on anything missed while disconnected
+    if (!adminState.streamOpen) syncChanges();
+    adminState.streamOpen = true;
+  };
+  stream.onerror = () => {
+    // EventSource reconnects by itself; poll until it does
+    adminState.streamOpen = false;
+  };
+  stream.addEventListener('booking', () => syncChanges());
+  stream.addEventListener('payment', () => syncChanges());
+  stream.addEventListener('reset', () => loadAllRequests());
 }
 
 /**
@@ -12,41 +57,27 @@ function initAdminRequestsModule() {
 function loadAllRequests() {
   showLoadingState(true);
   
-  Promise.all([
-    fetch('/api/admin/requests').then(handleResponse),
+  // Take the change cursor before the lists so no edit made during the load is lost
+  return fetch('/api/admin/changes')
+  .then(handleResponse)
+  .then(changeData => changeData.cursor)
+  .catch(error => {
+    console.error("Change log unavailable, falling back to full reloads:", error);
+    return null;
+  })
+  .then(cursor => Promise.all([
+    cursor,
+    fetchAllRequestPages('/api/admin/requests'),
     fetch('/api/admin/events').then(handleResponse)
-  ])
-  .then(([requestsData, eventsData]) => {
+  ]))
+  .then(([cursor, requestsData, eventsData]) => {
     const requests = Array.isArray(requestsData.requests) ? requestsData.requests : [];
-    const pending = requests.filter(r => r.request_status === 'pending');
-    const acceptedRequests = requests.filter(r => r.request_status === 'approved' || r.request_status === 'admin');
-    const declined = requests.filter(r => r.request_status === 'declined');
-    
     const adminEvents = Array.isArray(eventsData.events) ? eventsData.events : [];
-    const acceptedEvents = adminEvents.map(event => ({
-      ...event,
-      request_id: event.event_id,
-      request_status: 'admin', 
-      is_admin_event: true
-    }));
-
-    const allAccepted = [...acceptedRequests, ...acceptedEvents].sort((a, b) => {
-      return new Date(a.start_date) - new Date(b.start_date);
-    });
-
-    renderAdminRequests(pending, 'pendingRequests');
-    renderAdminRequests(allAccepted, 'acceptedRequests');
-    renderAdminDeclinedRequests(declined, 'declinedRequests');
 
-    // Delay filtering until DOM is rendered
-    setTimeout(() => {
-      filterRequests('pendingRequests');
-      filterRequests('acceptedRequests');
-      filterRequests('declinedRequests');
-    }, 0);
-    
-    updateRequestCounters(pending.length, allAccepted.length, declined.length);
-    setupRequestActions();
+    adminState.cursor = cursor;
+    adminState.requests = new Map(requests.map(r => [r.request_id, r]));
+    adminState.events = new Map(adminEvents.map(e => [e.event_id, e]));
+    renderAdminState();
   })
   .catch(error => {
     console.error("Error loading requests:", error);
@@ -57,6 +88,89 @@ function loadAllRequests() {
   });
 }
 
+/**
+ * Follow next_cursor through a paged request listing; resolves to {requests: [...]}
+ */
+async function fetchAllRequestPages(url) {
+  const requests = [];
+  let cursor = null;
+  do {
+    const pageUrl = cursor ? `${url}?after=${encodeURIComponent(cursor)}` : url;
+    const page = await fetch(pageUrl).then(handleResponse);
+    requests.push(...(page.requests || []));
+    cursor = page.next_cursor;
+  } while (cursor);
+  return { requests };
+}
+
+/**
+ * Apply the rows changed since adminState.cursor instead of reloading everything
+ */
+function syncChanges() {
+  if (!adminState.cursor) {
+    return loadAllRequests();
+  }
+
+  return fetch(`/api/admin/changes?since=${adminState.cursor}`)
+  .then(handleResponse)
+  .then(data => {
+    if (data.reset) {
+      return loadAllRequests();
+    }
+    adminState.cursor = data.cursor;
+
+    const changed = data.requests.length + data.events.length +
+      data.deleted_requests.length + data.deleted_events.length;
+    if (changed === 0) return;
+
+    data.requests.forEach(r => adminState.requests.set(r.request_id, r));
+    data.events.forEach(e => adminState.events.set(e.event_id, e));
+    data.deleted_requests.forEach(id => adminState.requests.delete(id));
+    data.deleted_events.forEach(id => adminState.events.delete(id));
+    renderAdminState();
+  })
+  .catch(error => {
+    console.error("Error syncing changes:", error);
+  });
+}
+
+/**
+ * Render the pending, accepted and declined lists from adminState
+ */
+function renderAdminState() {
+  const requests = [...adminState.requests.values()]
+    .sort((a, b) => new Date(a.start_date) - new Date(b.start_date));
+  const pending = requests.filter(r => r.request_status === 'pending');
+  const acceptedRequests = requests.filter(r => r.request_status === 'approved' || r.request_status === 'admin');
+  const declined = requests.filter(r => r.request_status === 'declined');
+  
+  const adminEvents = [...adminState.events.values()];
+  const acceptedEvents = adminEvents.map(event => ({
+    ...event,
+    request_id: event.event_id,
+    request_status: 'admin', 
+    is_admin_event: true
+  }));
+
+  const allAccepted = [...acceptedRequests, ...acceptedEvents].sort((a, b) => {
+    return new Date(a.start_date) - new Date(b.start_date);
+  });
+
+  renderAdminRequests(pending, 'pendingRequests');
+  renderAdminRequests(allAccepted, 'acceptedRequests');
+  renderAdminDeclinedRequests(declined, 'declinedRequests');
+
+  // Delay filtering until DOM is rendered
+  setTimeout(() => {
+    filterRequests('pendingRequests');
+    filterRequests('acceptedRequests');
+    filterRequests('declinedRequests');
+  }, 0);
+  
+  updateRequestCounters(pending.length, allAccepted.length, declined.length);
+  setupRequestActions();
+}
+
 function isEventStartedOrPassed(startDate, startTime) {
   if (!startDate || !startTime) return false;
 
@@ -544,7 +658,7 @@ function handleEditAmount(e, button) {
       // Remove modal and refresh data
       document.body.removeChild(backdrop);
       showToast('Amount updated successfully', 'success');
-      loadAllRequests();
+      syncChanges();
     } catch (error) {
       console.error('Error updating amount:', error);
       showToast(`Error: ${error.message}`, 'error');
@@ -689,7 +803,7 @@ function handleEditRecurring(e, button) {
       // Remove modal and refresh data
       document.body.removeChild(backdrop);
       showToast('End date updated successfully', 'success');
-      loadAllRequests();
+      syncChanges();
     } catch (error) {
       console.error('Error updating end date:', error);
       showToast(`Error: ${error.message}`, 'error');
@@ -936,7 +1050,7 @@ function showAmountPrompt(requestId) {
       // Remove modal and refresh data
       document.body.removeChild(backdrop);
       showToast('Request approved successfully' + (sendEmail ? ' and notification sent' : ''), 'success');
-      loadAllRequests();
+      syncChanges();
     } catch (error) {
       console.error('Error approving request:', error);
       showToast(`Error: ${error.message}`, 'error');
@@ -1097,7 +1211,7 @@ function setupRequestActions() {
           // Remove modal and refresh data
           document.body.removeChild(backdrop);
           showToast('Request declined successfully' + (sendEmail ? ' and notification sent' : ''), 'success');
-          loadAllRequests();
+          syncChanges();
         } catch (error) {
           console.error('Error declining request:', error);
           showToast(`Error: ${error.message}`, 'error');
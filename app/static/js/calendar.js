@@ -2,6 +2,8 @@ class IceRinkCalendar {
     constructor() {
         this.currentDate = new Date();
         this.allEvents = [];
+        // Events per month ("YYYY-MM" -> promise of events), filled on demand
+        this.monthCache = new Map();
 
         this.monthDisplay = document.getElementById('monthDisplay');
         this.calendar = document.getElementById('calendar');
@@ -9,24 +11,56 @@ class IceRinkCalendar {
         document.getElementById('prevMonth').addEventListener('click', () => this.changeMonth(-1));
         document.getElementById('nextMonth').addEventListener('click', () => this.changeMonth(1));
 
-        this.fetchData().then(() => this.renderCalendar());
+        this.showMonth();
     }
 
-    async fetchData() {
-        try {
-            const response = await fetch('/api/events');
-            if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-            this.allEvents = data.events || [];
-            console.log('Fetched events:', this.allEvents.length);
-        } catch (error) {
-            console.error('Error fetching data:', error);
+    monthKey(year, month) {
+        return `${year}-${String(month + 1).padStart(2, '0')}`;
+    }
+
+    fetchMonth(year, month) {
+        // Normalize e.g. month -1 / 12 into the previous / next year
+        const first = new Date(year, month, 1);
+        const key = this.monthKey(first.getFullYear(), first.getMonth());
+        if (!this.monthCache.has(key)) {
+            const lastDay = new Date(first.getFullYear(), first.getMonth() + 1, 0).getDate();
+            const url = `/api/events?start=${key}-01&end=${key}-${String(lastDay).padStart(2, '0')}`;
+            const request = fetch(url)
+                .then(response => {
+                    if (!response.ok) throw new Error('Network response was not ok');
+                    return response.json();
+                })
+                .then(data => data.events || [])
+                .catch(error => {
+                    console.error('Error fetching data:', error);
+                    this.monthCache.delete(key); // retry next time
+                    return [];
+                });
+            this.monthCache.set(key, request);
         }
+        return this.monthCache.get(key);
+    }
+
+    async showMonth() {
+        const year = this.currentDate.getFullYear();
+        const month = this.currentDate.getMonth();
+        const events = await this.fetchMonth(year, month);
+
+        // Ignore the response if the user has already moved to another month
+        if (year !== this.currentDate.getFullYear() || month !== this.currentDate.getMonth()) return;
+        this.allEvents = events;
+        console.log('Fetched events:', this.allEvents.length);
+        this.renderCalendar();
+
+        // Warm the cache for the months the arrows lead to
+        this.fetchMonth(year, month - 1);
+        this.fetchMonth(year, month + 1);
     }
 
     changeMonth(increment) {
+        this.currentDate.setDate(1);
         this.currentDate.setMonth(this.currentDate.getMonth() + increment);
-        this.renderCalendar();
+        this.showMonth();
     }
 
     renderCalendar() {
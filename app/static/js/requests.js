@@ -7,7 +7,8 @@ function initRequestsModule(user) {
 }
 
 function loadUserRequests(firebase_uid) {
-  fetch(`/api/user_requests/${firebase_uid}`)
+  // Only the lists this page shows
+  fetch(`/api/user_requests/${firebase_uid}?status=pending,approved`)
     .then(response => {
       if (!response.ok) {
         throw new Error('Network response was not ok');
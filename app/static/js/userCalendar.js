@@ -5,6 +5,8 @@ class IceRinkCalendar {
         this.allEvents = [];
         this.userEvents = [];
         this.showAllEvents = false; // Start with only user events
+        // Events per month ("YYYY-MM" -> promise of events) for each view, filled on demand
+        this.monthCache = { all: new Map(), user: new Map() };
         
         this.monthDisplay = document.getElementById('monthDisplay');
         this.calendar = document.getElementById('calendar');
@@ -22,22 +24,31 @@ class IceRinkCalendar {
     async initializeCalendar() {
         // Wait for Firebase auth to initialize first
         firebase.auth().onAuthStateChanged(async user => {
-            if (user) {
-                // Load user events first
-                await this.fetchUserEvents();
-                // Then load all events (but don't display them yet)
-                await this.fetchAllEvents();
-                // Render the calendar with user events initially
-                this.renderCalendar();
-            } else {
+            if (!user) {
                 // No user logged in, just show all approved events
                 this.showAllEvents = true;
-                await this.fetchAllEvents();
-                this.renderCalendar();
+            } else {
+                this.openScheduleStream();
             }
+            // Load the current month for the active view and render it
+            await this.showMonth();
         });
     }
     
+    openScheduleStream() {
+        if (!window.EventSource || !window.LIVE_UPDATES || this.scheduleStream) return;
+        
+        // Refetch the visible month whenever a booking changes (or we missed some)
+        this.scheduleStream = new EventSource('/api/stream/schedule');
+        const refresh = () => {
+            this.monthCache.all.clear();
+            this.monthCache.user.clear();
+            this.showMonth();
+        };
+        this.scheduleStream.addEventListener('booking', refresh);
+        this.scheduleStream.addEventListener('reset', refresh);
+    }
+    
     addToggleButton() {
         // Check if button already exists
         if (document.getElementById('toggleCalendar')) {
@@ -69,43 +80,77 @@ class IceRinkCalendar {
         }
         
         // Re-render the calendar with the new view setting
-        this.renderCalendar();
+        this.showMonth();
+    }
+    
+    monthKey(year, month) {
+        return `${year}-${String(month + 1).padStart(2, '0')}`;
     }
     
-    async fetchUserEvents() {
-        try {
+    fetchMonth(view, year, month) {
+        // Normalize e.g. month -1 / 12 into the previous / next year
+        const first = new Date(year, month, 1);
+        const key = this.monthKey(first.getFullYear(), first.getMonth());
+        const cache = this.monthCache[view];
+        if (cache.has(key)) {
+            return cache.get(key);
+        }
+        
+        let baseUrl = '/api/events';
+        if (view === 'user') {
             // Get the current user's ID
             const userId = firebase.auth().currentUser?.uid;
             if (!userId) {
                 console.error('No user logged in');
-                return;
+                return Promise.resolve([]);
             }
-            
-            const response = await fetch(`/api/user_events/${userId}`);
-            if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-            this.userEvents = data.events || [];
-            console.log('Fetched user events:', this.userEvents.length);
-        } catch (error) {
-            console.error('Error fetching user data:', error);
+            baseUrl = `/api/user_events/${userId}`;
         }
+        
+        const lastDay = new Date(first.getFullYear(), first.getMonth() + 1, 0).getDate();
+        const url = `${baseUrl}?start=${key}-01&end=${key}-${String(lastDay).padStart(2, '0')}`;
+        const request = fetch(url)
+            .then(response => {
+                if (!response.ok) throw new Error('Network response was not ok');
+                return response.json();
+            })
+            .then(data => data.events || [])
+            .catch(error => {
+                console.error(`Error fetching ${view} events:`, error);
+                cache.delete(key); // retry next time
+                return [];
+            });
+        cache.set(key, request);
+        return request;
     }
     
-    async fetchAllEvents() {
-        try {
-            const response = await fetch('/api/events');
-            if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-            this.allEvents = data.events || [];
-            console.log('Fetched all events:', this.allEvents.length);
-        } catch (error) {
-            console.error('Error fetching all events:', error);
+    async showMonth() {
+        const view = this.showAllEvents ? 'all' : 'user';
+        const year = this.currentDate.getFullYear();
+        const month = this.currentDate.getMonth();
+        const events = await this.fetchMonth(view, year, month);
+        
+        // Ignore the response if the user has already moved on
+        const currentView = this.showAllEvents ? 'all' : 'user';
+        if (view !== currentView || year !== this.currentDate.getFullYear() || month !== this.currentDate.getMonth()) return;
+        
+        if (view === 'all') {
+            this.allEvents = events;
+        } else {
+            this.userEvents = events;
         }
+        console.log(`Fetched ${view} events:`, events.length);
+        this.renderCalendar();
+        
+        // Warm the cache for the months the arrows lead to
+        this.fetchMonth(view, year, month - 1);
+        this.fetchMonth(view, year, month + 1);
     }
     
     changeMonth(increment) {
+        this.currentDate.setDate(1);
         this.currentDate.setMonth(this.currentDate.getMonth() + increment);
-        this.renderCalendar();
+        this.showMonth();
     }
     
     renderCalendar() {
@@ -13,13 +13,21 @@ const paymentSummary = document.getElementById('paymentSummary');
 const backToAdmin = document.getElementById('backToAdmin');
 const clearSearch = document.getElementById('clearSearch');
 const clearSelectedUser = document.getElementById('clearSelectedUser');
+const loadMoreRequests = document.getElementById('loadMoreRequests');
 const requestDetailsModal = new bootstrap.Modal(document.getElementById('requestDetailsModal'));
 
+// Requests per page from /api/admin/all-requests (filters are applied there)
+const REQUEST_PAGE_SIZE = 50;
+
 // State
 let currentUser = null;
 let allUserRequests = [];
 let filteredRequests = [];
 let currentYear = new Date().getFullYear();
+let nextCursor = null;        // cursor of the next page, null when everything is loaded
+let totalCount = 0;           // requests matching the filters on the server
+let paymentTotals = null;     // server-side payment summary for those requests
+let latestQuery = null;       // ignore responses to superseded filter changes
 
 // Initialize the page
 document.addEventListener('DOMContentLoaded', function() {
@@ -72,6 +80,7 @@ function setupEventListeners() {
     statusFilter.addEventListener('change', applyFilters);
     monthFilter.addEventListener('change', applyFilters);
     yearFilter.addEventListener('change', applyFilters);
+    loadMoreRequests.addEventListener('click', loadNextRequestPage);
     backToAdmin.addEventListener('click', function() {
         window.location.href = '/admin';
     });
@@ -168,32 +177,53 @@ function selectUser(user) {
     loadUserRequests(user.user_id);
 }
 
+/**
+ * URL of a page of requests for the selected user (or everyone) and the current filters
+ */
+function requestsUrl(cursor) {
+    const params = new URLSearchParams({ limit: REQUEST_PAGE_SIZE });
+    if (currentUser) params.set('user_id', currentUser.user_id);
+    if (statusFilter.value !== 'all') params.set('status', statusFilter.value);
+    if (monthFilter.value !== 'all') params.set('month', monthFilter.value);
+    if (yearFilter.value !== 'all') params.set('year', yearFilter.value);
+    const paymentStatus = document.getElementById('paymentFilter').value;
+    if (paymentStatus !== 'all') params.set('payment', paymentStatus);
+    if (cursor) params.set('after', cursor);
+    return `/api/admin/all-requests?${params}`;
+}
+
 async function loadUserRequests(userId) {
     loadingIndicator.style.display = 'block';
     noRequestsMessage.style.display = 'none';
+    loadMoreRequests.style.display = 'none';
     requestsList.innerHTML = '';
     
+    const query = requestsUrl(null);
+    latestQuery = query;
+    
     try {
-        let response;
-        if (userId) {
-            response = await fetch(`/api/admin/user-requests/${userId}`);
-        } else {
-            response = await fetch('/api/admin/all-requests');
-        }
-        
+        const response = await fetch(query);
         const data = await response.json();
+        if (query !== latestQuery) return;
         
-        if (data.requests && data.requests.length > 0) {
-            allUserRequests = data.requests;
-            applyFilters();
-            
-            // Update the UI to show we're viewing all requests if no user selected
-            if (!userId) {
-                document.getElementById('userFullName').textContent = 'All Users';
-                document.getElementById('userEmail').textContent = '';
-                document.getElementById('userPhone').textContent = '';
-                selectedUserInfo.style.display = 'block';
-            }
+        allUserRequests = data.requests || [];
+        filteredRequests = allUserRequests;
+        nextCursor = data.next_cursor || null;
+        totalCount = data.count || 0;
+        paymentTotals = data.payment_summary || null;
+        
+        // Update the UI to show we're viewing all requests if no user selected
+        if (!userId) {
+            document.getElementById('userFullName').textContent = 'All Users';
+            document.getElementById('userEmail').textContent = '';
+            document.getElementById('userPhone').textContent = '';
+            selectedUserInfo.style.display = 'block';
+        }
+        
+        if (allUserRequests.length > 0) {
+            displayFilteredRequests();
+            updateRequestCount();
+            updatePaymentSummary();
         } else {
             noRequestsMessage.textContent = userId 
                 ? 'No requests found for this user' 
@@ -211,6 +241,32 @@ async function loadUserRequests(userId) {
     }
 }
 
+/**
+ * Append the next page for the same filters
+ */
+async function loadNextRequestPage() {
+    if (!nextCursor) return;
+    
+    const query = latestQuery;
+    loadMoreRequests.disabled = true;
+    try {
+        const response = await fetch(requestsUrl(nextCursor));
+        const data = await response.json();
+        if (query !== latestQuery) return;
+        
+        allUserRequests = allUserRequests.concat(data.requests || []);
+        filteredRequests = allUserRequests;
+        nextCursor = data.next_cursor || null;
+        displayFilteredRequests();
+        updateRequestCount();
+    } catch (error) {
+        console.error('Error loading more requests:', error);
+        showToast('Error loading more requests', 'error');
+    } finally {
+        loadMoreRequests.disabled = false;
+    }
+}
+
 function clearSelectedUserInfo() {
     currentUser = null;
     allUserRequests = [];
@@ -234,75 +290,16 @@ document.addEventListener('DOMContentLoaded', function() {
     loadUserRequests(); // Load all requests initially
 });
 
+/**
+ * Filters are applied by the server, so a filter change reloads the first page
+ */
 function applyFilters() {
-    if (!allUserRequests || allUserRequests.length === 0) {
-        if (!currentUser) {
-            // Show message when no user is selected
-            noRequestsMessage.textContent = 'Select a user to view their requests or search for users above';
-            noRequestsMessage.style.display = 'block';
-        }
-        return;
-    }
-    
-    const status = statusFilter.value;
-    const month = monthFilter.value;
-    const year = yearFilter.value;
-    const paymentStatus = document.getElementById('paymentFilter').value;
-    
-    filteredRequests = allUserRequests.filter(request => {
-        // Status filter
-        if (status !== 'all' && request.request_status !== status) {
-            return false;
-        }
-        
-        // Payment status filter
-        if (paymentStatus !== 'all') {
-            if (paymentStatus === 'paid' && !request.paid) {
-                return false;
-            }
-            if (paymentStatus === 'unpaid' && (request.paid || !request.amount)) {
-                return false;
-            }
-        }
-        
-        // Parse request date
-        let requestDate;
-        try {
-            requestDate = new Date(request.start_date);
-            if (isNaN(requestDate.getTime())) {
-                // Try alternative date format if needed
-                const parts = request.start_date.split('/');
-                if (parts.length === 3) {
-                    requestDate = new Date(parts[2], parts[0] - 1, parts[1]);
-                } else {
-                    return false; // Invalid date format
-                }
-            }
-        } catch (e) {
-            console.error('Error parsing date:', request.start_date, e);
-            return false;
-        }
-        
-        // Month filter
-        if (month !== 'all' && (requestDate.getMonth() + 1) !== parseInt(month)) {
-            return false;
-        }
-        
-        // Year filter
-        if (year !== 'all' && requestDate.getFullYear() !== parseInt(year)) {
-            return false;
-        }
-        
-        return true;
-    });
-    
-    displayFilteredRequests();
-    updateRequestCount();
-    updatePaymentSummary();
+    loadUserRequests(currentUser ? currentUser.user_id : null);
 }
 
 function displayFilteredRequests() {
     requestsList.innerHTML = '';
+    loadMoreRequests.style.display = nextCursor ? 'inline-block' : 'none';
     
     if (filteredRequests.length === 0) {
         noRequestsMessage.style.display = 'block';
@@ -670,30 +667,19 @@ function showRequestDetails(requestId) {
 }
 
 function updateRequestCount() {
-    const count = filteredRequests.length;
-    requestCount.textContent = `${count} request${count !== 1 ? 's' : ''}`;
+    const count = Math.max(totalCount, filteredRequests.length);
+    const shown = filteredRequests.length < count ? `${filteredRequests.length} of ` : '';
+    requestCount.textContent = `${shown}${count} request${count !== 1 ? 's' : ''}`;
 }
 
 function updatePaymentSummary() {
+    // Totals cover every request matching the filters, not just the loaded pages
+    const totals = paymentTotals || { paid: 0, unpaid: 0, total: 0 };
     paymentSummary.style.display = 'block';
     
-    let paidTotal = 0;
-    let unpaidTotal = 0;
-    let allTotal = 0;
-    
-    filteredRequests.forEach(request => {
-        const amount = parseFloat(request.amount) || 0;
-        allTotal += amount;
-        if (request.paid) {
-            paidTotal += amount;
-        } else if (request.amount) {
-            unpaidTotal += amount;
-        }
-    });
-    
-    document.getElementById('amountPaid').textContent = `$${paidTotal.toFixed(2)}`;
-    document.getElementById('amountPending').textContent = `$${unpaidTotal.toFixed(2)}`;
-    document.getElementById('amountTotal').textContent = `$${allTotal.toFixed(2)}`;
+    document.getElementById('amountPaid').textContent = `$${totals.paid.toFixed(2)}`;
+    document.getElementById('amountPending').textContent = `$${totals.unpaid.toFixed(2)}`;
+    document.getElementById('amountTotal').textContent = `$${totals.total.toFixed(2)}`;
 }
 
 function clearSearchInput() {
@@ -0,0 +1,119 @@
+"""
+Concurrent stress test for the reservation path.
+
+Starts many threads that all try to book the same slot at the same moment
+and checks that exactly one of them gets it, then books one distinct slot
+per thread and checks that they all go through. Runs against a local
+PostgreSQL given by DATABASE_URL, never against Cloud SQL:
+
+    DATABASE_URL=postgresql+pg8000://postgres@localhost/icerink python stress_reservations.py
+"""
+import os
+import sys
+import threading
+from datetime import date, time, timedelta
+
+import sqlalchemy
+
+from conflict_index import Booking
+from reservations import lock_and_find_conflicts
+
+THREADS = int(os.environ.get('STRESS_THREADS', 32))
+TEST_EMAIL = 'stress-test@localhost'
+TEST_RENTAL_NAME = 'stress-test'
+
+
+def reserve(engine, renter_id, proposed, barrier, results):
+    with engine.connect() as conn:
+        trans = conn.begin()
+        barrier.wait()
+        if lock_and_find_conflicts(conn, proposed):
+            trans.rollback()
+            results.append(False)
+            return
+        conn.execute(sqlalchemy.text("""
+            INSERT INTO public.rental_request
+            (user_id, rental_name, start_date, end_date, start_time, end_time,
+             rental_status, is_recurring, recurrence_rule, request_date, amount)
+            VALUES
+            (:user_id, :rental_name, :start_date, :end_date, :start_time, :end_time,
+             'admin', :is_recurring, :recurrence_rule, NOW(), 0)
+        """), {
+            "user_id": renter_id,
+            "rental_name": TEST_RENTAL_NAME,
+            "start_date": proposed.start_date,
+            "end_date": proposed.end_date,
+            "start_time": proposed.start_time,
+            "end_time": proposed.end_time,
+            "is_recurring": proposed.is_recurring,
+            "recurrence_rule": proposed.recurrence_rule
+        })
+        trans.commit()
+        results.append(True)
+
+
+def run_round(engine, renter_id, proposals):
+    barrier = threading.Barrier(len(proposals))
+    results = []
+    threads = [threading.Thread(target=reserve, args=(engine, renter_id, proposed, barrier, results))
+               for proposed in proposals]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results.count(True)
+
+
+def cleanup(engine):
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("""
+            DELETE FROM public.rental_request
+            WHERE user_id IN (SELECT renter_id FROM public.renter WHERE renter_email = :email)
+        """), {"email": TEST_EMAIL})
+        conn.execute(sqlalchemy.text("DELETE FROM public.renter WHERE renter_email = :email"),
+                     {"email": TEST_EMAIL})
+
+
+def main():
+    url = os.environ.get('DATABASE_URL')
+    if not url:
+        print("Set DATABASE_URL to a local PostgreSQL database")
+        return 1
+
+    engine = sqlalchemy.create_engine(url, pool_size=THREADS, max_overflow=0)
+    cleanup(engine)
+    with engine.begin() as conn:
+        renter_id = conn.execute(sqlalchemy.text("""
+            INSERT INTO public.renter (first_name, last_name, renter_email, firebase_uid, created_at)
+            VALUES ('stress', 'test', :email, :email, NOW())
+            RETURNING renter_id
+        """), {"email": TEST_EMAIL}).fetchone()[0]
+
+    # Far in the future so real bookings don't get in the way.
+    day = date.today().replace(year=date.today().year + 50)
+    try:
+        same_slot = [Booking(None, None, None, day, day + timedelta(days=60), time(18), time(19), True, 'weekly')
+                     for _ in range(THREADS)]
+        booked = run_round(engine, renter_id, same_slot)
+        print(f"Same slot: {booked} of {THREADS} threads got the booking")
+        if booked != 1:
+            print("FAIL: expected exactly one booking")
+            return 1
+
+        later = day + timedelta(days=120)
+        own_slots = [Booking(None, None, None, later + timedelta(days=i), later + timedelta(days=i),
+                             time(6), time(7), False) for i in range(THREADS)]
+        booked = run_round(engine, renter_id, own_slots)
+        print(f"Distinct slots: {booked} of {THREADS} threads got their booking")
+        if booked != THREADS:
+            print("FAIL: expected every booking to go through")
+            return 1
+    finally:
+        cleanup(engine)
+
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
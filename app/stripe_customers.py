@@ -0,0 +1,114 @@
+"""
+Stripe customer id of each renter (renter.stripe_customer_id, added by
+migrations/007_renter_stripe_customer.sql) behind a read-through cache.
+
+Invoices used to get a Stripe customer by creating one per invoice or by
+searching customers by email; now a renter's id is resolved once, saved on
+the renter and kept in memory, so an invoice costs no customer call at all.
+
+    cache = CustomerIdCache()
+    customer_id = cache.get(renter_id, resolve)   # resolve(renter_id) on a miss
+
+match_customers() pairs renters with existing Stripe customers for the
+one-time backfill.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CustomerIdCache:
+    """
+    Thread-safe LRU of renter_id -> Stripe customer id. A miss calls
+    resolve(renter_id) with a per-renter lock held, so concurrent invoices for
+    the same renter can't create two customers in this process.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        # renter_id -> [lock, callers holding or waiting for it]
+        self._resolving = {}
+
+    def _store(self, renter_id, customer_id):
+        self._ids[renter_id] = customer_id
+        self._ids.move_to_end(renter_id)
+        while len(self._ids) > self.max_entries:
+            self._ids.popitem(last=False)
+
+    def get(self, renter_id, resolve):
+        with self._lock:
+            customer_id = self._ids.get(renter_id)
+            if customer_id:
+                self._ids.move_to_end(renter_id)
+                return customer_id
+            # The lock stays registered until its last waiter is done, so a
+            # caller arriving after a failed resolve waits for the retry
+            resolving = self._resolving.setdefault(renter_id, [threading.Lock(), 0])
+            resolving[1] += 1
+
+        try:
+            with resolving[0]:
+                with self._lock:
+                    customer_id = self._ids.get(renter_id)
+                if not customer_id:
+                    customer_id = resolve(renter_id)
+                    with self._lock:
+                        self._store(renter_id, customer_id)
+        finally:
+            with self._lock:
+                resolving[1] -= 1
+                if not resolving[1]:
+                    del self._resolving[renter_id]
+        return customer_id
+
+    def prime(self, customer_ids):
+        """Add known {renter_id: customer_id} pairs (None values are skipped)"""
+        with self._lock:
+            for renter_id, customer_id in customer_ids.items():
+                if customer_id:
+                    self._store(renter_id, customer_id)
+
+    def forget(self, renter_id):
+        with self._lock:
+            self._ids.pop(renter_id, None)
+
+
+def customer_idempotency_key(renter_id, email, name=None, replacing=None):
+    """
+    Idempotency key for creating a renter's Stripe customer. It changes with
+    the email and name sent, which Stripe would otherwise reject as a reused
+    key, and with the customer being replaced (`replacing`, one Stripe no
+    longer has), which Stripe would otherwise hand back again for 24 hours.
+    """
+    digest = hashlib.sha1(f"{email or ''}\n{name or ''}".encode()).hexdigest()[:16]
+    key = f"renter-{renter_id}-customer-{digest}"
+    return f"{key}-{replacing}" if replacing else key
+
+
+def match_customers(renters, customers):
+    """
+    {renter_id: customer_id} for renters (dicts with renter_id and email)
+    that already have a Stripe customer. customers are dicts with id, email,
+    created and metadata, as listed by Stripe. A customer tagged with the
+    renter's user_id wins; otherwise the newest customer with the renter's
+    email that isn't tagged with another user.
+    """
+    tagged = {}
+    by_email = {}
+    for customer in sorted(customers, key=lambda c: c.get('created') or 0):
+        user_id = (customer.get('metadata') or {}).get('user_id')
+        if user_id:
+            tagged[str(user_id)] = customer['id']
+        elif customer.get('email'):
+            by_email[customer['email'].strip().lower()] = customer['id']
+
+    matches = {}
+    for renter in renters:
+        customer_id = tagged.get(str(renter['renter_id']))
+        if not customer_id and renter.get('email'):
+            customer_id = by_email.get(renter['email'].strip().lower())
+        if customer_id:
+            matches[renter['renter_id']] = customer_id
+    return matches
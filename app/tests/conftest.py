@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+import sqlalchemy
+
+# The app's modules are imported by their top-level names, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def database():
+    """
+    Engine for the local PostgreSQL in TEST_DATABASE_URL, which must have the
+    app's tables and every script in migrations/ applied. Tests using it are
+    skipped without one; never point it at Cloud SQL.
+
+        TEST_DATABASE_URL=postgresql+pg8000://postgres@localhost/icerink python -m pytest tests
+    """
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = sqlalchemy.create_engine(url, pool_size=4, max_overflow=0)
+    yield engine
+    engine.dispose()
+
+
+TEST_EMAIL = 'pytest@localhost'
+
+
+@pytest.fixture
+def renter_id(database):
+    """A renter for the test's bookings; it and all its bookings are deleted afterwards"""
+    def cleanup():
+        with database.begin() as conn:
+            conn.execute(sqlalchemy.text("""
+                DELETE FROM public.booking_occurrence
+                WHERE source = 'rental' AND booking_id IN (
+                    SELECT request_id FROM public.rental_request rr
+                    JOIN public.renter ON rr.user_id = renter.renter_id
+                    WHERE renter.renter_email = :email)
+            """), {"email": TEST_EMAIL})
+            conn.execute(sqlalchemy.text("""
+                DELETE FROM public.rental_request
+                WHERE user_id IN (SELECT renter_id FROM public.renter WHERE renter_email = :email)
+            """), {"email": TEST_EMAIL})
+            conn.execute(sqlalchemy.text("DELETE FROM public.renter WHERE renter_email = :email"),
+                         {"email": TEST_EMAIL})
+
+    cleanup()
+    with database.begin() as conn:
+        renter = conn.execute(sqlalchemy.text("""
+            INSERT INTO public.renter (first_name, last_name, renter_email, firebase_uid, created_at)
+            VALUES ('py', 'test', :email, :email, NOW())
+            RETURNING renter_id
+        """), {"email": TEST_EMAIL}).scalar()
+    yield renter
+    cleanup()
+
+
+@pytest.fixture
+def renter_email(renter_id):
+    """The test renter's email"""
+    return TEST_EMAIL
+
+
+@pytest.fixture
+def add_rental(renter_id):
+    """
+    add_rental(conn, booking, status='admin', amount=0) INSERTs a
+    conflict_index.Booking as a request of the test renter and returns its
+    request_id
+    """
+    def insert(conn, booking, status='admin', amount=0):
+        return conn.execute(sqlalchemy.text("""
+            INSERT INTO public.rental_request
+            (user_id, rental_name, start_date, end_date, start_time, end_time,
+             rental_status, is_recurring, recurrence_rule, request_date, amount)
+            VALUES
+            (:user_id, :rental_name, :start_date, :end_date, :start_time, :end_time,
+             :status, :is_recurring, :recurrence_rule, NOW(), :amount)
+            RETURNING request_id
+        """), {
+            "user_id": renter_id,
+            "rental_name": booking.name or 'pytest',
+            "start_date": booking.start_date,
+            "end_date": booking.end_date,
+            "start_time": booking.start_time,
+            "end_time": booking.end_time,
+            "status": status,
+            "is_recurring": booking.is_recurring,
+            "recurrence_rule": booking.recurrence_rule,
+            "amount": amount
+        }).scalar()
+    return insert
+
+
+@pytest.fixture
+def admin_client(database, monkeypatch):
+    """A test client for main.app using `database`, signed in as an admin"""
+    import main
+    from token_cache import VerifiedTokenCache
+
+    monkeypatch.setattr(main, 'pool', database)
+    monkeypatch.setattr(main, 'token_cache', VerifiedTokenCache(max_entries=8, admin_ttl=60))
+    monkeypatch.setattr(main, 'verify_id_token', lambda token: {'uid': 'pytest-admin', 'email': 'admin@localhost'})
+    monkeypatch.setattr(main, 'lookup_admin', lambda email: True)
+
+    client = main.app.test_client()
+    client.set_cookie('localhost', 'token', 'pytest')
+    with client.session_transaction() as flask_session:
+        flask_session['firebase_uid'] = 'pytest-admin'
+        flask_session['is_admin'] = True
+    return client
@@ -0,0 +1,106 @@
+"""
+/api/admin/changes against the schedule_change triggers
+(migrations/003_schedule_change.sql): every change after a cursor comes back
+once, even from a transaction that was still open when the cursor was taken,
+and a cursor older than what cleanup pruned gets a reset.
+
+Needs TEST_DATABASE_URL (see conftest.py); skipped without it.
+"""
+from datetime import date, time, timedelta
+
+import pytest
+import sqlalchemy
+
+import main
+from conflict_index import Booking
+
+
+DAY = date(2090, 6, 5)
+
+
+def booking(hour, day=DAY):
+    return Booking(None, None, 'pytest', day, day, time(hour), time(hour, 45), False, None)
+
+
+@pytest.fixture
+def changes(admin_client):
+    """changes(since=None) is the body of GET /api/admin/changes"""
+    def get(since=None):
+        response = admin_client.get('/api/admin/changes',
+                                    query_string={'since': since} if since is not None else {})
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return get
+
+
+def ours(body, request_ids):
+    """(changed, deleted) request ids of a changes body among `request_ids`"""
+    changed = [row['request_id'] for row in body['requests'] if row['request_id'] in request_ids]
+    deleted = [i for i in body['deleted_requests'] if i in request_ids]
+    return sorted(changed), sorted(deleted)
+
+
+def test_changes_after_a_cursor_come_back_once(database, changes, add_rental):
+    with database.connect() as conn:
+        updated = add_rental(conn, booking(7))
+        deleted = add_rental(conn, booking(8))
+    cursor = changes()['cursor']
+
+    with database.connect() as conn:
+        inserted = add_rental(conn, booking(9))
+        # Twice, and in a separate transaction from the insert
+        for amount in (10, 20):
+            conn.execute(sqlalchemy.text("UPDATE public.rental_request SET amount = :amount WHERE request_id = :id"),
+                         {"amount": amount, "id": updated})
+        conn.execute(sqlalchemy.text("DELETE FROM public.rental_request WHERE request_id = :id"), {"id": deleted})
+
+    ids = {updated, deleted, inserted}
+    body = changes(cursor)
+    assert not body['reset']
+    assert ours(body, ids) == (sorted([updated, inserted]), [deleted])
+    assert [row['amount'] for row in body['requests'] if row['request_id'] == updated] == ['20.00']
+
+    again = changes(body['cursor'])
+    assert ours(again, ids) == ([], [])
+
+
+def test_cursor_does_not_skip_a_transaction_still_open(database, changes, add_rental):
+    cursor = changes()['cursor']
+
+    with database.connect() as slow:
+        transaction = slow.begin()
+        late = add_rental(slow, booking(10))
+
+        # Committed after the slow transaction started, and read while it is open.
+        # Another month, so it doesn't wait on the slow one's payment summary row.
+        with database.connect() as conn:
+            early = add_rental(conn, booking(11, DAY + timedelta(days=40)))
+        body = changes(cursor)
+        assert ours(body, {late, early}) == ([], [])
+
+        transaction.commit()
+
+    body = changes(body['cursor'])
+    assert ours(body, {late, early}) == (sorted([late, early]), [])
+    assert ours(changes(body['cursor']), {late, early}) == ([], [])
+
+
+def test_cursor_older_than_the_pruned_changes_is_reset(database, changes, add_rental):
+    stale = changes()['cursor']
+    with database.connect() as conn:
+        request_id = add_rental(conn, booking(12))
+        # Make its change old enough for cleanup to prune
+        conn.execute(sqlalchemy.text("""
+            UPDATE public.schedule_change SET changed_at = NOW() - INTERVAL '31 days'
+            WHERE source = 'rental' AND row_id = :id
+        """), {"id": request_id})
+    current = changes()['cursor']
+
+    # Also deletes requests that ended over 4 months ago, as it does every night
+    with main.app.test_request_context():
+        main.cleanup_requests(None)
+
+    assert changes(stale)['reset']
+    body = changes(current)
+    assert not body['reset']
+    assert ours(body, {request_id}) == ([], [])
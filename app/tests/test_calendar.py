@@ -0,0 +1,109 @@
+"""
+The calendars show what was booked: one-off bookings once, on their start
+date, and recurring bookings only with a rule in PERIOD_DAYS. The conflict
+checks keep reading bookings conservatively. Both calendar paths,
+process_recurring_events and the booking_occurrence queries, must agree.
+
+The last test needs TEST_DATABASE_URL (see conftest.py).
+"""
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+import main
+import occurrences
+from recurrence import Recurrence, period_of
+from test_conflict_kernel import random_schedule
+
+
+WINDOW = (date(2025, 3, 1), date(2025, 3, 31))
+
+
+def event(start_date, end_date, is_recurring, rule=None, event_id=1):
+    return {
+        'id': event_id,
+        'name': 'Practice',
+        'description': '',
+        'start_time': '18:00:00',
+        'end_time': '19:00:00',
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'status': 'approved',
+        'is_recurring': is_recurring,
+        'recurrence_rule': rule
+    }
+
+
+def shown_dates(events, start_date=WINDOW[0], end_date=WINDOW[1]):
+    return [entry['date'] for entry in main.process_recurring_events(events, start_date, end_date)]
+
+
+def test_one_off_booking_shows_on_its_start_date():
+    assert shown_dates([event(date(2025, 3, 10), date(2025, 3, 12), False)]) == ['2025-03-10']
+    # Starting before the window, it isn't shown in it
+    assert shown_dates([event(date(2025, 2, 27), date(2025, 3, 2), False)]) == []
+
+
+def test_recurring_bookings_follow_their_rule():
+    assert shown_dates([event(date(2025, 3, 3), date(2025, 3, 24), True, 'weekly')]) == \
+        ['2025-03-03', '2025-03-10', '2025-03-17', '2025-03-24']
+    assert shown_dates([event(date(2025, 3, 3), date(2025, 3, 31), True, 'biweekly')]) == \
+        ['2025-03-03', '2025-03-17', '2025-03-31']
+    assert shown_dates([event(date(2025, 2, 27), date(2025, 3, 2), True, 'daily')]) == \
+        ['2025-03-01', '2025-03-02']
+
+
+def test_unknown_rule_is_not_shown_but_still_blocks():
+    assert shown_dates([event(date(2025, 3, 3), date(2025, 3, 24), True, 'monthly'),
+                        event(date(2025, 3, 3), date(2025, 3, 24), True, None)]) == []
+
+    assert period_of(True, 'monthly', strict=True) is None
+    assert period_of(True, 'monthly') == 1
+    recurrence = Recurrence.from_booking(date(2025, 3, 3), date(2025, 3, 24), time(18), time(19),
+                                         True, 'monthly')
+    assert recurrence.period == 1
+
+
+def test_event_window():
+    assert main.parse_event_window({'start': '2025-03-01', 'end': '2025-03-31'}) == WINDOW
+    for args in ({'start': '2025-03-01'}, {'start': '2025-03-31', 'end': '2025-03-01'},
+                 {'start': '2025-01-01', 'end': '2025-04-30'}):
+        with pytest.raises(ValueError):
+            main.parse_event_window(args)
+
+
+def test_default_event_window_is_this_month():
+    start_date, end_date = main.parse_event_window({})
+    today = main.datetime.now().date()
+    assert start_date == today.replace(day=1) <= today <= end_date
+    assert (end_date + timedelta(days=1)).day == 1
+    assert (end_date - start_date).days + 1 <= main.MAX_EVENT_WINDOW_DAYS
+
+
+@pytest.mark.parametrize('seed', (1, 2))
+def test_occurrence_calendar_matches_expansion(database, add_rental, seed):
+    rng = random.Random(seed)
+    # Whole weeks into years nobody has booked yet
+    offset = timedelta(weeks=52 * 65)
+    start_date, end_date = date(2025, 3, 1) + offset, date(2025, 5, 31) + offset
+
+    events = []
+    with database.begin() as conn:
+        for booking in random_schedule(rng, 200):
+            booking.start_date += offset
+            booking.end_date += offset
+            request_id = add_rental(conn, booking, 'approved')
+            occurrences.refresh_booking(conn, 'rental', request_id)
+            events.append(dict(event(booking.start_date, booking.end_date, booking.is_recurring,
+                                     booking.recurrence_rule, request_id),
+                               start_time=booking.start_time.isoformat(), end_time=booking.end_time.isoformat()))
+        rows = occurrences.fetch_calendar(conn, start_date, end_date)
+
+    ours = {entry['id'] for entry in events}
+    from_table = sorted((row['id'], row['occurrence_date']) for row in rows
+                        if row['status'] == 'approved' and row['id'] in ours)
+    expanded = sorted((entry['id'], entry['date'])
+                      for entry in main.process_recurring_events(events, start_date, end_date))
+    assert from_table == expanded
+    assert len(expanded) > 100
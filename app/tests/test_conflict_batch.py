@@ -0,0 +1,51 @@
+"""
+/api/check_conflicts/batch against an in-memory ConflictIndex: every entry in
+`results`, including the ones for slots that could not be read, has the same
+keys.
+"""
+from datetime import date, time
+
+import pytest
+
+import main
+from conflict_index import Booking, ConflictIndex
+from token_cache import VerifiedTokenCache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    practice = Booking('admin', 7, 'Practice', date(2025, 3, 3), date(2025, 3, 31),
+                       time(18, 0), time(19, 0), True, 'weekly')
+    monkeypatch.setattr(main, 'conflict_engine', ConflictIndex(lambda: [practice], max_age=3600))
+    monkeypatch.setattr(main, 'token_cache', VerifiedTokenCache(max_entries=8, admin_ttl=60))
+    monkeypatch.setattr(main, 'verify_id_token', lambda token: {'uid': 'pytest', 'email': 'renter@localhost'})
+    client = main.app.test_client()
+    client.set_cookie('localhost', 'token', 'pytest')
+    return client
+
+
+def slot(day, start_time, end_time):
+    return {'start_date': day, 'end_date': day, 'start_time': start_time, 'end_time': end_time,
+            'is_recurring': False}
+
+
+def test_error_entries_have_every_key(client):
+    response = client.post('/api/check_conflicts/batch', json={'slots': [
+        slot('03/10/2025', '6:30 PM', '7:30 PM'),
+        slot('2025-03-11', '6:30 PM', '7:30 PM'),
+        slot('03/10/2025', '7:00 PM', '8:00 PM'),
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['has_conflicts']
+
+    checked, unreadable, overlapping = body['results']
+    assert [conflict['event_id'] for conflict in checked['admin_conflicts']] == [7]
+    assert [conflict['index'] for conflict in checked['batch_conflicts']] == [2]
+
+    assert unreadable['error']
+    assert not unreadable['has_conflicts']
+    assert set(unreadable) == set(checked) | {'error'}
+    for key in ('rental_conflicts', 'admin_conflicts', 'batch_conflicts'):
+        assert unreadable[key] == []
+    assert set(overlapping) == set(checked)
@@ -0,0 +1,101 @@
+"""
+The database conflict engines must report the same bookings and the same
+first colliding dates as ConflictIndex for the same schedule: their SQL only
+narrows down the candidates, so it must never drop one that collides. The
+rows booking_occurrence holds for a booking must be the days its Recurrence
+occurs on.
+
+Needs TEST_DATABASE_URL (see conftest.py); skipped without it.
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+import sqlalchemy
+
+import occurrences
+from conflict_index import Booking, ConflictIndex
+from sql_conflicts import SqlConflictEngine
+from test_conflict_kernel import keyed, random_proposals, random_schedule
+
+
+# Whole weeks, so every booking keeps its weekday, into years nobody has booked yet
+OFFSET = timedelta(weeks=52 * 65)
+
+ENGINES = {
+    'sql': SqlConflictEngine,
+    'occurrences': occurrences.OccurrenceConflictEngine,
+}
+
+
+def shifted(booking):
+    return Booking(booking.source, booking.booking_id, booking.name, booking.start_date + OFFSET,
+                   booking.end_date + OFFSET, booking.start_time, booking.end_time,
+                   booking.is_recurring, booking.recurrence_rule, booking.status)
+
+
+@pytest.fixture
+def stored_schedule(database, add_rental):
+    """
+    save(bookings, status=None) stores every booking as a request of the test
+    renter with its own status or `status` (admin events as 'admin'
+    requests) and returns them as the database has them
+    """
+    def save(bookings, status=None):
+        stored = []
+        with database.begin() as conn:
+            for booking in bookings:
+                booking_status = status or booking.status or 'admin'
+                request_id = add_rental(conn, booking, booking_status)
+                occurrences.refresh_booking(conn, 'rental', request_id)
+                stored.append(Booking('rental', request_id, booking.name, booking.start_date, booking.end_date,
+                                      booking.start_time, booking.end_time, booking.is_recurring,
+                                      booking.recurrence_rule, booking_status))
+        return stored
+    return save
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+@pytest.mark.parametrize('seed', (1, 2))
+def test_engine_matches_conflict_index(database, stored_schedule, engine, seed):
+    rng = random.Random(seed)
+    bookings = stored_schedule([shifted(booking) for booking in random_schedule(rng, 300)])
+    # Requests that don't block the rink must never be reported
+    waiting = stored_schedule([shifted(booking) for booking in random_proposals(rng, 25)], status='pending')
+    denied = stored_schedule([shifted(booking) for booking in random_proposals(rng, 25)], status='denied')
+    proposals = [shifted(proposed) for proposed in random_proposals(rng, 100)]
+
+    # Rows other tests or people left in the database are not compared
+    ours = {booking.key for booking in bookings + waiting + denied}
+    reference = ConflictIndex(lambda: bookings, max_age=3600)
+    checked = ENGINES[engine](database)
+
+    def own(conflicts):
+        return [pair for pair in keyed(conflicts) if pair[0] in ours]
+
+    expected = [keyed(conflicts) for conflicts in reference.find_conflicts_many(proposals)]
+    assert [own(conflicts) for conflicts in checked.find_conflicts_many(proposals)] == expected
+    for proposed, conflicts in zip(proposals, expected):
+        assert own(checked.find_conflicts(proposed)) == conflicts
+    assert sum(1 for conflicts in expected if conflicts) > len(proposals) // 4
+
+
+def test_occurrence_rows_follow_the_recurrence(database, stored_schedule):
+    """period_sql must read every rule the way recurrence.period_of does"""
+    rng = random.Random(4)
+    bookings = stored_schedule([shifted(booking) for booking in random_schedule(rng, 200)])
+
+    with database.connect() as conn:
+        rows = conn.execute(sqlalchemy.text("""
+            SELECT booking_id, occurrence_date FROM public.booking_occurrence
+            WHERE source = 'rental' AND booking_id IN :ids
+        """).bindparams(sqlalchemy.bindparam('ids', expanding=True)),
+            {"ids": [booking.booking_id for booking in bookings]}).fetchall()
+
+    stored = {}
+    for booking_id, day in rows:
+        stored.setdefault(booking_id, []).append(day)
+    for booking in bookings:
+        recurrence = booking.recurrence
+        expected = [date.fromordinal(day) for day in range(recurrence.anchor, recurrence.last + 1, recurrence.period)]
+        assert sorted(stored[booking.booking_id]) == expected, booking.recurrence_rule
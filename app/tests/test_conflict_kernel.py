@@ -0,0 +1,128 @@
+"""
+The NumPy kernel (CONFLICT_ENGINE=numpy) must report the same bookings and
+the same first colliding dates as ConflictIndex, and both must agree with a
+plain walk over the days each booking occupies.
+
+    cd app
+    python -m pytest tests
+"""
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+from conflict_index import Booking, ConflictIndex
+from conflict_kernel import VectorConflictIndex
+
+
+FIRST_DAY = date(2025, 1, 1)
+# 'monthly' isn't understood and is treated as daily
+RULES = ('daily', 'weekly', 'biweekly', 'monthly')
+SEEDS = (1, 2, 3)
+
+
+def random_window(rng):
+    """A daily window on a 30-minute grid, so touching windows come up often"""
+    start = rng.randrange(12, 44)
+    end = rng.randrange(start + 1, 48)
+    return time(start // 2, start % 2 * 30), time(end // 2, end % 2 * 30)
+
+
+def random_booking(rng, source, booking_id, status=None):
+    start_date = FIRST_DAY + timedelta(days=rng.randrange(365))
+    start_time, end_time = random_window(rng)
+    if rng.random() < 0.4:
+        rule = rng.choice(RULES)
+        end_date = start_date + timedelta(days=rng.randrange(150))
+        return Booking(source, booking_id, f"{source}-{booking_id}", start_date, end_date,
+                       start_time, end_time, True, rule, status)
+    # One-off, sometimes over several days
+    end_date = start_date + timedelta(days=rng.choice((0, 0, 0, 1, 2, 5)))
+    return Booking(source, booking_id, f"{source}-{booking_id}", start_date, end_date,
+                   start_time, end_time, False, None, status)
+
+
+def random_schedule(rng, count):
+    """Bookings as the loader returns them: approved/admin rentals and admin events"""
+    bookings = []
+    for booking_id in range(count):
+        if rng.random() < 0.3:
+            bookings.append(random_booking(rng, 'admin', booking_id))
+        else:
+            bookings.append(random_booking(rng, 'rental', booking_id, rng.choice(('approved', 'admin'))))
+    return bookings
+
+
+def random_proposals(rng, count):
+    return [random_booking(rng, None, None) for _ in range(count)]
+
+
+def occupied_days(booking):
+    recurrence = booking.recurrence
+    return range(recurrence.anchor, recurrence.last + 1, recurrence.period)
+
+
+def brute_force(proposed, bookings):
+    """(booking key, first colliding date) pairs found by walking the days"""
+    days = set(occupied_days(proposed))
+    found = []
+    for booking in bookings:
+        if not (proposed.start_time <= booking.end_time and proposed.end_time >= booking.start_time):
+            continue
+        common = [day for day in occupied_days(booking) if day in days]
+        if common:
+            found.append((booking.key, date.fromordinal(min(common))))
+    return sorted(found)
+
+
+def keyed(conflicts):
+    return [(booking.key, conflict_date) for booking, conflict_date in conflicts]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_kernel_matches_conflict_index(seed):
+    rng = random.Random(seed)
+    bookings = random_schedule(rng, 2000)
+    proposals = random_proposals(rng, 300)
+    reference = ConflictIndex(lambda: bookings, max_age=3600)
+    kernel = VectorConflictIndex(lambda: bookings, max_age=3600)
+
+    expected = [keyed(conflicts) for conflicts in reference.find_conflicts_many(proposals)]
+    assert [keyed(conflicts) for conflicts in kernel.find_conflicts_many(proposals)] == expected
+    for proposed, conflicts in zip(proposals, expected):
+        assert keyed(kernel.find_conflicts(proposed)) == conflicts
+        assert kernel.has_conflict(proposed) == bool(conflicts)
+    # The schedule is dense enough that most checks find something
+    assert sum(1 for conflicts in expected if conflicts) > len(proposals) // 2
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_both_engines_match_day_scan(seed):
+    rng = random.Random(seed)
+    bookings = random_schedule(rng, 300)
+    proposals = random_proposals(rng, 100)
+    reference = ConflictIndex(lambda: bookings, max_age=3600)
+    kernel = VectorConflictIndex(lambda: bookings, max_age=3600)
+
+    for proposed in proposals:
+        expected = brute_force(proposed, bookings)
+        assert sorted(keyed(reference.find_conflicts(proposed))) == expected
+        assert sorted(keyed(kernel.find_conflicts(proposed))) == expected
+
+
+def test_touching_windows_conflict():
+    existing = Booking('admin', 1, 'Practice', date(2025, 3, 3), date(2025, 3, 31),
+                       time(18, 0), time(19, 0), True, 'biweekly')
+    proposals = [
+        # Starts the minute the practice ends, on its second occurrence
+        Booking(None, None, 'After', date(2025, 3, 17), date(2025, 3, 17), time(19, 0), time(20, 0), False),
+        # Daily, ends when the practice starts
+        Booking(None, None, 'Before', date(2025, 3, 4), date(2025, 3, 20), time(17, 0), time(18, 0), True, 'daily'),
+        # Weekly on the practice's weekday, but a minute later
+        Booking(None, None, 'Later', date(2025, 3, 3), date(2025, 3, 31), time(19, 1), time(20, 0), True, 'weekly'),
+    ]
+    for index in (ConflictIndex(lambda: [existing], max_age=3600),
+                  VectorConflictIndex(lambda: [existing], max_age=3600)):
+        assert keyed(index.find_conflicts(proposals[0])) == [(('admin', 1), date(2025, 3, 17))]
+        assert keyed(index.find_conflicts(proposals[1])) == [(('admin', 1), date(2025, 3, 17))]
+        assert keyed(index.find_conflicts(proposals[2])) == []
@@ -0,0 +1,141 @@
+"""
+The email outbox against a local database: a queued email is sent once,
+retried later after a failure, given up after max_attempts, sent again when
+its sender's lease runs out, and never sent twice by two dispatchers
+draining at the same time.
+
+Needs TEST_DATABASE_URL (see conftest.py); skipped without it.
+"""
+import threading
+import time
+import uuid
+
+import pytest
+import sqlalchemy
+
+import email_outbox
+from email_outbox import Dispatcher, FakeTransport
+
+
+TO_ADDRESS = 'pytest-outbox@localhost'
+
+
+@pytest.fixture
+def outbox(database):
+    """queue(n=1, dedupe_key=None) queues n test emails and returns their ids; they are deleted afterwards"""
+    def cleanup():
+        with database.connect() as conn:
+            conn.execute(sqlalchemy.text("DELETE FROM public.email_outbox WHERE to_address = :to"),
+                         {"to": TO_ADDRESS})
+
+    def queue(n=1, dedupe_key=None):
+        with database.connect() as conn:
+            return [email_outbox.enqueue(conn, TO_ADDRESS, f"pytest {uuid.uuid4()}", '<p>pytest</p>', dedupe_key)
+                    for _ in range(n)]
+
+    cleanup()
+    yield queue
+    cleanup()
+
+
+def stored(database, email_id):
+    with database.connect() as conn:
+        return dict(conn.execute(sqlalchemy.text("""
+            SELECT status, attempts, message_id, last_error, next_attempt_at > NOW() AS later
+            FROM public.email_outbox WHERE email_id = :email_id
+        """), {"email_id": email_id}).mappings().one())
+
+
+def test_queued_email_is_sent(database, outbox):
+    email_id, = outbox()
+    transport = FakeTransport()
+    sent, failed = Dispatcher(database, transport).drain()
+
+    assert (sent, failed) == (len(transport.sent), 0)
+    row = stored(database, email_id)
+    assert row['status'] == 'sent' and row['attempts'] == 1
+    assert row['message_id'] and row['message_id'].startswith('fake-')
+    assert [message['to'] for message in transport.sent].count(TO_ADDRESS) == 1
+
+
+def test_failed_send_is_retried_later(database, outbox):
+    email_id, = outbox()
+    transport = FakeTransport(failures=1)
+    Dispatcher(database, transport, workers=1).drain()
+
+    row = stored(database, email_id)
+    assert row['status'] == 'pending' and row['attempts'] == 1
+    assert row['later'] and row['last_error'] == "Fake transport failure"
+    assert row['message_id'] is None
+
+
+def test_email_fails_after_max_attempts(database, outbox):
+    email_id, = outbox()
+    # Without a delay the email is due again at once, so one drain runs every attempt
+    dispatcher = Dispatcher(database, FakeTransport(failures=3), workers=1, max_attempts=3, base_delay=0)
+    dispatcher.drain()
+
+    row = stored(database, email_id)
+    assert row['status'] == 'failed' and row['attempts'] == 3
+
+
+def test_email_is_claimed_again_after_its_lease(database, outbox):
+    email_id, = outbox()
+    with database.connect() as conn:
+        claimed, = [email for email in email_outbox.claim_due(conn, 100, 300) if email['email_id'] == email_id]
+        # Its sender is still within the lease
+        assert email_id not in [email['email_id'] for email in email_outbox.claim_due(conn, 100, 300)]
+        # ... and then dies without recording the result
+        conn.execute(sqlalchemy.text("""
+            UPDATE public.email_outbox SET next_attempt_at = NOW() - INTERVAL '1 second'
+            WHERE email_id = :email_id
+        """), {"email_id": email_id})
+
+    Dispatcher(database, FakeTransport()).drain()
+    row = stored(database, email_id)
+    assert row['status'] == 'sent' and row['attempts'] == 2
+
+    # The first sender's late failure doesn't touch the row any more
+    with database.connect() as conn:
+        email_outbox.mark_failed(conn, claimed, RuntimeError("late"), 0, True)
+    assert stored(database, email_id)['status'] == 'sent'
+
+
+def test_dedupe_key_queues_one_email(database, outbox):
+    key = f"pytest-{uuid.uuid4()}"
+    first, second = outbox(2, dedupe_key=key)
+    assert first == second
+
+    with database.connect() as conn:
+        assert conn.execute(sqlalchemy.text("SELECT COUNT(*) FROM public.email_outbox WHERE dedupe_key = :key"),
+                            {"key": key}).scalar() == 1
+
+
+class SlowTransport(FakeTransport):
+    def send(self, to_address, subject, html_body):
+        time.sleep(0.01)
+        return super().send(to_address, subject, html_body)
+
+
+def test_concurrent_drains_send_each_email_once(database, outbox):
+    email_ids = outbox(30)
+    transports = [SlowTransport(), SlowTransport()]
+    dispatchers = [Dispatcher(database, transport) for transport in transports]
+
+    start = threading.Barrier(len(dispatchers))
+
+    def drain(dispatcher):
+        start.wait()
+        dispatcher.drain()
+
+    threads = [threading.Thread(target=drain, args=(dispatcher,)) for dispatcher in dispatchers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    subjects = [message['subject'] for transport in transports for message in transport.sent
+                if message['to'] == TO_ADDRESS]
+    assert len(subjects) == len(set(subjects)) == len(email_ids)
+    assert all(transport.sent for transport in transports)
+    assert {stored(database, email_id)['status'] for email_id in email_ids} == {'sent'}
@@ -0,0 +1,458 @@
+"""
+The monthly invoicing job's rate limiter and retries, and the job itself run
+against a fake `stripe` module and in-memory runs instead of Stripe and
+monthly_invoice_run. The resume tests at the end use the real
+monthly_invoice_run and need TEST_DATABASE_URL (see conftest.py).
+"""
+import threading
+import time
+from datetime import date, time as time_of_day
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy
+
+import invoicing
+import main
+from conflict_index import Booking
+from invoicing import TokenBucket, call_with_retries, run_concurrently
+
+
+class FakeClock:
+    """clock() and sleep() for TokenBucket: sleeping moves the clock"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Retryable(Exception):
+    pass
+
+
+def test_token_bucket_spaces_calls():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock.clock, sleep=clock.sleep)
+    times = []
+    for _ in range(5):
+        bucket.acquire()
+        times.append(clock.now)
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert gaps == pytest.approx([0.1] * 4)
+
+
+def test_token_bucket_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(10, burst=3, clock=clock.clock, sleep=clock.sleep)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.now == pytest.approx(100.1)
+
+    # Idle time refills the bucket, but never past the burst
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == pytest.approx(110.1)
+    bucket.acquire()
+    assert clock.now == pytest.approx(110.2)
+
+
+def test_retries_until_success():
+    clock = FakeClock()
+    bucket = TokenBucket(1000, burst=10, clock=clock.clock, sleep=clock.sleep)
+    calls = []
+
+    def call():
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise Retryable("rate limited")
+        return 'done'
+
+    sleeps = []
+    assert call_with_retries(call, limiter=bucket, retryable=(Retryable,), attempts=4,
+                             base_delay=0.5, sleep=sleeps.append) == 'done'
+    assert len(calls) == 3
+    # base_delay * 2^n plus up to as much again in jitter
+    assert 0.5 <= sleeps[0] <= 1.0
+    assert 1.0 <= sleeps[1] <= 2.0
+
+
+def test_gives_up_after_the_last_attempt():
+    calls = []
+    sleeps = []
+
+    def call():
+        calls.append(1)
+        raise Retryable(f"attempt {len(calls)}")
+
+    with pytest.raises(Retryable, match='attempt 3'):
+        call_with_retries(call, retryable=(Retryable,), attempts=3, sleep=sleeps.append)
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        call_with_retries(call, retryable=(Retryable,), attempts=3, sleep=lambda seconds: None)
+    assert len(calls) == 1
+
+
+def test_run_concurrently_keeps_order_and_errors():
+    def work(item):
+        if item == 3:
+            raise ValueError('three')
+        time.sleep(0.01 * (5 - item))
+        return item * 10
+
+    results = run_concurrently([1, 2, 3, 4], work, workers=4)
+    assert [(item, result) for item, result, _ in results] == [(1, 10), (2, 20), (3, None), (4, 40)]
+    assert [type(error) for _, _, error in results] == [type(None), type(None), ValueError, type(None)]
+    assert run_concurrently([], work, workers=4) == []
+
+
+class StripeError(Exception):
+    pass
+
+
+class FakeStripe:
+    """
+    The parts of the stripe module the job uses. InvoiceItem.create fails for
+    the customers in `failing`; every call takes a little time so the job's
+    threads overlap, and the most calls in flight at once is kept.
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self.invoices = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.error = SimpleNamespace(
+            StripeError=StripeError,
+            RateLimitError=type('RateLimitError', (StripeError,), {}),
+            APIConnectionError=type('APIConnectionError', (StripeError,), {}),
+            APIError=type('APIError', (StripeError,), {}),
+            InvalidRequestError=type('InvalidRequestError', (StripeError,), {})
+        )
+        self.Invoice = SimpleNamespace(
+            create=self._call('Invoice.create', self._create_invoice),
+            retrieve=self._call('Invoice.retrieve', lambda invoice_id, **params: self.invoices[invoice_id]),
+            finalize_invoice=self._call('Invoice.finalize_invoice', self._finalize)
+        )
+        self.InvoiceItem = SimpleNamespace(create=self._call('InvoiceItem.create', self._create_item))
+
+    def _call(self, name, handler):
+        def call(*args, **params):
+            with self._lock:
+                self.calls.append((name, params.get('idempotency_key')))
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                time.sleep(0.02)
+                return handler(*args, **params)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+        return call
+
+    def _create_invoice(self, customer, **params):
+        with self._lock:
+            invoice_id = f"in_{len(self.invoices) + 1}"
+            self.invoices[invoice_id] = {'id': invoice_id, 'customer': customer, 'status': 'draft',
+                                         'lines': {'data': []}}
+        return SimpleNamespace(id=invoice_id)
+
+    def _create_item(self, customer, invoice, amount, **params):
+        if customer in self.failing:
+            raise StripeError(f"Your card was declined ({customer})")
+        item_id = f"ii_{invoice}"
+        self.invoices[invoice]['lines']['data'].append({'id': f"il_{invoice}", 'invoice_item': item_id,
+                                                        'amount': amount})
+        return SimpleNamespace(id=item_id)
+
+    def _finalize(self, invoice_id, **params):
+        self.invoices[invoice_id]['status'] = 'open'
+        return SimpleNamespace(id=invoice_id, status='open', hosted_invoice_url=f"https://pay/{invoice_id}")
+
+
+class FakeRuns:
+    """monthly_invoice_run and monthly_invoice in memory, behind the invoicing functions the job calls"""
+
+    def __init__(self, users):
+        self.runs = {}
+        self.failures = {}
+        self.recorded = []
+        self.users = users
+
+    def plan_month(self, conn, month, year):
+        return list(self.users), [], []
+
+    def save_plan(self, conn, month, year, to_invoice):
+        planned = {user['user_id'] for user in to_invoice}
+        for user_id, run in list(self.runs.items()):
+            if user_id not in planned and run['state'] == 'planned' and not run['stripe_invoice_id']:
+                del self.runs[user_id]
+        for user in to_invoice:
+            run = self.runs.setdefault(user['user_id'], {
+                'user_id': user['user_id'],
+                'state': 'planned',
+                'stripe_customer_id': None,
+                'stripe_invoice_item_id': None,
+                'stripe_invoice_id': None,
+                'payment_link': None,
+                'attempts': 0
+            })
+            if run['state'] == 'planned' and not run['stripe_invoice_id']:
+                run.update(amount=user['total_amount'], request_ids=user['request_ids'], details={
+                    key: user[key] for key in ('user_email', 'user_name', 'rental_names', 'start_dates', 'end_dates')
+                })
+
+    def pending_runs(self, conn, month, year):
+        return [dict(run) for run in self.runs.values() if run['state'] != 'emailed']
+
+    def save_progress(self, conn, month, year, run, **fields):
+        self.runs[run['user_id']].update(fields)
+        run.update(fields)
+
+    def save_failure(self, conn, month, year, user_id, error):
+        self.runs[user_id]['attempts'] += 1
+        self.failures[user_id] = str(error)
+
+    def record_finalized(self, conn, month, year):
+        finalized = [run for run in self.runs.values() if run['state'] == 'finalized']
+        for run in finalized:
+            run['state'] = 'recorded'
+            self.recorded.append(run['user_id'])
+        return len(finalized)
+
+
+class FakePool:
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def make_user(user_id):
+    return {
+        'user_id': user_id,
+        'user_email': f"renter{user_id}@example.com",
+        'user_name': f"Renter {user_id}",
+        'stripe_customer_id': f"cus_{user_id}",
+        'total_amount': Decimal('25.50') * user_id,
+        'request_ids': [user_id * 10],
+        'rental_names': [f"Rental {user_id}"],
+        'start_dates': ['2025-03-03'],
+        'end_dates': ['2025-03-03']
+    }
+
+
+@pytest.fixture
+def job(monkeypatch):
+    """Runs the job with stripe, the runs and the emails replaced; returns (stripe, runs, emails)"""
+    def setup(user_ids, failing=()):
+        fake_stripe = FakeStripe(failing)
+        runs = FakeRuns([make_user(user_id) for user_id in user_ids])
+        emails = []
+        monkeypatch.setattr(main, 'stripe', fake_stripe)
+        monkeypatch.setattr(main, 'pool', FakePool())
+        monkeypatch.setattr(main, 'stripe_limiter', TokenBucket(1000, burst=20))
+        monkeypatch.setattr(main, 'stripe_customer_ids', main.CustomerIdCache(64))
+        monkeypatch.setattr(main, 'INVOICE_WORKERS', 4)
+        monkeypatch.setattr(main, 'send_monthly_invoice_email',
+                            lambda **email: emails.append(email) or True)
+        for name in ('plan_month', 'save_plan', 'pending_runs', 'save_progress', 'save_failure',
+                     'record_finalized'):
+            monkeypatch.setattr(invoicing, name, getattr(runs, name))
+        return fake_stripe, runs, emails
+    return setup
+
+
+def test_job_invoices_users_concurrently(job):
+    fake_stripe, runs, emails = job(range(1, 9), failing={'cus_5'})
+    report = main.run_monthly_invoicing(3, 2025, time.monotonic() + 60)
+
+    assert report['invoices_created'] == 7
+    assert report['invoices_failed'] == [5]
+    assert report['emails_sent'] == 7
+    assert report['remaining'] == 1
+    assert not report['complete']
+    assert fake_stripe.max_in_flight > 1
+
+    assert 'declined' in runs.failures[5]
+    assert runs.runs[5]['state'] == 'planned' and runs.runs[5]['attempts'] == 1
+    for user_id in (1, 2, 3, 4, 6, 7, 8):
+        run = runs.runs[user_id]
+        assert run['state'] == 'emailed'
+        assert run['payment_link'] == f"https://pay/{run['stripe_invoice_id']}"
+        assert run['stripe_invoice_item_id'] == f"ii_{run['stripe_invoice_id']}"
+    assert sorted(email['payment_link'] for email in emails) == \
+        sorted(runs.runs[user_id]['payment_link'] for user_id in (1, 2, 3, 4, 6, 7, 8))
+
+    # Each user's invoice is created with its own idempotency key, once
+    invoice_keys = [key for name, key in fake_stripe.calls if name == 'Invoice.create']
+    assert sorted(invoice_keys) == sorted(invoicing.idempotency_key(user_id, 3, 2025, 'invoice')
+                                          for user_id in range(1, 9))
+
+
+def test_job_resumes_failed_user(job):
+    fake_stripe, runs, emails = job([1, 2], failing={'cus_2'})
+    main.run_monthly_invoicing(3, 2025, time.monotonic() + 60)
+    invoice_id = runs.runs[2]['stripe_invoice_id']
+
+    fake_stripe.failing.clear()
+    fake_stripe.calls.clear()
+    report = main.run_monthly_invoicing(3, 2025, time.monotonic() + 60)
+
+    assert report['invoices_created'] == 1
+    assert report['invoices_failed'] == []
+    assert report['complete']
+    # The draft from the failed attempt is reused, not created again
+    assert runs.runs[2]['stripe_invoice_id'] == invoice_id
+    assert [name for name, _ in fake_stripe.calls] == ['Invoice.retrieve', 'InvoiceItem.create',
+                                                       'Invoice.finalize_invoice']
+
+
+def test_resumed_draft_with_its_item_keeps_the_item(job):
+    fake_stripe, runs, emails = job([1])
+    main.run_monthly_invoicing(3, 2025, time.monotonic() + 60)
+    run = runs.runs[1]
+    invoice_id = run['stripe_invoice_id']
+
+    # As if the item was added but the attempt died before checkpointing it
+    run.update(state='planned', stripe_invoice_item_id=None, payment_link=None)
+    fake_stripe.invoices[invoice_id]['status'] = 'draft'
+    fake_stripe.calls.clear()
+    main.advance_invoice_run(dict(run), 3, 2025, time.monotonic() + 60)
+
+    assert runs.runs[1]['stripe_invoice_item_id'] == f"ii_{invoice_id}"
+    assert runs.runs[1]['state'] == 'finalized'
+    assert len(fake_stripe.invoices[invoice_id]['lines']['data']) == 1
+    assert 'InvoiceItem.create' not in [name for name, _ in fake_stripe.calls]
+
+
+def test_past_deadline_does_nothing(job):
+    fake_stripe, runs, emails = job([1, 2])
+    report = main.run_monthly_invoicing(3, 2025, time.monotonic() - 1)
+    assert report['invoices_created'] == 0
+    assert report['remaining'] == 2
+    assert fake_stripe.calls == []
+
+
+# A month nobody has booked yet
+MONTH, YEAR = 1, 2090
+
+
+@pytest.fixture
+def db_job(database, renter_id, monkeypatch):
+    """Runs the job on the test database with stripe and the emails replaced; returns (stripe, emails)"""
+    fake_stripe = FakeStripe()
+    emails = []
+    monkeypatch.setattr(main, 'stripe', fake_stripe)
+    monkeypatch.setattr(main, 'pool', database)
+    monkeypatch.setattr(main, 'stripe_limiter', TokenBucket(1000, burst=20))
+    monkeypatch.setattr(main, 'stripe_customer_ids', main.CustomerIdCache(64))
+    monkeypatch.setattr(main, 'send_monthly_invoice_email', lambda **email: emails.append(email) or True)
+    with database.begin() as conn:
+        conn.execute(sqlalchemy.text("""
+            UPDATE public.renter SET stripe_customer_id = 'cus_pytest' WHERE renter_id = :renter_id
+        """), {"renter_id": renter_id})
+    yield fake_stripe, emails
+    with database.begin() as conn:
+        for table in ('monthly_invoice_run', 'monthly_invoice'):
+            conn.execute(sqlalchemy.text(f"DELETE FROM public.{table} WHERE user_id = :renter_id"),
+                         {"renter_id": renter_id})
+
+
+def add_practice(database, add_rental, day, amount):
+    booking = Booking(None, None, 'Practice', date(YEAR, MONTH, day), date(YEAR, MONTH, day),
+                      time_of_day(18), time_of_day(19), False)
+    with database.begin() as conn:
+        return add_rental(conn, booking, 'approved', amount)
+
+
+def interrupted_invocation(database, renter_id, **progress):
+    """Plan the month and checkpoint `progress` on the renter's run, as an invocation that then died"""
+    with database.connect() as conn:
+        to_invoice, _, _ = invoicing.plan_month(conn, MONTH, YEAR)
+        invoicing.save_plan(conn, MONTH, YEAR, to_invoice)
+        run = next(run for run in invoicing.pending_runs(conn, MONTH, YEAR) if run['user_id'] == renter_id)
+        if progress:
+            invoicing.save_progress(conn, MONTH, YEAR, run, **progress)
+
+
+def stored_run(database, renter_id):
+    with database.connect() as conn:
+        return conn.execute(sqlalchemy.text("""
+            SELECT state, amount, request_ids FROM public.monthly_invoice_run
+            WHERE invoice_year = :year AND invoice_month = :month AND user_id = :user_id
+        """), {"year": YEAR, "month": MONTH, "user_id": renter_id}).fetchone()
+
+
+def test_resume_drops_the_run_of_a_renter_who_paid(database, renter_id, add_rental, db_job):
+    fake_stripe, emails = db_job
+    request_id = add_practice(database, add_rental, 10, Decimal('30'))
+    interrupted_invocation(database, renter_id, stripe_customer_id='cus_pytest')
+
+    with database.begin() as conn:
+        conn.execute(sqlalchemy.text("UPDATE public.rental_request SET paid = TRUE WHERE request_id = :request_id"),
+                     {"request_id": request_id})
+    main.run_monthly_invoicing(MONTH, YEAR, time.monotonic() + 60)
+
+    assert stored_run(database, renter_id) is None
+    assert fake_stripe.calls == []
+    assert emails == []
+
+
+def test_resume_replans_until_the_invoice_exists(database, renter_id, add_rental, db_job):
+    fake_stripe, emails = db_job
+    first = add_practice(database, add_rental, 10, Decimal('30'))
+    # The customer is saved, but no invoice was created yet
+    interrupted_invocation(database, renter_id, stripe_customer_id='cus_pytest')
+
+    second = add_practice(database, add_rental, 17, Decimal('20'))
+    report = main.run_monthly_invoicing(MONTH, YEAR, time.monotonic() + 60)
+
+    assert report['invoices_created'] == 1
+    run = stored_run(database, renter_id)
+    assert run.state == 'emailed'
+    assert run.amount == Decimal('50') and run.request_ids == [first, second]
+    [invoice] = fake_stripe.invoices.values()
+    assert [line['amount'] for line in invoice['lines']['data']] == [5000]
+    assert [email['amount'] for email in emails] == [Decimal('50')]
+
+    # Once the invoice exists the run is fixed, even if the requests change again
+    add_practice(database, add_rental, 24, Decimal('10'))
+    with database.begin() as conn:
+        conn.execute(sqlalchemy.text("""
+            UPDATE public.monthly_invoice_run SET state = 'planned'
+            WHERE invoice_year = :year AND invoice_month = :month AND user_id = :user_id
+        """), {"year": YEAR, "month": MONTH, "user_id": renter_id})
+        conn.execute(sqlalchemy.text("DELETE FROM public.monthly_invoice WHERE user_id = :user_id"),
+                     {"user_id": renter_id})
+    with database.connect() as conn:
+        to_invoice, _, _ = invoicing.plan_month(conn, MONTH, YEAR)
+        invoicing.save_plan(conn, MONTH, YEAR, to_invoice)
+    assert stored_run(database, renter_id).amount == Decimal('50')
@@ -0,0 +1,188 @@
+"""
+CertificateKeyStore against a locally generated key set: RS256 tokens signed
+with throwaway keys, served through an injected `fetch`.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+import key_store
+from key_store import CertificateKeyStore, TokenExpiredError
+
+
+PROJECT_ID = 'test-project'
+
+
+def make_key(key_id):
+    """(signer, PEM certificate, PEM private key) for a fresh RSA key"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+    now = datetime.now(timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name)
+                   .issuer_name(name)
+                   .public_key(private_key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - timedelta(days=1))
+                   .not_valid_after(now + timedelta(days=1))
+                   .sign(private_key, hashes.SHA256()))
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    return (crypt.RSASigner.from_string(private_pem, key_id),
+            certificate.public_bytes(serialization.Encoding.PEM).decode(),
+            private_pem)
+
+
+@pytest.fixture(scope='module')
+def keys():
+    return {key_id: make_key(key_id) for key_id in ('key-1', 'key-2')}
+
+
+class FakeFetch:
+    """Returns each of `responses` ({key_id: certificate}, max_age) in turn, then repeats the last"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return response
+
+
+class FakeClock:
+    """Stands in for the time module inside key_store"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def certs_for(keys, *key_ids):
+    return {key_id: keys[key_id][1] for key_id in key_ids}
+
+
+def make_token(keys, key_id='key-1', **overrides):
+    now = int(time.time())
+    claims = {
+        'iss': f"https://securetoken.google.com/{PROJECT_ID}",
+        'aud': PROJECT_ID,
+        'sub': 'user-123',
+        'email': 'renter@example.com',
+        'iat': now - 10,
+        'auth_time': now - 10,
+        'exp': now + 3600,
+    }
+    claims.update(overrides)
+    return jwt.encode(keys[key_id][0], claims).decode()
+
+
+def test_valid_token(keys):
+    store = CertificateKeyStore(PROJECT_ID, fetch=FakeFetch((certs_for(keys, 'key-1'), 3600)))
+    claims = store.verify(make_token(keys))
+    assert claims['uid'] == 'user-123'
+    assert claims['email'] == 'renter@example.com'
+
+
+def test_expired_token(keys):
+    store = CertificateKeyStore(PROJECT_ID, fetch=FakeFetch((certs_for(keys, 'key-1'), 3600)))
+    past = int(time.time()) - 7200
+    with pytest.raises(TokenExpiredError):
+        store.verify(make_token(keys, iat=past - 3600, auth_time=past - 3600, exp=past))
+
+
+def test_wrong_audience(keys):
+    store = CertificateKeyStore(PROJECT_ID, fetch=FakeFetch((certs_for(keys, 'key-1'), 3600)))
+    with pytest.raises(ValueError):
+        store.verify(make_token(keys, aud='another-project'))
+
+
+def test_wrong_issuer(keys):
+    store = CertificateKeyStore(PROJECT_ID, fetch=FakeFetch((certs_for(keys, 'key-1'), 3600)))
+    with pytest.raises(ValueError, match='issuer'):
+        store.verify(make_token(keys, iss='https://securetoken.google.com/another-project'))
+
+
+def test_signed_by_another_key(keys):
+    # key-2's token claiming key-1's id doesn't verify with key-1's certificate
+    signer = crypt.RSASigner.from_string(keys['key-2'][2], 'key-1')
+    store = CertificateKeyStore(PROJECT_ID, fetch=FakeFetch((certs_for(keys, 'key-1'), 3600)))
+    now = int(time.time())
+    token = jwt.encode(signer, {'iss': f"https://securetoken.google.com/{PROJECT_ID}", 'aud': PROJECT_ID,
+                                'sub': 'user-123', 'iat': now, 'exp': now + 3600}).decode()
+    with pytest.raises(ValueError):
+        store.verify(token)
+
+
+def test_unknown_key_id_refetches(keys):
+    fetch = FakeFetch((certs_for(keys, 'key-1'), 3600), (certs_for(keys, 'key-1', 'key-2'), 3600))
+    store = CertificateKeyStore(PROJECT_ID, fetch=fetch, retry_delay=0)
+    store.verify(make_token(keys, 'key-1'))
+    assert fetch.calls == 1
+
+    # The certificates rotated before our copy expired
+    assert store.verify(make_token(keys, 'key-2'))['uid'] == 'user-123'
+    assert fetch.calls == 2
+
+
+def test_unknown_key_id_after_refetch_fails(keys):
+    fetch = FakeFetch((certs_for(keys, 'key-1'), 3600))
+    store = CertificateKeyStore(PROJECT_ID, fetch=fetch, retry_delay=0)
+    with pytest.raises(ValueError):
+        store.verify(make_token(keys, 'key-2'))
+    assert fetch.calls == 2
+
+
+def test_refresh_honors_max_age(keys, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(key_store, 'time', clock)
+    fetch = FakeFetch((certs_for(keys, 'key-1'), 600), (certs_for(keys, 'key-2'), 600))
+    store = CertificateKeyStore(PROJECT_ID, fetch=fetch)
+
+    assert store.certs() == certs_for(keys, 'key-1')
+    clock.now += 599
+    assert store.certs() == certs_for(keys, 'key-1')
+    assert fetch.calls == 1
+
+    clock.now += 2
+    assert store.certs() == certs_for(keys, 'key-2')
+    assert fetch.calls == 2
+
+
+def test_failed_refresh_keeps_previous_certs(keys, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(key_store, 'time', clock)
+    responses = [(certs_for(keys, 'key-1'), 600)]
+
+    def fetch():
+        if not responses:
+            raise OSError("network down")
+        return responses.pop()
+
+    store = CertificateKeyStore(PROJECT_ID, fetch=fetch)
+    assert store.certs() == certs_for(keys, 'key-1')
+    clock.now += 601
+    assert store.certs() == certs_for(keys, 'key-1')
+
+
+def test_cache_file_is_reused(keys, tmp_path):
+    cache_path = str(tmp_path / 'certs.json')
+    CertificateKeyStore(PROJECT_ID, cache_path=cache_path,
+                        fetch=FakeFetch((certs_for(keys, 'key-1'), 3600))).certs()
+
+    fetch = FakeFetch((certs_for(keys, 'key-2'), 3600))
+    store = CertificateKeyStore(PROJECT_ID, cache_path=cache_path, fetch=fetch)
+    assert store.verify(make_token(keys))['uid'] == 'user-123'
+    assert fetch.calls == 0
@@ -0,0 +1,84 @@
+"""
+Lazy builds its value once per process, even when many threads ask for it at
+the same moment, and tries again after a factory that raised.
+"""
+import sys
+import threading
+import time
+
+import pytest
+
+from lazy import Lazy, lazy_module
+
+
+def test_concurrent_first_use_runs_the_factory_once():
+    calls = []
+
+    def factory():
+        calls.append(threading.current_thread().name)
+        # Long enough for every thread to reach get() meanwhile
+        time.sleep(0.05)
+        return object()
+
+    client = Lazy(factory)
+    start = threading.Barrier(16)
+    values = []
+
+    def use():
+        start.wait()
+        values.append(client.get())
+
+    threads = [threading.Thread(target=use) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(values) == 16 and all(value is values[0] for value in values)
+
+
+def test_failed_factory_is_tried_again():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("Cloud SQL unavailable")
+        return 'pool'
+
+    client = Lazy(factory)
+    with pytest.raises(ConnectionError):
+        client.get()
+    assert not client.initialized
+
+    assert client.get() == 'pool'
+    assert client.initialized
+    client.get()
+    assert len(attempts) == 2
+
+
+def test_attributes_are_forwarded():
+    class Pool:
+        def connect(self):
+            return 'connection'
+
+    pool = Lazy(Pool, 'pool')
+    assert not pool.initialized
+    assert 'not initialized' in repr(pool)
+
+    assert pool.connect() == 'connection'
+    assert pool.initialized
+    assert isinstance(pool.get(), Pool)
+    with pytest.raises(AttributeError):
+        pool.missing
+
+
+def test_lazy_module_imports_and_sets_up_once():
+    setups = []
+    module = lazy_module('json', setup=setups.append)
+    assert not module.initialized and setups == []
+
+    assert module.dumps([1]) == '[1]'
+    assert module.loads('[1]') == [1]
+    assert setups == [sys.modules['json']]
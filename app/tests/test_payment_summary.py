@@ -0,0 +1,138 @@
+"""
+rental_payment_summary (migrations/005_rental_payment_summary.sql) must match
+rental_request after every kind of write its trigger handles, and
+rebuild_rental_payment_summary() must reproduce it; payment_summary() reads
+its totals from it.
+
+Needs TEST_DATABASE_URL (see conftest.py); skipped without it.
+"""
+from datetime import date, time
+
+import pytest
+import sqlalchemy
+
+from conflict_index import Booking
+
+
+OTHER_EMAIL = 'pytest-other@localhost'
+
+SUMMARY_COLUMNS = """user_id, month, rental_status, request_count, paid_count, unpaid_count,
+    paid_amount, unpaid_amount, total_amount"""
+
+STORED_QUERY = sqlalchemy.text(f"""
+    SELECT {SUMMARY_COLUMNS} FROM public.rental_payment_summary
+    WHERE user_id IN :users AND request_count <> 0
+    ORDER BY user_id, month, rental_status
+""").bindparams(sqlalchemy.bindparam('users', expanding=True))
+
+DIRECT_QUERY = sqlalchemy.text("""
+    SELECT
+        user_id,
+        date_trunc('month', start_date)::date,
+        COALESCE(rental_status, ''),
+        COUNT(*),
+        COUNT(*) FILTER (WHERE paid),
+        COUNT(*) FILTER (WHERE NOT COALESCE(paid, false) AND COALESCE(amount, 0) <> 0),
+        COALESCE(SUM(amount) FILTER (WHERE paid), 0),
+        COALESCE(SUM(amount) FILTER (WHERE NOT COALESCE(paid, false)), 0),
+        COALESCE(SUM(amount), 0)
+    FROM public.rental_request
+    WHERE user_id IN :users
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+""").bindparams(sqlalchemy.bindparam('users', expanding=True))
+
+# What /api/admin/payment-summary reports for one renter
+TOTALS_QUERY = sqlalchemy.text("""
+    SELECT
+        COUNT(*),
+        COALESCE(SUM(amount) FILTER (WHERE paid), 0),
+        COALESCE(SUM(amount) FILTER (WHERE NOT COALESCE(paid, false) AND rental_status = 'approved'), 0),
+        COALESCE(SUM(amount), 0)
+    FROM public.rental_request
+    WHERE user_id = :user_id
+""")
+
+
+@pytest.fixture
+def other_renter_id(database, renter_id):
+    """A second renter to move a request to; deleted (after the test renter's requests) afterwards"""
+    def cleanup():
+        with database.begin() as conn:
+            conn.execute(sqlalchemy.text("""
+                DELETE FROM public.rental_request
+                WHERE user_id IN (SELECT renter_id FROM public.renter WHERE renter_email = :email)
+            """), {"email": OTHER_EMAIL})
+            conn.execute(sqlalchemy.text("DELETE FROM public.renter WHERE renter_email = :email"),
+                         {"email": OTHER_EMAIL})
+
+    cleanup()
+    with database.begin() as conn:
+        other = conn.execute(sqlalchemy.text("""
+            INSERT INTO public.renter (first_name, last_name, renter_email, firebase_uid, created_at)
+            VALUES ('py', 'test', :email, :email, NOW())
+            RETURNING renter_id
+        """), {"email": OTHER_EMAIL}).scalar()
+    yield other
+    cleanup()
+
+
+def summary_matches(conn, users):
+    stored = [tuple(row) for row in conn.execute(STORED_QUERY, {"users": users})]
+    direct = [tuple(row) for row in conn.execute(DIRECT_QUERY, {"users": users})]
+    assert stored == direct
+    # Groups emptied by updates and deletes stay behind, all zero
+    assert conn.execute(sqlalchemy.text("""
+        SELECT COUNT(*) FROM public.rental_payment_summary
+        WHERE user_id IN :users AND request_count = 0
+        AND (paid_count, unpaid_count, paid_amount, unpaid_amount, total_amount) <> (0, 0, 0, 0, 0)
+    """).bindparams(sqlalchemy.bindparam('users', expanding=True)), {"users": users}).scalar() == 0
+    return stored
+
+
+def test_summary_follows_every_write(database, admin_client, add_rental, renter_id, other_renter_id):
+    users = [renter_id, other_renter_id]
+    day = date(2090, 3, 12)
+    booking = Booking(None, None, 'pytest', day, day, time(18), time(19), False, None)
+
+    def update(assignments, request_id):
+        conn.execute(sqlalchemy.text(f"UPDATE public.rental_request SET {assignments} WHERE request_id = :id"),
+                     {"id": request_id})
+
+    def check():
+        summary_matches(conn, users)
+        for user_id in users:
+            response = admin_client.get('/api/admin/payment-summary', query_string={'user_id': user_id})
+            body = response.get_json()
+            count, paid, unpaid, total = conn.execute(TOTALS_QUERY, {"user_id": user_id}).fetchone()
+            assert (body['count'], body['payment_summary']) == \
+                (count, {"paid": float(paid), "unpaid": float(unpaid), "total": float(total)})
+
+    with database.connect() as conn:
+        # Already in the month and status the request under test moves through
+        add_rental(conn, booking, 'approved', 40)
+        add_rental(conn, booking, 'pending', 15.5)
+        request_id = add_rental(conn, booking, 'pending', 100)
+        check()
+
+        for assignments in ("rental_status = 'approved'",
+                            "amount = 250",
+                            "paid = true",
+                            "start_date = DATE '2090-04-02', end_date = DATE '2090-04-02'",
+                            f"user_id = {other_renter_id}",
+                            "paid = false, amount = 0"):
+            update(assignments, request_id)
+            check()
+
+        conn.execute(sqlalchemy.text("DELETE FROM public.rental_request WHERE request_id = :id"),
+                     {"id": request_id})
+        check()
+
+        stored = summary_matches(conn, users)
+        with conn.begin():
+            conn.execute(sqlalchemy.text("SELECT public.rebuild_rental_payment_summary()"))
+        assert summary_matches(conn, users) == stored
+        assert [tuple(row) for row in conn.execute(sqlalchemy.text(f"""
+            SELECT {SUMMARY_COLUMNS} FROM public.rental_payment_summary
+            WHERE user_id IN :users ORDER BY user_id, month, rental_status
+        """).bindparams(sqlalchemy.bindparam('users', expanding=True)), {"users": users})] == stored
@@ -0,0 +1,112 @@
+"""
+The request listings page with a keyset cursor: following next_cursor to the
+end must give the same rows, in the same order, as the unpaged list (or the
+filtered table), for every page size and filter.
+
+Needs TEST_DATABASE_URL (see conftest.py); skipped without it.
+"""
+import random
+from datetime import date, time, timedelta
+
+import pytest
+import sqlalchemy
+
+from conflict_index import Booking
+
+
+STATUS_RANKS = {'pending': 0, 'approved': 1, 'denied': 2, 'admin': 3}
+
+
+@pytest.fixture
+def stored_requests(database, add_rental, renter_id):
+    """60 requests of the test renter in 2090-2091, several sharing a start, as dicts"""
+    rng = random.Random(7)
+    stored = []
+    with database.begin() as conn:
+        for _ in range(60):
+            day = date(2090, 1, 1) + timedelta(days=rng.randrange(0, 730, 7))
+            start_time = time(rng.choice((7, 18, 20)))
+            booking = Booking(None, None, 'pytest', day, day, start_time, time(start_time.hour, 45), False, None)
+            status = rng.choice(sorted(STATUS_RANKS))
+            amount = rng.choice((0, 0, 150, 225.5))
+            paid = amount > 0 and rng.random() < 0.4
+            request_id = add_rental(conn, booking, status, amount)
+            if paid:
+                conn.execute(sqlalchemy.text("UPDATE public.rental_request SET paid = true WHERE request_id = :id"),
+                             {"id": request_id})
+            stored.append({"request_id": request_id, "start_date": day, "start_time": start_time,
+                           "status": status, "amount": amount, "paid": paid})
+    assert len({(row['start_date'], row['start_time']) for row in stored}) < len(stored)
+    return stored
+
+
+def follow(client, url, limit, params=None):
+    """Every request_id of a listing, a page of `limit` at a time"""
+    params = dict(params or {}, limit=limit)
+    ids = []
+    while True:
+        response = client.get(url, query_string=params)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        assert len(body['requests']) <= limit
+        page = [row['request_id'] for row in body['requests']]
+        # A cursor that doesn't move past its row would page forever
+        assert not set(page) & set(ids)
+        ids += page
+        if not body['next_cursor']:
+            return ids
+        params['after'] = body['next_cursor']
+
+
+@pytest.mark.parametrize('status', (None, 'pending', 'approved,declined', 'admin'))
+def test_user_request_pages_match_the_unpaged_list(admin_client, renter_email, stored_requests, status):
+    url = f'/api/user_requests/{renter_email}'
+    params = {'status': status} if status else {}
+    response = admin_client.get(url, query_string=params)
+    assert response.status_code == 200
+    unpaged = [row['request_id'] for row in response.get_json()['requests']]
+
+    wanted = {'declined': 'denied'}
+    statuses = [wanted.get(name, name) for name in status.split(',')] if status else list(STATUS_RANKS)
+    expected = sorted((row for row in stored_requests if row['status'] in statuses),
+                      key=lambda row: (STATUS_RANKS[row['status']], row['start_date'], row['start_time'],
+                                       row['request_id']))
+    assert unpaged == [row['request_id'] for row in expected]
+
+    for limit in (1, 4, 7, 500):
+        assert follow(admin_client, url, limit, params) == unpaged
+
+
+def test_user_requests_of_an_unknown_user(admin_client, stored_requests):
+    assert admin_client.get('/api/user_requests/pytest-nobody').status_code == 404
+    assert admin_client.get('/api/user_requests/pytest-nobody?limit=5').status_code == 404
+
+
+ADMIN_FILTERS = (
+    ({}, lambda row: True),
+    ({'status': 'pending'}, lambda row: row['status'] == 'pending'),
+    ({'status': 'approved,declined'}, lambda row: row['status'] in ('approved', 'denied')),
+    ({'payment': 'paid'}, lambda row: row['paid']),
+    ({'payment': 'unpaid'}, lambda row: not row['paid'] and row['amount'] != 0),
+    ({'month': 3}, lambda row: row['start_date'].month == 3),
+    ({'year': 2091}, lambda row: row['start_date'].year == 2091),
+    ({'month': 12, 'year': 2090}, lambda row: (row['start_date'].year, row['start_date'].month) == (2090, 12)),
+    ({'status': 'approved', 'payment': 'unpaid', 'year': 2090},
+     lambda row: row['status'] == 'approved' and not row['paid'] and row['amount'] != 0
+     and row['start_date'].year == 2090),
+)
+
+
+@pytest.mark.parametrize('url, descending', (('/api/admin/requests', False), ('/api/admin/all-requests', True)))
+@pytest.mark.parametrize('filters, matches', ADMIN_FILTERS)
+def test_admin_pages_return_every_row_once(admin_client, renter_id, stored_requests, url, descending,
+                                           filters, matches):
+    # Scoped to the test renter, so rows other tests left don't count
+    params = dict(filters, user_id=renter_id)
+    expected = sorted((row for row in stored_requests if matches(row)),
+                      key=lambda row: (row['start_date'], row['start_time'], row['request_id']),
+                      reverse=descending)
+    assert expected
+
+    for limit in (1, 6, 500):
+        assert follow(admin_client, url, limit, params) == [row['request_id'] for row in expected]
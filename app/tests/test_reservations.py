@@ -0,0 +1,193 @@
+"""
+Any two bookings that can collide must share a slot_lock_buckets bucket, so
+their reservations are serialized, and a booking inserted after
+lock_and_find_conflicts must block the next reservation of its slot with
+every candidate fetch.
+
+The tests that use the `database` fixture need TEST_DATABASE_URL (see
+conftest.py) and are skipped without it.
+"""
+import random
+from datetime import date, time, timedelta
+
+import pytest
+import sqlalchemy
+
+import occurrences
+import sql_conflicts
+from conflict_index import Booking, bookings_conflict
+from reservations import fetch_overlapping, lock_and_find_conflicts, slot_lock_buckets
+from test_conflict_kernel import random_proposals
+
+
+MONDAY = date(2025, 3, 3)
+# Far enough ahead that real bookings don't get in the way
+FUTURE_MONDAY = date(2090, 1, 2)
+
+
+def proposal(start_date, end_date, start_time, end_time, rule=None):
+    return Booking(None, None, 'pytest', start_date, end_date, start_time, end_time, rule is not None, rule)
+
+
+def test_one_off_buckets():
+    booked = proposal(MONDAY, MONDAY, time(18, 0), time(19, 30))
+    assert slot_lock_buckets(booked) == [18, 19]
+
+    friday = proposal(MONDAY + timedelta(days=4), MONDAY + timedelta(days=4), time(6, 0), time(6, 45))
+    assert slot_lock_buckets(friday) == [4 * 24 + 6]
+
+
+def test_recurring_buckets_cover_every_weekday_it_falls_on():
+    weekly = proposal(MONDAY, MONDAY + timedelta(days=60), time(18, 0), time(19, 0), 'weekly')
+    assert slot_lock_buckets(weekly) == [18, 19]
+
+    # Friday to Sunday
+    weekend = proposal(MONDAY + timedelta(days=4), MONDAY + timedelta(days=6), time(9, 0), time(9, 30), 'daily')
+    assert slot_lock_buckets(weekend) == [4 * 24 + 9, 5 * 24 + 9, 6 * 24 + 9]
+
+    # A one-off booking over several days and an unknown rule (read as daily)
+    for booked in (proposal(MONDAY, MONDAY + timedelta(days=9), time(9, 0), time(9, 30)),
+                   proposal(MONDAY, MONDAY + timedelta(days=40), time(9, 0), time(9, 30), 'monthly')):
+        assert slot_lock_buckets(booked) == [weekday * 24 + 9 for weekday in range(7)]
+
+
+def test_late_windows_stay_in_the_day():
+    late = proposal(MONDAY, MONDAY, time(22, 30), time(23, 59))
+    assert slot_lock_buckets(late) == [22, 23]
+
+    sunday = proposal(MONDAY + timedelta(days=6), MONDAY + timedelta(days=6), time(23, 0), time(23, 45))
+    assert slot_lock_buckets(sunday) == [6 * 24 + 23]
+    assert max(slot_lock_buckets(sunday)) < 7 * 24
+
+
+@pytest.mark.parametrize('seed', (1, 2, 3))
+def test_colliding_proposals_share_a_bucket(seed):
+    rng = random.Random(seed)
+    proposals = random_proposals(rng, 200)
+    buckets = [set(slot_lock_buckets(p)) for p in proposals]
+
+    colliding = 0
+    for i, first in enumerate(proposals):
+        for j in range(i + 1, len(proposals)):
+            if bookings_conflict(first, proposals[j]):
+                colliding += 1
+                assert buckets[i] & buckets[j], (i, j)
+    assert colliding > 100
+
+
+def reserve(conn, add_rental, proposed, fetch):
+    """What submit_admin_request does: lock, check, INSERT and write the occurrences in one transaction"""
+    with conn.begin():
+        if lock_and_find_conflicts(conn, proposed, fetch):
+            return None
+        request_id = add_rental(conn, proposed)
+        occurrences.refresh_booking(conn, 'rental', request_id)
+        return request_id
+
+
+@pytest.mark.parametrize('fetch', (fetch_overlapping, sql_conflicts.fetch_candidates,
+                                   occurrences.fetch_candidates),
+                         ids=('overlap', 'sql', 'occurrences'))
+def test_reservation_blocks_the_next_one(database, add_rental, fetch):
+    practice = proposal(FUTURE_MONDAY, FUTURE_MONDAY + timedelta(days=56), time(18, 0), time(19, 0), 'weekly')
+
+    with database.connect() as conn:
+        request_id = reserve(conn, add_rental, practice, fetch)
+        assert request_id is not None
+
+        # The same slot, and a one-off on the practice's third Monday
+        assert reserve(conn, add_rental, practice, fetch) is None
+        third = FUTURE_MONDAY + timedelta(days=14)
+        assert reserve(conn, add_rental, proposal(third, third, time(18, 30), time(20, 0)), fetch) is None
+
+        with conn.begin():
+            conflicts = lock_and_find_conflicts(conn, practice, fetch)
+        assert [(booking.key, day) for booking, day in conflicts] == [(('rental', request_id), FUTURE_MONDAY)]
+
+        # The Tuesday after, and the same Monday an hour later, are free
+        tuesday = FUTURE_MONDAY + timedelta(days=1)
+        assert reserve(conn, add_rental, proposal(tuesday, tuesday, time(18, 0), time(19, 0)), fetch) is not None
+        assert reserve(conn, add_rental, proposal(third, third, time(19, 1), time(20, 0)), fetch) is not None
+
+
+def test_submitted_booking_blocks_as_soon_as_it_commits(database, renter_email, monkeypatch):
+    import main
+    from token_cache import VerifiedTokenCache
+
+    monkeypatch.setattr(main, 'pool', database)
+    monkeypatch.setattr(main, 'CONFLICT_ENGINE', 'occurrences')
+    monkeypatch.setattr(main, 'USE_OCCURRENCE_TABLE', True)
+    monkeypatch.setattr(main, 'conflict_engine', occurrences.OccurrenceConflictEngine(database))
+    monkeypatch.setattr(main, 'token_cache', VerifiedTokenCache(max_entries=8, admin_ttl=60))
+    monkeypatch.setattr(main, 'verify_id_token', lambda token: {'uid': 'pytest', 'email': 'admin@localhost'})
+    monkeypatch.setattr(main, 'lookup_admin', lambda email: True)
+    monkeypatch.setattr(main, 'queue_email', lambda *args, **kwargs: None)
+
+    day = FUTURE_MONDAY + timedelta(days=21)
+    slot = proposal(day, day, time(7, 0), time(8, 0))
+
+    # Another submit for the same slot that gets the locks the moment the
+    # first one commits, before anything else runs
+    seen = []
+    booking_changed = main.booking_changed
+
+    def racing_booking_changed(conn, source, booking_id, **kwargs):
+        with database.connect() as other:
+            with other.begin():
+                seen.append(main.reserve_slot(other, slot))
+        return booking_changed(conn, source, booking_id, **kwargs)
+
+    monkeypatch.setattr(main, 'booking_changed', racing_booking_changed)
+
+    # As the request form sends it
+    form = {
+        'firebase_uid': 'pytest',
+        'user_email': renter_email,
+        'rental_name': 'pytest',
+        'start_date': day.strftime('%m/%d/%Y'),
+        'end_date': day.strftime('%m/%d/%Y'),
+        'start_time': '7:00 AM',
+        'end_time': '8:00 AM',
+        'is_recurring': False,
+        'amount': 0
+    }
+    client = main.app.test_client()
+    client.set_cookie('localhost', 'token', 'pytest')
+    response = client.post('/api/submit_admin_request', json=form)
+    assert response.status_code == 200, response.get_json()
+    assert seen == [False]
+
+
+@pytest.mark.parametrize('engine', ('index', 'sql', 'occurrences'))
+def test_overlapping_pending_requests_cannot_both_be_approved(database, add_rental, admin_client, monkeypatch,
+                                                              engine):
+    import main
+
+    monkeypatch.setattr(main, 'CONFLICT_ENGINE', engine)
+    monkeypatch.setattr(main, 'USE_OCCURRENCE_TABLE', engine == 'occurrences')
+    monkeypatch.setattr(main, 'conflict_engine', occurrences.OccurrenceConflictEngine(database))
+
+    day = FUTURE_MONDAY + timedelta(days=28)
+    with database.begin() as conn:
+        first, second = [add_rental(conn, proposal(day, day, start_time, time(19, 0)), 'pending')
+                         for start_time in (time(17, 0), time(18, 0))]
+        # Pending requests have occurrence rows too, which must not block
+        for request_id in (first, second):
+            occurrences.refresh_booking(conn, 'rental', request_id)
+
+    def approve(request_id):
+        return admin_client.post(f'/api/admin/approve_request/{request_id}', json={'amount': 100})
+
+    assert approve(first).status_code == 200
+    assert approve(second).status_code == 409
+    # Approving it again (e.g. with another amount) doesn't collide with itself
+    assert approve(first).status_code == 200
+    response = admin_client.post(f'/api/admin/update-request/{second}', json={'status': 'admin'})
+    assert response.status_code == 409
+    assert approve(0).status_code == 404
+
+    with database.connect() as conn:
+        statuses = dict(conn.execute(sqlalchemy.text("""
+            SELECT request_id, rental_status FROM public.rental_request WHERE request_id IN (:first, :second)
+        """), {"first": first, "second": second}).fetchall())
+    assert statuses == {first: 'approved', second: 'pending'}
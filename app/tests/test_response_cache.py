@@ -0,0 +1,79 @@
+"""
+ScheduleVersion: the memoized schedule version behind the /api/events cache
+keys and the ETags.
+"""
+import pytest
+
+from response_cache import ScheduleVersion
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingRead:
+    """Returns "v1", "v2", ... and counts the calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"v{self.calls}"
+
+
+def test_reused_within_ttl():
+    clock, read = FakeClock(), CountingRead()
+    versions = ScheduleVersion(read, ttl=2, clock=clock)
+    assert versions.get() == 'v1'
+    clock.now += 1.9
+    assert versions.get() == 'v1'
+    assert read.calls == 1
+
+    clock.now += 0.2
+    assert versions.get() == 'v2'
+    assert read.calls == 2
+
+
+def test_forget_reads_again():
+    clock, read = FakeClock(), CountingRead()
+    versions = ScheduleVersion(read, ttl=2, clock=clock)
+    versions.get()
+    versions.forget()
+    assert versions.get() == 'v2'
+    assert versions.get() == 'v2'
+
+
+def test_read_started_before_forget_is_not_kept():
+    clock = FakeClock()
+    versions = None
+
+    def read():
+        # A write lands while this read is in flight
+        versions.forget()
+        return 'before-write'
+
+    versions = ScheduleVersion(read, ttl=2, clock=clock)
+    assert versions.get() == 'before-write'
+    versions.read = lambda: 'after-write'
+    assert versions.get() == 'after-write'
+
+
+def test_failed_read_keeps_last_version():
+    clock, read = FakeClock(), CountingRead()
+    versions = ScheduleVersion(read, ttl=2, clock=clock)
+    assert versions.last() is None
+    versions.get()
+
+    def fail():
+        raise OSError("database unreachable")
+
+    versions.read = fail
+    clock.now += 3
+    with pytest.raises(OSError):
+        versions.get()
+    assert versions.last() == 'v1'
@@ -0,0 +1,102 @@
+"""
+ScheduleHub fan-out: who sees which rows, replay after a reconnect, the
+reset event when a subscriber can't be caught up, and the subscriber cap.
+"""
+from schedule_hub import ScheduleHub
+
+
+def received(subscription):
+    """The (name, data) pairs waiting in a subscription's queue"""
+    events = []
+    while not subscription.events.empty():
+        event = subscription.events.get_nowait()
+        events.append((event['name'], event['data']))
+    return events
+
+
+def streamed_ids(hub, subscription):
+    """The SSE ids a subscription's stream sends (it ends after a moment)"""
+    text = ''.join(hub.stream(subscription, 0.05))
+    return [line[len('id: '):] for line in text.splitlines() if line.startswith('id: ')]
+
+
+def publish_bookings(hub, ids):
+    for booking_id in ids:
+        hub.publish('booking', {"id": booking_id}, owner=1, public=True)
+
+
+def test_renters_see_public_bookings_and_their_own():
+    hub = ScheduleHub()
+    owner = hub.subscribe(renter_id=5, is_admin=False)
+    other = hub.subscribe(renter_id=6, is_admin=False)
+    anonymous = hub.subscribe(renter_id=None, is_admin=False)
+
+    hub.publish('booking', {"id": 1, "name": "Practice"}, owner=7, public=True)
+    hub.publish('booking', {"id": 2, "amount": 150}, owner=5, public_data={"id": 2})
+    hub.publish('payment', {"request_ids": [3], "paid": True}, owner=5)
+
+    assert received(owner) == [('booking', {"id": 1, "name": "Practice"}),
+                               ('booking', {"id": 2, "amount": 150}),
+                               ('payment', {"request_ids": [3], "paid": True})]
+    # Someone else's private row only as its public_data, and not at all without one
+    for subscription in (other, anonymous):
+        assert received(subscription) == [('booking', {"id": 1, "name": "Practice"}),
+                                          ('booking', {"id": 2})]
+
+
+def test_admins_see_full_rows():
+    hub = ScheduleHub()
+    admin = hub.subscribe(renter_id=None, is_admin=True)
+    hub.publish('booking', {"id": 2, "amount": 150}, owner=5, public_data={"id": 2})
+    hub.publish('payment', {"request_ids": [3], "paid": True}, owner=5)
+    assert received(admin) == [('booking', {"id": 2, "amount": 150}),
+                               ('payment', {"request_ids": [3], "paid": True})]
+
+
+def test_reconnect_replays_what_was_missed():
+    hub = ScheduleHub()
+    first = hub.subscribe(renter_id=None, is_admin=True)
+    publish_bookings(hub, [1, 2])
+    last_event_id = streamed_ids(hub, first)[-1]
+
+    # Missed while disconnected
+    publish_bookings(hub, [3, 4])
+    again = hub.subscribe(renter_id=None, is_admin=True, last_event_id=last_event_id)
+    assert received(again) == [('booking', {"id": 3}), ('booking', {"id": 4})]
+
+
+def test_reset_when_history_no_longer_has_the_last_event():
+    hub = ScheduleHub(history=3)
+    first = hub.subscribe(renter_id=None, is_admin=True)
+    publish_bookings(hub, [1])
+    last_event_id = streamed_ids(hub, first)[-1]
+
+    publish_bookings(hub, range(2, 8))
+    again = hub.subscribe(renter_id=None, is_admin=True, last_event_id=last_event_id)
+    assert received(again) == [('reset', {})]
+
+    # An id from before a restart, or not one of ours
+    for last_event_id in ('0123abcd:7', 'garbage'):
+        assert received(hub.subscribe(renter_id=None, is_admin=True, last_event_id=last_event_id)) == \
+            [('reset', {})]
+
+
+def test_reset_when_a_subscriber_falls_behind():
+    hub = ScheduleHub(queue_size=3)
+    slow = hub.subscribe(renter_id=None, is_admin=True)
+    publish_bookings(hub, [1, 2, 3, 4])
+    assert received(slow) == [('reset', {})]
+
+    # It is caught up again once it has reloaded
+    publish_bookings(hub, [5])
+    assert received(slow) == [('booking', {"id": 5})]
+
+
+def test_subscribers_are_capped():
+    hub = ScheduleHub(max_subscribers=2)
+    first = hub.subscribe(renter_id=1, is_admin=False)
+    assert hub.subscribe(renter_id=2, is_admin=False) is not None
+    assert hub.subscribe(renter_id=3, is_admin=False) is None
+
+    hub.unsubscribe(first)
+    assert hub.subscribe(renter_id=3, is_admin=False) is not None
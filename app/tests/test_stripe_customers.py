@@ -0,0 +1,118 @@
+"""
+CustomerIdCache resolves each renter's customer once at a time, even after a
+failed resolve; match_customers pairs renters with existing customers for the
+backfill; customer_idempotency_key changes with what is being created.
+"""
+import threading
+import time
+
+from stripe_customers import CustomerIdCache, customer_idempotency_key, match_customers
+
+
+def customer(customer_id, email=None, created=0, user_id=None):
+    return {"id": customer_id, "email": email, "created": created, "metadata": {"user_id": user_id}}
+
+
+def test_cached_customer_is_not_resolved_again():
+    cache = CustomerIdCache(max_entries=2)
+    calls = []
+
+    def resolve(renter_id):
+        calls.append(renter_id)
+        return f"cus_{renter_id}"
+
+    assert [cache.get(renter_id, resolve) for renter_id in (1, 1, 2, 3, 1)] == \
+        ['cus_1', 'cus_1', 'cus_2', 'cus_3', 'cus_1']
+    # 1 was the least recently used when 3 came in
+    assert calls == [1, 2, 3, 1]
+
+    cache.forget(1)
+    cache.prime({2: 'cus_primed', 4: None})
+    assert cache.get(1, resolve) == 'cus_1'
+    assert cache.get(2, resolve) == 'cus_primed'
+    assert calls == [1, 2, 3, 1, 1]
+
+
+def test_renter_is_resolved_once_at_a_time_after_a_failure():
+    cache = CustomerIdCache()
+    inside = {"now": 0, "most": 0}
+    calls = []
+    release = [threading.Event(), threading.Event()]
+    entered = [threading.Event(), threading.Event()]
+    counter = threading.Lock()
+
+    def resolve(renter_id):
+        with counter:
+            call = len(calls)
+            calls.append(call)
+            inside["now"] += 1
+            inside["most"] = max(inside["most"], inside["now"])
+        try:
+            if call < 2:
+                entered[call].set()
+                release[call].wait(5)
+            if call == 0:
+                raise ConnectionError("Stripe unavailable")
+            return f"cus_{call}"
+        finally:
+            with counter:
+                inside["now"] -= 1
+
+    results = {}
+
+    def get(name):
+        try:
+            results[name] = cache.get(7, resolve)
+        except ConnectionError:
+            results[name] = 'failed'
+
+    threads = {name: threading.Thread(target=get, args=(name,)) for name in 'abc'}
+    threads['a'].start()
+    assert entered[0].wait(5)
+    # b waits for a's lock, then retries once a has failed
+    threads['b'].start()
+    time.sleep(0.05)
+    release[0].set()
+    assert entered[1].wait(5)
+    # c arrives while b is resolving and must wait for it
+    threads['c'].start()
+    time.sleep(0.05)
+    release[1].set()
+    for thread in threads.values():
+        thread.join(5)
+
+    assert results == {'a': 'failed', 'b': 'cus_1', 'c': 'cus_1'}
+    assert inside["most"] == 1
+    assert len(calls) == 2
+    assert cache._resolving == {}
+
+
+def test_tagged_customer_wins():
+    renters = [{"renter_id": 1, "email": "Ann@Example.com "}]
+    customers = [customer('cus_email', 'ann@example.com', created=300),
+                 customer('cus_tagged', 'old@example.com', created=100, user_id='1')]
+    assert match_customers(renters, customers) == {1: 'cus_tagged'}
+
+
+def test_newest_customer_with_the_email_otherwise():
+    renters = [{"renter_id": 1, "email": "ann@example.com"}, {"renter_id": 2, "email": "bob@example.com"},
+               {"renter_id": 3, "email": None}]
+    customers = [customer('cus_new', ' ANN@example.com', created=300),
+                 customer('cus_old', 'ann@example.com', created=100),
+                 # Tagged for another user, so not bob's even with the same email
+                 customer('cus_other', 'bob@example.com', created=500, user_id='9')]
+    assert match_customers(renters, customers) == {1: 'cus_new'}
+
+
+def test_customer_key_follows_what_is_created():
+    key = customer_idempotency_key(1, 'ann@example.com', 'Ann')
+    assert key == customer_idempotency_key(1, 'ann@example.com', 'Ann')
+    assert key.startswith('renter-1-customer-')
+    others = {customer_idempotency_key(2, 'ann@example.com', 'Ann'),
+              customer_idempotency_key(1, 'ann@new.example.com', 'Ann'),
+              customer_idempotency_key(1, 'ann@example.com', 'Ann B'),
+              customer_idempotency_key(1, 'ann@example.com', 'Ann', replacing='cus_gone')}
+    assert key not in others and len(others) == 4
+    assert customer_idempotency_key(1, 'ann@example.com', 'Ann', replacing='cus_gone').endswith('-cus_gone')
+    # Stripe allows keys of up to 255 characters
+    assert len(customer_idempotency_key(10 ** 9, 'x' * 255, 'y' * 255, replacing='cus_' + 'z' * 24)) <= 255
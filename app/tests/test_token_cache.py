@@ -0,0 +1,127 @@
+"""
+VerifiedTokenCache with a fake verify_fn and lookup_fn and a clock the tests
+move by hand.
+"""
+import pytest
+
+import token_cache
+from token_cache import VerifiedTokenCache
+
+
+class Clock:
+    """Stands in for the time module in token_cache"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class Verifier:
+    """verify_fn that counts its calls and gives every token `lifetime` seconds from `clock`"""
+
+    def __init__(self, clock, lifetime=3600):
+        self.clock = clock
+        self.lifetime = lifetime
+        self.calls = []
+
+    def __call__(self, token):
+        self.calls.append(token)
+        if token == 'bad':
+            raise ValueError("Invalid token")
+        return {'uid': token, 'exp': self.clock.now + self.lifetime}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_cache, 'time', clock)
+    return clock
+
+
+def test_claims_are_reused_until_the_token_expires(clock):
+    cache = VerifiedTokenCache()
+    verify = Verifier(clock, lifetime=600)
+
+    claims = cache.verify('alice', verify)
+    clock.now += 599
+    assert cache.verify('alice', verify) is claims
+    assert verify.calls == ['alice']
+
+    clock.now += 1
+    assert cache.verify('alice', verify) is not claims
+    assert verify.calls == ['alice', 'alice']
+
+
+def test_claims_already_expired_are_not_cached(clock):
+    cache = VerifiedTokenCache()
+    verify = Verifier(clock, lifetime=0)
+    cache.verify('alice', verify)
+    cache.verify('alice', verify)
+    assert verify.calls == ['alice', 'alice']
+
+
+def test_least_recently_used_tokens_are_dropped(clock):
+    cache = VerifiedTokenCache(max_entries=2)
+    verify = Verifier(clock)
+
+    cache.verify('alice', verify)
+    cache.verify('bob', verify)
+    cache.verify('alice', verify)
+    # carol pushes out bob, used longer ago than alice
+    cache.verify('carol', verify)
+    cache.verify('alice', verify)
+    cache.verify('bob', verify)
+    assert verify.calls == ['alice', 'bob', 'carol', 'bob']
+
+
+def test_verify_errors_are_not_cached(clock):
+    cache = VerifiedTokenCache()
+    verify = Verifier(clock)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.verify('bad', verify)
+    assert verify.calls == ['bad', 'bad']
+
+
+def test_admin_lookup_expires_after_admin_ttl(clock):
+    cache = VerifiedTokenCache(admin_ttl=60)
+    admins = {'admin@localhost'}
+    lookups = []
+
+    def lookup(email):
+        lookups.append(email)
+        return email in admins
+
+    assert cache.is_admin('admin@localhost', lookup)
+    assert not cache.is_admin('renter@localhost', lookup)
+    admins.clear()
+    clock.now += 59
+    assert cache.is_admin('admin@localhost', lookup)
+    assert len(lookups) == 2
+
+    clock.now += 1
+    assert not cache.is_admin('admin@localhost', lookup)
+    assert len(lookups) == 3
+
+
+def test_flush_forgets_tokens_and_admins(clock):
+    cache = VerifiedTokenCache()
+    verify = Verifier(clock)
+    lookups = []
+
+    def lookup(email):
+        lookups.append(email)
+        return True
+
+    cache.verify('alice', verify)
+    cache.is_admin('admin@localhost', lookup)
+    cache.flush()
+    cache.verify('alice', verify)
+    cache.is_admin('admin@localhost', lookup)
+    assert verify.calls == ['alice', 'alice']
+    assert lookups == ['admin@localhost', 'admin@localhost']
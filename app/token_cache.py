@@ -0,0 +1,74 @@
+"""
+Cache of verified Firebase ID tokens and admin membership for the auth decorators.
+
+auth.verify_id_token checks an RS256 signature on every call and require_admin
+then asks public.admin whether the email is an administrator. An admin page
+fires several API calls with the same token back to back, so:
+    - decoded claims are kept, keyed by a hash of the token (the raw token is
+      never stored), until the token's own `exp`, in a bounded LRU
+    - admin membership per email is kept for `admin_ttl` seconds
+flush() drops both; call it whenever public.admin changes.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """Thread-safe LRU of token hash -> claims plus a TTL cache of email -> is_admin"""
+
+    def __init__(self, max_entries=1024, admin_ttl=60):
+        self.max_entries = max_entries
+        self.admin_ttl = admin_ttl
+        self._claims = OrderedDict()
+        self._admins = {}
+        self._lock = threading.Lock()
+
+    def _key(self, token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def verify(self, token, verify_fn):
+        """
+        Claims for `token`, from the cache or by calling verify_fn(token). Errors
+        from verify_fn (expired, invalid) propagate and nothing is cached.
+        """
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            claims = self._claims.get(key)
+            if claims is not None:
+                if claims.get('exp', 0) > now:
+                    self._claims.move_to_end(key)
+                    return claims
+                del self._claims[key]
+
+        claims = verify_fn(token)
+        if claims.get('exp', 0) > now:
+            with self._lock:
+                self._claims[key] = claims
+                self._claims.move_to_end(key)
+                while len(self._claims) > self.max_entries:
+                    self._claims.popitem(last=False)
+        return claims
+
+    def is_admin(self, email, lookup_fn):
+        """Whether `email` is an admin, from the cache or by calling lookup_fn(email)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._admins.get(email)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        is_admin = bool(lookup_fn(email))
+        with self._lock:
+            if len(self._admins) >= self.max_entries:
+                self._admins.clear()
+            self._admins[email] = (now + self.admin_ttl, is_admin)
+        return is_admin
+
+    def flush(self):
+        """Forget every cached token and admin lookup"""
+        with self._lock:
+            self._claims.clear()
+            self._admins.clear()